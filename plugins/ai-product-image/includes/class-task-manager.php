@@ -25,7 +25,7 @@ class AI_Product_Image_Task_Manager {
     }
 
     /**
-     * Получить список всех задач
+     * Получить список задач в очереди (ожидающие и захваченные обработчиком)
      * @return array
      */
     public function get_tasks() {
@@ -33,16 +33,74 @@ class AI_Product_Image_Task_Manager {
         if ( ! is_dir( $this->tasks_dir ) ) {
             return $tasks;
         }
-        foreach ( glob( $this->tasks_dir . '*.json' ) as $file ) {
-            $json = file_get_contents( $file );
-            $data = json_decode( $json, true );
-            if ( $data ) {
-                $tasks[] = $data;
+        $states = [
+            'pending' => $this->tasks_dir,
+            'processing' => $this->tasks_dir . 'processing/',
+        ];
+        foreach ( $states as $state => $dir ) {
+            foreach ( glob( $dir . '*.json' ) ?: [] as $file ) {
+                $json = @file_get_contents( $file );
+                $data = $json ? json_decode( $json, true ) : null;
+                if ( $data ) {
+                    $data['queue_state'] = $state;
+                    $tasks[] = $data;
+                }
             }
         }
+        return array_merge( $tasks, $this->get_queue_db_tasks() );
+    }
+
+    /**
+     * Задачи из очереди SQLite (queue_backend: sqlite в config.yaml обработчика).
+     * Выборка идёт по индексу (status, priority, created_at), без чтения всей очереди.
+     * @param int $limit
+     * @return array
+     */
+    public function get_queue_db_tasks( $limit = 500 ) {
+        $db_file = dirname( $this->tasks_dir ) . '/queue.db';
+        if ( ! file_exists( $db_file ) || ! class_exists( 'PDO' ) || ! in_array( 'sqlite', PDO::getAvailableDrivers(), true ) ) {
+            return [];
+        }
+        $tasks = [];
+        try {
+            $db = new PDO( 'sqlite:' . $db_file, null, null, [ PDO::ATTR_ERRMODE => PDO::ERRMODE_EXCEPTION ] );
+            $db->exec( 'PRAGMA busy_timeout = 5000' );
+            foreach ( [ 'processing', 'pending' ] as $state ) {
+                $stmt = $db->prepare( 'SELECT payload, attempts FROM tasks WHERE status = ? ORDER BY priority DESC, created_at LIMIT ?' );
+                $stmt->bindValue( 1, $state );
+                $stmt->bindValue( 2, intval( $limit ), PDO::PARAM_INT );
+                $stmt->execute();
+                foreach ( $stmt->fetchAll( PDO::FETCH_ASSOC ) as $row ) {
+                    $data = json_decode( $row['payload'], true );
+                    if ( $data ) {
+                        $data['queue_state'] = $state;
+                        $data['attempts'] = intval( $row['attempts'] );
+                        $tasks[] = $data;
+                    }
+                }
+            }
+        } catch ( Exception $e ) {
+            error_log( 'AI Product Image: ошибка чтения очереди SQLite: ' . $e->getMessage() );
+        }
         return $tasks;
     }
 
+    /**
+     * Записать файл задачи атомарно: обработчик не должен захватить недописанный JSON
+     * @param string $task_id
+     * @param array $task
+     * @return bool
+     */
+    private function write_task_file( $task_id, $task ) {
+        $file = $this->tasks_dir . $task_id . '.json';
+        $tmp = $file . '.tmp';
+        $json = json_encode( $task, JSON_UNESCAPED_UNICODE | JSON_PRETTY_PRINT );
+        if ( file_put_contents( $tmp, $json ) === false ) {
+            return false;
+        }
+        return rename( $tmp, $file );
+    }
+
     /**
      * Создать новое задание
      * @param array $task_data
@@ -59,9 +117,7 @@ class AI_Product_Image_Task_Manager {
             $new_name = $task_id . '.' . $ext;
             $this->backup_original_image($task_data['original_image_path'], $new_name);
         }
-        $file = $this->tasks_dir . $task_id . '.json';
-        $json = json_encode( $task_data, JSON_UNESCAPED_UNICODE | JSON_PRETTY_PRINT );
-        return file_put_contents( $file, $json ) !== false;
+        return $this->write_task_file( $task_id, $task_data );
     }
 
     /**
@@ -189,9 +245,7 @@ class AI_Product_Image_Task_Manager {
         // Копируем оригинал в originals/
         $this->backup_original_image($image_path, basename($image_path));
         // Сохраняем задачу в tasks/
-        $file = $this->tasks_dir . $task_id . '.json';
-        $json = json_encode($task, JSON_UNESCAPED_UNICODE | JSON_PRETTY_PRINT);
-        return file_put_contents($file, $json) !== false;
+        return $this->write_task_file($task_id, $task);
     }
 
     /**
@@ -202,22 +256,83 @@ class AI_Product_Image_Task_Manager {
         $count = 0;
         $upload_dir = wp_upload_dir();
         $results_dir = trailingslashit( $upload_dir['basedir'] ) . 'ai_image/results/';
+        $journal_count = $this->process_results_journal($results_dir . 'journal.db');
+        if ($journal_count !== null) {
+            return $journal_count;
+        }
         foreach (glob($results_dir . '*.json') as $file) {
             $json = file_get_contents($file);
             $data = json_decode($json, true);
             if (!$data || $data['status'] !== 'success') continue;
-            // task_id вида 20240610_12345_6789, где 12345 — ID товара
-            if (preg_match('/_(\d+)$/', $data['task_id'], $m)) {
-                $product_id = intval($m[1]);
-                if ($product_id && get_post_type($product_id) === 'product') {
-                    update_post_meta($product_id, '_ai_image_processed', $data['task_id']);
-                    $count++;
-                }
+            if ($this->mark_product_processed($data['task_id'])) {
+                $count++;
+            }
+        }
+        return $count;
+    }
+
+    /**
+     * Обработать только новые записи журнала результатов (после сохранённого курсора)
+     * @param string $db_file Путь к results/journal.db
+     * @param int $batch Записей за один запрос
+     * @return int|null Количество обновлённых товаров или null, если журнал недоступен
+     */
+    public function process_results_journal( $db_file, $batch = 1000 ) {
+        if ( ! file_exists( $db_file ) || ! class_exists( 'PDO' ) || ! in_array( 'sqlite', PDO::getAvailableDrivers(), true ) ) {
+            return null;
+        }
+        $count = 0;
+        $cursor = intval( get_option( 'ai_image_results_cursor', 0 ) );
+        try {
+            $db = new PDO( 'sqlite:' . $db_file, null, null, [ PDO::ATTR_ERRMODE => PDO::ERRMODE_EXCEPTION ] );
+            $db->exec( 'PRAGMA busy_timeout = 5000' );
+            // Журнал создан заново (seq начались с начала) — читаем его целиком
+            $last_seq = intval( $db->query( "SELECT seq FROM sqlite_sequence WHERE name = 'results'" )->fetchColumn() );
+            if ( $cursor > $last_seq ) {
+                $cursor = 0;
             }
+            $stmt = $db->prepare( 'SELECT seq, record FROM results WHERE seq > ? ORDER BY seq LIMIT ?' );
+            do {
+                $stmt->bindValue( 1, $cursor, PDO::PARAM_INT );
+                $stmt->bindValue( 2, intval( $batch ), PDO::PARAM_INT );
+                $stmt->execute();
+                $rows = $stmt->fetchAll( PDO::FETCH_ASSOC );
+                foreach ( $rows as $row ) {
+                    $cursor = intval( $row['seq'] );
+                    $data = json_decode( $row['record'], true );
+                    if ( $data && $data['status'] === 'success' && $this->mark_product_processed( $data['task_id'] ) ) {
+                        $count++;
+                    }
+                }
+            } while ( count( $rows ) === intval( $batch ) );
+            update_option( 'ai_image_results_cursor', $cursor, false );
+            // Курсор в журнале: обработчик не удалит при сжатии ещё не прочитанные записи
+            $ack = $db->prepare( 'INSERT INTO cursors (consumer, seq, updated_at) VALUES (?, ?, ?) ON CONFLICT (consumer) DO UPDATE SET seq = MAX(cursors.seq, excluded.seq), updated_at = excluded.updated_at' );
+            $ack->execute( [ 'wordpress', $cursor, time() ] );
+        } catch ( Exception $e ) {
+            error_log( 'AI Product Image: ошибка чтения журнала результатов: ' . $e->getMessage() );
+            update_option( 'ai_image_results_cursor', $cursor, false );
         }
         return $count;
     }
 
+    /**
+     * Записать _ai_image_processed товару, ID которого закодирован в task_id
+     * @param string $task_id
+     * @return bool
+     */
+    private function mark_product_processed( $task_id ) {
+        // task_id вида 20240610_12345_6789, где 12345 — ID товара
+        if (preg_match('/_(\d+)$/', $task_id, $m)) {
+            $product_id = intval($m[1]);
+            if ($product_id && get_post_type($product_id) === 'product') {
+                update_post_meta($product_id, '_ai_image_processed', $task_id);
+                return true;
+            }
+        }
+        return false;
+    }
+
     public static function resolve_font_path($val) {
         if (is_numeric($val)) {
             $url = wp_get_attachment_url($val);
@@ -5,7 +5,7 @@ from pathlib import Path
 import yaml
 from jsonschema import validate, ValidationError
 from rembg import remove
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
 import cv2
 import numpy as np
 import sys
@@ -17,6 +17,14 @@ import io
 import requests
 import importlib.util
 import base64
+from model_registry import get_registry
+from segmentation import Segmentation, logo_inpaint_mask, resolve_logo_mask
+from layout import compile_layout, index_box_layout, draw_tire, downsample_text_layer
+import postprocess
+from task_queue import PermanentTaskError, should_retry
+import time
+import signal
+from functools import lru_cache
 
 # --- Явная проверка Python 3.9 и активация venv39 (только для Windows) ---
 if not (sys.version_info.major == 3 and sys.version_info.minor == 9):
@@ -36,6 +44,13 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--config', type=str, default='config.yaml', help='Путь к config.yaml')
 parser.add_argument('--task', type=str, help='Путь к задаче (JSON)')
 parser.add_argument('--debug', action='store_true', help='Включить подробное логирование и сохранение промежуточных изображений')
+parser.add_argument('--daemon', action='store_true', help='Постоянный режим: модели загружаются один раз, новые задачи обрабатываются по мере появления')
+parser.add_argument('--workers', type=int, default=1, help='Число процессов-воркеров для --daemon и пакетного режима (веса моделей загружаются до fork и общие для всех)')
+parser.add_argument('--poll-interval', type=float, default=None, help='Интервал опроса папки задач в режиме --daemon (секунды)')
+parser.add_argument('--retemplate', type=str, default=None, help='Перерисовать готовые задачи из кэша вырезок: all или task_id через запятую')
+parser.add_argument('--template', type=str, default=None, help='Новый шаблон для --retemplate (файл в templates_dir)')
+parser.add_argument('--params', type=str, default=None, help='JSON с новыми params для --retemplate (цвета, шрифты, размеры)')
+parser.add_argument('--compute-missing', action='store_true', help='--retemplate: для задач без вырезки в кэше запускать полную обработку')
 args, unknown = parser.parse_known_args()
 
 CONFIG_PATH = Path(args.config)
@@ -54,6 +69,7 @@ PROCESSED_DIR = (PROJECT_ROOT / config['processed_dir']).resolve()
 TEMPLATES_DIR = (PROJECT_ROOT / config['templates_dir']).resolve()
 LOGOS_DIR = (PROJECT_ROOT / config['logos_dir']).resolve()
 BATCH_SIZE = config.get('batch_size', 10)
+DAEMON_POLL_INTERVAL = args.poll_interval or config.get('daemon_poll_interval', 2.0)
 
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
 PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
@@ -73,32 +89,6 @@ TASK_SCHEMA = {
     "required": ["task_id", "product_data", "original_image", "template", "icon", "output_filename"]
 }
 
-# --- КОНСТАНТЫ ДЛЯ КОМПОНОВКИ ---
-COEFF = {
-    'brand_font': 0.103,
-    'brand_y': 0.058,
-    'model_font': 0.052,
-    'model_y': 0.156,
-    'specs_main_font': 0.083,
-    'specs_rim_font': 0.083,
-    'specs_x': 0.5,
-    'specs_y': 0.213,
-    'specs_main_w': 0.5596,
-    'specs_main_h': 0.0859,
-	'main_text_x': 0.0505,
-    'main_text_y': 0.279,
-    'index_box_w': 0.1951,
-    'index_box_h': 0.1295,
-    'season_font': 0.0419,
-    'season_x': 0.0639,
-    'season_y': 0.7966,
-    'season_y2': 0.8329,
-    'tire_w': 0.5677,
-    'tire_h': 0.6392,
-    'tire_x': 0.3725,
-    'tire_y': 0.3087,
-}
-
 # --- Альтернативный режим восстановления шины под логотипом ---
 ALT_TIRE_INPAINT = True  # Включить альтернативный inpaint только по шине
 
@@ -113,10 +103,15 @@ def validate_task_json(task):
 def get_font(size, font_path):
     """
     Получить объект ImageFont. Если font_path невалиден — fallback на системный шрифт или дефолтный.
+    Объекты шрифтов кэшируются по (путь, размер): файл читается FreeType один раз на процесс.
     :param size: размер шрифта
     :param font_path: путь к ttf-файлу
     :return: ImageFont
     """
+    return _load_font(int(size), str(font_path) if font_path else None)
+
+@lru_cache(maxsize=128)
+def _load_font(size, font_path):
     from PIL import ImageFont
     import os
     import sys
@@ -137,53 +132,66 @@ def get_font(size, font_path):
         logger.warning(f"Ошибка загрузки системного шрифта: {e}. Используется ImageFont.load_default().")
         return ImageFont.load_default()
 
+_text_sprites = None
+
+def get_text_sprites():
+    global _text_sprites
+    if _text_sprites is None:
+        from render_cache import TextSprites
+        _text_sprites = TextSprites(max_mb=config.get('text_sprite_cache_mb', 64))
+    return _text_sprites
+
+def draw_text(draw, xy, text, font, fill, anchor):
+    """
+    draw.text через кэш растров: бренды, сезоны, диаметры повторяются у тысяч товаров,
+    поэтому маска текста растеризуется один раз и дальше только закрашивается цветом fill.
+    """
+    sprite = get_text_sprites().get(text, font, anchor)
+    if sprite is None:
+        draw.text(xy, text, font=font, fill=fill, anchor=anchor)
+        return
+    mask, (dx, dy) = sprite
+    draw.bitmap((xy[0] + dx, xy[1] + dy), mask, fill=fill)
+
+def text_block_size(font, text):
+    bbox = font.getbbox(text) if hasattr(font, 'getbbox') else (0, 0, *font.getmask(text).size)
+    return bbox[2] - bbox[0], bbox[3] - bbox[1]
+
 # ---- ФУНКЦИИ РИСОВКИ ПО МАКЕТУ ----
+# Координаты и размеры шрифтов — из compile_layout (layout.py), один раз на (ширина, высота).
 def draw_brand(draw, text, width, height, font_path_bold, WHITE, debug_logging=False):
-    font_size = int(width * COEFF['brand_font'])
+    layout = compile_layout(width, height)['brand']
+    font_size = layout['font_size']
     font = get_font(font_size, font_path_bold)
-    x = width // 2
-    y = int(height * COEFF['brand_y'])
-    bbox = font.getbbox(text) if hasattr(font, 'getbbox') else (0, 0, *font.getmask(text).size)
-    block_w = bbox[2] - bbox[0]
-    block_h = bbox[3] - bbox[1]
+    x, y = layout['pos']
     if debug_logging:
+        block_w, block_h = text_block_size(font, text)
         print(f'draw_brand: text="{text}", x={x}, y={y}, font_size={font_size}, block_w={block_w}, block_h={block_h}')
         logger.debug(f'draw_brand: text="{text}", x={x}, y={y}, font_size={font_size}, block_w={block_w}, block_h={block_h}')
-    draw.text((x, y), text, font=font, fill=WHITE, anchor='mt')
+    draw_text(draw, (x, y), text, font, WHITE, 'mt')
 
 def draw_model(draw, text, width, height, font_path_semibold, WHITE, debug_logging=False):
-    font_size = int(width * COEFF['model_font'])
+    layout = compile_layout(width, height)['model']
+    font_size = layout['font_size']
     font = get_font(font_size, font_path_semibold)
-    x = width // 2
-    y = int(height * COEFF['model_y'])
-    bbox = font.getbbox(text) if hasattr(font, 'getbbox') else (0, 0, *font.getmask(text).size)
-    block_w = bbox[2] - bbox[0]
-    block_h = bbox[3] - bbox[1]
+    x, y = layout['pos']
     if debug_logging:
+        block_w, block_h = text_block_size(font, text)
         print(f'draw_model: text="{text}", x={x}, y={y}, font_size={font_size}, block_w={block_w}, block_h={block_h}')
         logger.debug(f'draw_model: text="{text}", x={x}, y={y}, font_size={font_size}, block_w={block_w}, block_h={block_h}')
-    draw.text((x, y), text, font=font, fill=WHITE, anchor='mt')
+    draw_text(draw, (x, y), text, font, WHITE, 'mt')
 
 def draw_specs(draw, main_text, rim_text, width, height, font_path_semibold, font_path_bold, BLACK, CYAN, LIGHT_BG, WHITE, debug_logging=False):
-    main_font = get_font(int(width * COEFF['specs_main_font']), font_path_semibold)
-    rim_font = get_font(int(width * COEFF['specs_rim_font']), font_path_bold)
-    specs_x = int(width * COEFF['specs_x'])
-    specs_y = int(height * COEFF['specs_y'])
-    main_w = int(width * COEFF['specs_main_w'])
-    main_h = int(height * COEFF['specs_main_h'])
-    main_text_x = int(main_w * COEFF['main_text_x'])
-    main_text_y = int(height * COEFF['main_text_y'])
-    rect_coords = (specs_x - main_w//2, specs_y, specs_x + main_w//2, specs_y + main_h)
-    bbox_main = main_font.getbbox(main_text) if hasattr(main_font, 'getbbox') else (0, 0, *main_font.getmask(main_text).size)
-    block_w_main = bbox_main[2] - bbox_main[0]
-    block_h_main = bbox_main[3] - bbox_main[1]
+    layout = compile_layout(width, height)['specs']
+    main_font = get_font(layout['main_font_size'], font_path_semibold)
+    rim_font = get_font(layout['rim_font_size'], font_path_bold)
+    rect_coords = layout['rect']
     if debug_logging:
-        print(f'draw_specs: main_text="{main_text}", x={(specs_x - main_w//2) + main_text_x}, y={specs_y + main_text_y}, font_size={main_font.size}, block_w={block_w_main}, block_h={block_h_main}')
-        logger.debug(f'draw_specs: main_text="{main_text}", x={(specs_x - main_w//2) + main_text_x}, y={specs_y + main_text_y}, font_size={main_font.size}, block_w={block_w_main}, block_h={block_h_main}')
-    bbox_rim = rim_font.getbbox(rim_text) if hasattr(rim_font, 'getbbox') else (0, 0, *rim_font.getmask(rim_text).size)
-    block_w_rim = bbox_rim[2] - bbox_rim[0]
-    block_h_rim = bbox_rim[3] - bbox_rim[1]
+        block_w_main, block_h_main = text_block_size(main_font, main_text)
+        print(f'draw_specs: main_text="{main_text}", x={layout["main_pos"][0]}, y={layout["main_debug_y"]}, font_size={main_font.size}, block_w={block_w_main}, block_h={block_h_main}')
+        logger.debug(f'draw_specs: main_text="{main_text}", x={layout["main_pos"][0]}, y={layout["main_debug_y"]}, font_size={main_font.size}, block_w={block_w_main}, block_h={block_h_main}')
     if debug_logging:
+        block_w_rim, block_h_rim = text_block_size(rim_font, rim_text)
         print(f'draw_specs: rim_text="{rim_text}", font_size={rim_font.size}, block_w={block_w_rim}, block_h={block_h_rim}')
         logger.debug(f'draw_specs: rim_text="{rim_text}", font_size={rim_font.size}, block_w={block_w_rim}, block_h={block_h_rim}')
     if debug_logging:
@@ -193,101 +201,78 @@ def draw_specs(draw, main_text, rim_text, width, height, font_path_semibold, fon
     #     rect_coords,
     #     radius=int(height*0.03), fill=LIGHT_BG
     # )
-    draw.text(
-        ((specs_x - main_w//2) + main_text_x, main_text_y),
-        main_text, font=main_font, fill=BLACK, anchor='ls'
-    )
-    rim_space = int(main_h * 0.0698)
-    rim_x = (specs_x - main_w//2) + int(main_w * 0.6379)
-    rim_x2 = (specs_x + main_w//2) - rim_space
-    rim_y = specs_y + rim_space
-    rim_y2 = (specs_y + main_h) - rim_space
-    rim_rect = (rim_x, rim_y, rim_x2, rim_y2)
+    draw_text(draw, layout['main_pos'], main_text, main_font, BLACK, 'ls')
+    rim_rect = layout['rim_rect']
     if debug_logging:
         print(f'draw_specs: rim rect {rim_rect}')
         logger.debug(f'draw_specs: rim rect {rim_rect}')
-    print(f'draw_specs: rim_text="{rim_text}", x={rim_x + (rim_x2 - rim_x)//2}, y={rim_y + int((rim_y2 - rim_y) * 0.0746)}, font_size={rim_font.size}')
-    logger.debug(f'draw_specs: rim_text="{rim_text}", x={rim_x + (rim_x2 - rim_x)//2}, y={rim_y + int((rim_y2 - rim_y) * 0.0746)}, font_size={rim_font.size}')
+    print(f'draw_specs: rim_text="{rim_text}", x={layout["rim_pos"][0]}, y={layout["rim_debug_y"]}, font_size={rim_font.size}')
+    logger.debug(f'draw_specs: rim_text="{rim_text}", x={layout["rim_pos"][0]}, y={layout["rim_debug_y"]}, font_size={rim_font.size}')
     #draw.rounded_rectangle(
     #    rim_rect,
     #    radius=int(height*0.027), fill=CYAN
     #)
-    rim_w = rim_x2 - rim_x
-    rim_h = rim_y2 - rim_y
-    draw.text(
-        (rim_x + rim_w//2, main_text_y),
-        rim_text, font=rim_font, fill=WHITE, anchor='ms'
-    )
+    draw_text(draw, layout['rim_pos'], rim_text, rim_font, WHITE, 'ms')
 
-def draw_index_box(draw, value, text1, text2, width, height, bg_color, x, y, font_path_bold, font_path_regular, WHITE, debug_logging=False):
-    box_w = int(width * COEFF['index_box_w'])
-    box_h = int(height * COEFF['index_box_h'])
-    rect_coords = (x, y, x + box_w, y + box_h)
-    num_font = get_font(int(width * 0.0629), font_path_bold)
-    text_font = get_font(int(width * 0.037), font_path_regular)
-    cx = x + int(box_w * 0.0682)
-    cy = y + int(box_h * 0.0526)
-    bbox_val = num_font.getbbox(value) if hasattr(num_font, 'getbbox') else (0, 0, *num_font.getmask(value).size)
-    block_w_val = bbox_val[2] - bbox_val[0]
-    block_h_val = bbox_val[3] - bbox_val[1]
+def draw_index_box(draw, value, text1, text2, width, height, bg_color, x, y, font_path_bold, font_path_regular, WHITE, debug_logging=False, captions=False):
+    """
+    Значение индекса. Подписи text1/text2 неизменны для всех товаров: при captions=False (по умолчанию)
+    они не рисуются — их даёт шаблон или базовый слой (draw_static_layer).
+    """
+    layout = index_box_layout(width, height, x, y)
+    rect_coords = layout['rect']
+    num_font = get_font(layout['num_font_size'], font_path_bold)
+    text_font = get_font(layout['text_font_size'], font_path_regular)
+    cx, cy = layout['value_pos']
     if debug_logging:
+        block_w_val, block_h_val = text_block_size(num_font, value)
         print(f'draw_index_box: value="{value}", x={cx}, y={cy}, font_size={num_font.size}, block_w={block_w_val}, block_h={block_h_val}')
         logger.debug(f'draw_index_box: value="{value}", x={cx}, y={cy}, font_size={num_font.size}, block_w={block_w_val}, block_h={block_h_val}')
-    bbox_t1 = text_font.getbbox(text1) if hasattr(text_font, 'getbbox') else (0, 0, *text_font.getmask(text1).size)
-    block_w_t1 = bbox_t1[2] - bbox_t1[0]
-    block_h_t1 = bbox_t1[3] - bbox_t1[1]
     if debug_logging:
-        print(f'draw_index_box: text1="{text1}", x={cx}, y={y + int(box_h * 0.4554)}, font_size={text_font.size}, block_w={block_w_t1}, block_h={block_h_t1}')
-        logger.debug(f'draw_index_box: text1="{text1}", x={cx}, y={y + int(box_h * 0.4554)}, font_size={text_font.size}, block_w={block_w_t1}, block_h={block_h_t1}')
-    bbox_t2 = text_font.getbbox(text2) if hasattr(text_font, 'getbbox') else (0, 0, *text_font.getmask(text2).size)
-    block_w_t2 = bbox_t2[2] - bbox_t2[0]
-    block_h_t2 = bbox_t2[3] - bbox_t2[1]
+        block_w_t1, block_h_t1 = text_block_size(text_font, text1)
+        print(f'draw_index_box: text1="{text1}", x={cx}, y={layout["text1_debug_y"]}, font_size={text_font.size}, block_w={block_w_t1}, block_h={block_h_t1}')
+        logger.debug(f'draw_index_box: text1="{text1}", x={cx}, y={layout["text1_debug_y"]}, font_size={text_font.size}, block_w={block_w_t1}, block_h={block_h_t1}')
     if debug_logging:
-        print(f'draw_index_box: text2="{text2}", x={cx}, y={y + int(box_h * 0.6883)}, font_size={text_font.size}, block_w={block_w_t2}, block_h={block_h_t2}')
-        logger.debug(f'draw_index_box: text2="{text2}", x={cx}, y={y + int(box_h * 0.6883)}, font_size={text_font.size}, block_w={block_w_t2}, block_h={block_h_t2}')
+        block_w_t2, block_h_t2 = text_block_size(text_font, text2)
+        print(f'draw_index_box: text2="{text2}", x={cx}, y={layout["text2_debug_y"]}, font_size={text_font.size}, block_w={block_w_t2}, block_h={block_h_t2}')
+        logger.debug(f'draw_index_box: text2="{text2}", x={cx}, y={layout["text2_debug_y"]}, font_size={text_font.size}, block_w={block_w_t2}, block_h={block_h_t2}')
     if debug_logging:
         print(f'draw_index_box: rect {rect_coords}')
         logger.debug(f'draw_index_box: rect {rect_coords}')
     #draw.rounded_rectangle(rect_coords, radius=int(height*0.027), fill=bg_color)
-    draw.text((cx, cy), value, font=num_font, fill=WHITE, anchor='lt')
-    #draw.text((cx, y + int(box_h * 0.4834)), text1, font=text_font, fill=WHITE, anchor='lt')
-    #draw.text((cx, y + int(box_h * 0.7255)), text2, font=text_font, fill=WHITE, anchor='lt')
+    draw_text(draw, (cx, cy), value, num_font, WHITE, 'lt')
+    if captions:
+        draw_index_captions(draw, text1, text2, layout, font_path_regular, WHITE)
+
+def draw_index_captions(draw, text1, text2, layout, font_path_regular, WHITE):
+    text_font = get_font(layout['text_font_size'], font_path_regular)
+    draw_text(draw, layout['text1_pos'], text1, text_font, WHITE, 'lt')
+    draw_text(draw, layout['text2_pos'], text2, text_font, WHITE, 'lt')
 
 def draw_season(draw, season, icon_img, width, height, font_path_bold, WHITE, img=None, debug_logging=False):
-    font = get_font(int(width * COEFF['season_font']), font_path_bold)
-    x = int(width * COEFF['season_x'])
-    y = int(height * COEFF['season_y'])
-    y2 = int(height * COEFF['season_y2'])
+    layout = compile_layout(width, height)['season']
+    font = get_font(layout['font_size'], font_path_bold)
+    x, y = layout['line1_pos']
+    y2 = layout['line2_pos'][1]
     line1 = "ЛЕТНЯЯ" if season.lower() == "летняя" else "ЗИМНЯЯ" if season.lower() == "зимняя" else "ЛЮБОЙ"
     line2 = "РЕЗИНА" if season.lower() in ["летняя", "зимняя"] else "СЕЗОН"
-    bbox1 = font.getbbox(line1) if hasattr(font, 'getbbox') else (0, 0, *font.getmask(line1).size)
-    block_w1 = bbox1[2] - bbox1[0]
-    block_h1 = bbox1[3] - bbox1[1]
-    bbox2 = font.getbbox(line2) if hasattr(font, 'getbbox') else (0, 0, *font.getmask(line2).size)
-    block_w2 = bbox2[2] - bbox2[0]
-    block_h2 = bbox2[3] - bbox2[1]
     if debug_logging:
+        block_w1, block_h1 = text_block_size(font, line1)
+        block_w2, block_h2 = text_block_size(font, line2)
         print(f'draw_season: line1="{line1}", x={x}, y={y}, font_size={font.size}, block_w={block_w1}, block_h={block_h1}')
         logger.debug(f'draw_season: line1="{line1}", x={x}, y={y}, font_size={font.size}, block_w={block_w1}, block_h={block_h1}')
         print(f'draw_season: line2="{line2}", x={x}, y={y2}, font_size={font.size}, block_w={block_w2}, block_h={block_h2}')
         logger.debug(f'draw_season: line2="{line2}", x={x}, y={y2}, font_size={font.size}, block_w={block_w2}, block_h={block_h2}')
-    draw.text((x, y), line1, font=font, fill=WHITE, anchor='lt')
-    draw.text((x, y2), line2, font=font, fill=WHITE, anchor='lt')
+    draw_text(draw, (x, y), line1, font, WHITE, 'lt')
+    draw_text(draw, (x, y2), line2, font, WHITE, 'lt')
     if icon_img and img is not None:
-        icon_w = int(width * 0.087)
-        icon_h = int(height * 0.0726)
-        icon_x = int(width * 0.267)
-        icon_y = int(height * 0.79)
-        icon_resized = icon_img.resize((icon_w, icon_h))
-        img.paste(icon_resized, (icon_x, icon_y), icon_resized)
-
-def draw_tire(img, tire_img, width, height):
-    tire_width = int(width * COEFF['tire_w'])
-    tire_height = int(height * COEFF['tire_h'])
-    x = int(width * COEFF['tire_x'])
-    y = int(height * COEFF['tire_y'])
-    tire_resized = tire_img.resize((tire_width, tire_height), Image.LANCZOS)
-    img.paste(tire_resized, (x, y), tire_resized)
+        icon_w, icon_h = layout['icon_size']
+        if isinstance(icon_img, (str, Path)):
+            # Путь к иконке: уменьшенная копия под этот размер берётся из кэша ассетов
+            icon_resized = get_asset_cache().get(icon_img, (icon_w, icon_h), resample=Image.BICUBIC)
+        else:
+            icon_resized = icon_img.resize((icon_w, icon_h))
+        img.paste(icon_resized, layout['icon_pos'], icon_resized)
 
 # --- Вспомогательные функции ---
 def crop_to_content(img):
@@ -339,13 +324,86 @@ def resolve_font_path(font_path):
         return str(abs_path)
     return font_path
 
+# --- Модели: общий реестр процесса, загрузка один раз и LRU-вытеснение по лимиту памяти ---
+def resolve_weights_path(weights_path):
+    # Относительные пути к весам считаются от папки py/
+    if not weights_path:
+        return None
+    weights_path = Path(weights_path)
+    return weights_path if weights_path.is_absolute() else (Path(__file__).parent / weights_path).resolve()
+
+MODEL_REGISTRY = get_registry(
+    max_memory_mb=config.get('model_cache_max_mb', 2048),
+    u2net_weights={
+        'u2net': resolve_weights_path(config.get('u2net_weights')),
+        'u2netp': resolve_weights_path(config.get('u2netp_weights')),
+    }
+)
+
+def get_rembg_session(model_name=None):
+    return MODEL_REGISTRY.rembg_session(model_name or config.get('rembg_model', 'u2net'))
+
+def saliency_backend(precision):
+    """
+    Бэкенд U2NET для точности: int8 есть только в onnxruntime, поэтому int8 (в том числе из params задачи)
+    выбирает onnx независимо от saliency_backend.
+    """
+    if precision == 'int8':
+        return 'onnx'
+    return config.get('saliency_backend', 'torch')
+
+def get_u2net_predictor(model_name=None, precision=None):
+    # saliency_model: u2net | u2netp (или fast — быстрый режим: ~4.7 МБ весов, заметно быстрее на CPU)
+    # saliency_backend: torch | onnx (onnxruntime, см. u2net_onnx.py)
+    # saliency_precision: fp32 | int8 (только onnx, см. quantize_u2net.py; включает onnx сам)
+    model_name = model_name or config.get('saliency_model', 'u2net')
+    if model_name == 'fast':
+        model_name = 'u2netp'
+    precision = precision or config.get('saliency_precision', 'fp32')
+    return MODEL_REGISTRY.u2net(
+        model_name,
+        backend=saliency_backend(precision),
+        num_threads=config.get('onnx_threads', 0),
+        precision=precision
+    )
+
+def rembg_at_startup():
+    """
+    Нужен ли rembg при старте: opencv/lama с общей сегментацией берут альфу из маски U2NET и rembg не вызывают.
+    Задача с другим методом в params загрузит rembg лениво.
+    """
+    method = config.get('logo_removal_method', 'opencv')
+    return method not in ('opencv', 'lama') or not config.get('shared_segmentation', True)
+
+def check_model_files():
+    """
+    Проверка при старте, что модели лежат локально (недостающие rembg-модели скачиваются сразу).
+    """
+    rembg_models = config.get('rembg_models') or ([config.get('rembg_model', 'u2net')] if rembg_at_startup() else [])
+    MODEL_REGISTRY.ensure_model_files(
+        rembg_models=rembg_models,
+        u2net_models=['u2netp' if config.get('saliency_model') in ('u2netp', 'fast') else 'u2net'],
+        allow_download=config.get('models_allow_download', True)
+    )
+
+def warmup_models():
+    """
+    Загружает модели и прогоняет пустой кадр, чтобы первая задача не платила за холодный старт.
+    """
+    started = time.monotonic()
+    dummy = Image.new('RGB', (320, 320), (128, 128, 128))
+    if rembg_at_startup():
+        remove(dummy, session=get_rembg_session())
+    try:
+        get_u2net_predictor().predict(dummy)
+    except FileNotFoundError as e:
+        logger.warning(f'[MODELS] Прогрев U2NET пропущен: {e}')
+    logger.info(f'[MODELS] Модели прогреты за {time.monotonic() - started:.1f} с')
+
 # --- Универсальная функция удаления логотипа с автоадаптацией ---
-def get_salient_mask_u2net(img):
-    from u2net import U2NETPredictor
-    import torch
-    from pathlib import Path
-    weights_path = (Path(__file__).parent / 'u2net.pth').resolve()
-    predictor = U2NETPredictor(weights_path=weights_path)
+def get_salient_mask_u2net(img, params=None):
+    params = params or {}
+    predictor = get_u2net_predictor(params.get('saliency_model'), params.get('saliency_precision'))
     mask = predictor.predict(img.convert('RGB'))
     return Image.fromarray(mask).convert('L')
 
@@ -469,14 +527,15 @@ def remove_logo_lama(img, mask_salient, mask_auto, debug_path_prefix=None):
     import io
     import requests
     import traceback
-    # Генерируем итоговую маску (аналогично OpenCV)
-    final_mask = np.bitwise_or(mask_salient, mask_auto)
+    # Закрашивается только логотип внутри шины (как в remove_logo_opencv), а не вся шина
+    final_mask = logo_inpaint_mask(mask_salient, mask_auto)
     # Логируем статистику маски
     nonzero = np.count_nonzero(final_mask)
     logger.debug(f'LAMA_MASK: shape={final_mask.shape}, nonzero={nonzero}')
     if nonzero == 0:
-        logger.error('LAMA_MASK: Маска пуста, inpaint невозможен!')
-        raise RuntimeError('Маска для lama-cleaner пуста, inpaint невозможен.')
+        # Логотипа на шине нет — закрашивать нечего
+        logger.info('LAMA_MASK: Маска логотипа на шине пуста, изображение без изменений')
+        return img
     # Сохраняем input и mask во временные in-memory файлы
     img_bytes = io.BytesIO()
     img.save(img_bytes, format='PNG')
@@ -531,7 +590,11 @@ def remove_logo_lama(img, mask_salient, mask_auto, debug_path_prefix=None):
 
 
 
-def remove_logo_from_object(img, mask_path=None, logo_removal_method='runwayml', debug_path_prefix=None, params=None):
+def remove_logo_from_object(img, mask_path=None, logo_removal_method='runwayml', debug_path_prefix=None, params=None, segmentation=None):
+    """
+    segmentation — общая маска шины (segmentation.py): для opencv/lama используется как салентная маска
+    вместо отдельного прогона U2NET.
+    """
     if img.mode != 'RGBA':
         img = img.convert('RGBA')
     if logo_removal_method == 'runwayml':
@@ -542,14 +605,24 @@ def remove_logo_from_object(img, mask_path=None, logo_removal_method='runwayml',
         if not api_key:
             logger.error("API-ключ RunwayML не передан!")
             logger.error("Проверьте: 1) переменную окружения RUNWAYML_API_KEY, 2) передачу ключа в params задачи")
-            raise RuntimeError("API-ключ RunwayML не передан!")
+            raise PermanentTaskError("API-ключ RunwayML не передан!")
         return remove_logo_runwayml(img, prompt, api_key, debug_path_prefix)
-    # --- Для активации других методов раскомментируйте и доработайте код ниже ---
-    # elif logo_removal_method == 'lama':
-    #     ...
-    # else:
-    #     ...
-    # ------------------------------------------------------
+    if logo_removal_method in ('opencv', 'lama'):
+        if segmentation is not None:
+            mask_salient = segmentation.array(img.size)
+        else:
+            mask_salient = np.array(get_salient_mask_u2net(img, params))
+        # Маска логотипа из задачи, иначе — автоматическая (яркие и преобладающие цвета внизу кадра)
+        if mask_path and os.path.isfile(mask_path):
+            mask_auto = np.array(Image.open(mask_path).convert('L').resize(img.size, Image.NEAREST))
+        else:
+            if mask_path:
+                logger.warning(f'Маска логотипа не найдена: {mask_path}, используется автоматическая')
+            mask_auto = get_auto_color_masks(img)
+        if logo_removal_method == 'lama':
+            return remove_logo_lama(img, mask_salient, mask_auto, debug_path_prefix)
+        return remove_logo_opencv(img, mask_salient, mask_auto, debug_path_prefix)
+    raise PermanentTaskError(f'Неизвестный метод удаления логотипа: {logo_removal_method}')
 
 def remove_logo_runwayml(img, prompt, api_key, debug_path_prefix=None):
     """
@@ -570,14 +643,14 @@ def remove_logo_runwayml(img, prompt, api_key, debug_path_prefix=None):
         from runwayml import RunwayML, TaskFailedError
     except ImportError:
         logger.error("[RunwayML] SDK RunwayML не установлен. Установите: pip install runwayml")
-        raise RuntimeError("SDK RunwayML не установлен. Установите: pip install runwayml")
+        raise PermanentTaskError("SDK RunwayML не установлен. Установите: pip install runwayml")
     
     masked_key = (api_key[:5] + '...' + str(len(api_key))) if api_key else '(none)'
     logger.info(f"[RunwayML] Используется API-ключ: {masked_key}")
     
     if not api_key:
         logger.error("API-ключ RunwayML не передан или пуст!")
-        raise RuntimeError("API-ключ RunwayML не передан или пуст!")
+        raise PermanentTaskError("API-ключ RunwayML не передан или пуст!")
     
     logger.info(f"[RunwayML] Старт отправки изображения на runwayml.com для удаления логотипа. Prompt: {prompt}")
     
@@ -607,7 +680,7 @@ def remove_logo_runwayml(img, prompt, api_key, debug_path_prefix=None):
             new_w = w
             new_h = h
         
-        img_resized = img.resize((new_w, new_h), Image.LANCZOS)
+        img_resized = resize_image(img, (new_w, new_h), 'runwayml')
         logger.info(f"[RunwayML] Изображение ресайзено: {w}x{h} -> {new_w}x{new_h}")
         
         # Конвертируем ресайзенное изображение в base64 data URI
@@ -667,6 +740,390 @@ def remove_logo_runwayml(img, prompt, api_key, debug_path_prefix=None):
             logger.error(f"[RunwayML] Тело ответа: {e.response.text}")
         raise RuntimeError(f"RunwayML API error: {e}")
 
+def task_logo_mask(task):
+    """
+    Маска логотипа из задачи (logo_mask) — в папке оригиналов, как original_image; None, если не задана.
+    """
+    return resolve_logo_mask(task.get('logo_mask'), ORIGINALS_DIR)
+
+def task_files(task):
+    """
+    Пути к входным файлам задачи и к итоговому файлу.
+    """
+    params = task.get('params', {})
+    def get_param(key, default=None):
+        return params.get(key) or config.get(key) or default
+    return {
+        'original': ORIGINALS_DIR / Path(task['original_image']).name,
+        'template': TEMPLATES_DIR / Path(task['template']).name,
+        'icon': LOGOS_DIR / Path(task.get('icon', 'icon.png')).name,
+        'logo_mask': task_logo_mask(task),
+        'font_bold': resolve_font_path(get_param('font_bold', 'Inter-Bold.ttf')),
+        'font_semibold': resolve_font_path(get_param('font_semibold', 'Inter-SemiBold.ttf')),
+        'font_regular': resolve_font_path(get_param('font_regular', 'Inter-Regular.ttf')),
+        'output': PROCESSED_DIR / Path(task['output_filename']).name,
+    }
+
+# --- Кэш готовых изображений по содержимому входов ---
+# Увеличить при изменении отрисовки: старые записи кэша перестанут совпадать
+OUTPUT_CACHE_VERSION = 3
+# Параметры, не влияющие на изображение
+OUTPUT_CACHE_VOLATILE_PARAMS = {'runwayml_api_key', 'debug_logging'}
+# Настройки config.yaml, не влияющие на изображение (каталоги, очередь, демон, логи, кэши)
+OUTPUT_CACHE_OPERATIONAL_CONFIG = {
+    'tasks_dir', 'results_dir', 'originals_dir', 'processed_dir', 'templates_dir', 'logos_dir', 'logs_dir',
+    'batch_size', 'log_level', 'daemon_poll_interval', 'model_cache_max_mb', 'models_allow_download',
+    'onnx_threads', 'memory_report_interval', 'task_lease_seconds', 'task_max_attempts',
+    'retry_backoff_seconds', 'retry_backoff_max_seconds', 'queue_backend', 'queue_db',
+    'results_journal', 'results_journal_retain_days', 'results_journal_max_records', 'results_journal_archives',
+    'output_cache', 'output_cache_dir', 'cutout_cache', 'cutout_cache_dir', 'cutout_cache_max_mb', 'cutout_cache_format',
+    'batch_dedup', 'dedup_hamming_threshold', 'dedup_max_thumb_diff', 'template_cache_max_mb', 'template_cache_disk', 'template_cache_dir',
+    'text_sprite_cache_mb', 'max_image_pixels',
+}
+
+_output_cache = None
+
+def get_output_cache():
+    global _output_cache
+    if not config.get('output_cache', True):
+        return None
+    if _output_cache is None:
+        from content_cache import OutputCache
+        _output_cache = OutputCache((PROJECT_ROOT / config.get('output_cache_dir', 'uploads/ai_image/cache/output')).resolve())
+    return _output_cache
+
+def output_cache_key(task, files):
+    """
+    Ключ из хэшей входных файлов и канонического JSON product_data, params и влияющих настроек config.yaml.
+    """
+    from content_cache import content_key, file_sha256
+    hashes = {}
+    for name, path in files.items():
+        if name != 'output':
+            hashes[name] = file_sha256(path) if path and os.path.isfile(path) else None
+    params = {k: v for k, v in (task.get('params') or {}).items() if k not in OUTPUT_CACHE_VOLATILE_PARAMS}
+    render_config = {k: v for k, v in config.items() if k not in OUTPUT_CACHE_OPERATIONAL_CONFIG}
+    return content_key(
+        OUTPUT_CACHE_VERSION, hashes, task.get('product_data'), params, render_config,
+        files['output'].suffix.lower()
+    )
+
+def process_image_cached(task):
+    """
+    process_image с кэшем по содержимому: при совпадении ключа готовый файл берётся из кэша.
+    Возвращает (output_image, cache_hit, sha256 итогового файла).
+    """
+    from content_cache import file_sha256
+    cache = get_output_cache()
+    files = task_files(task)
+    output_image = str(files['output'].relative_to(PROCESSED_DIR.parent))
+    if cache is None:
+        output_image = process_image(task)
+        return output_image, False, file_sha256(PROCESSED_DIR.parent / output_image)
+    if not os.path.isfile(files['original']) or not os.path.isfile(files['template']):
+        # Ошибку с понятным текстом сформирует process_image
+        return process_image(task), False, None
+    key = output_cache_key(task, files)
+    digest = cache.fetch(key, files['output'])
+    if digest:
+        logger.info(f'[CACHE] Результат задачи {task["task_id"]} взят из кэша ({key[:12]})')
+        return output_image, True, digest
+    output_image = process_image(task)
+    if task.get(CUTOUT_REUSED_FIELD):
+        # Вырезка похожего оригинала: под ключом этого оригинала результат не запоминается
+        return output_image, False, file_sha256(PROCESSED_DIR.parent / output_image)
+    return output_image, False, cache.store(key, PROCESSED_DIR.parent / output_image)
+
+# --- Кэш вырезанной шины: зависит только от оригинала и метода удаления логотипа/фона ---
+# Увеличить при изменении цепочки удаления логотипа/фона/обрезки
+CUTOUT_CACHE_VERSION = 2
+# Поля задачи (только в памяти): ключ вырезки лидера группы похожих снимков, которую можно взять,
+# и отметка, что вырезка взята у лидера — такой результат не сохраняется в кэши под ключами задачи
+CUTOUT_SOURCE_FIELD = '_cutout_source'
+CUTOUT_REUSED_FIELD = '_cutout_reused'
+
+_cutout_cache = None
+
+def get_cutout_cache():
+    global _cutout_cache
+    if not config.get('cutout_cache', True):
+        return None
+    if _cutout_cache is None:
+        from content_cache import CutoutCache
+        _cutout_cache = CutoutCache(
+            (PROJECT_ROOT / config.get('cutout_cache_dir', 'uploads/ai_image/cache/cutouts')).resolve(),
+            max_mb=config.get('cutout_cache_max_mb', 2048),
+            image_format=config.get('cutout_cache_format', 'png'),
+        )
+    return _cutout_cache
+
+def log_cutout_cache_stats():
+    cache = _cutout_cache
+    if cache is not None and cache.hits + cache.misses:
+        st = cache.stats()
+        logger.info(f"[CACHE] Кэш вырезок: попаданий {st['hits']}, промахов {st['misses']} ({st['hit_ratio']:.0%}), записано {st['stores']}, вытеснено {st['evictions']}")
+
+def cutout_signature(task, params):
+    """
+    Всё, кроме оригинала, от чего зависит вырезка: метод удаления логотипа и его параметры (<метод>_*),
+    модель rembg, маска логотипа.
+    """
+    from content_cache import file_sha256
+    def get_param(key, default=None):
+        return params.get(key) or config.get(key) or default
+    method = get_param('logo_removal_method', 'opencv')
+    method_params = {
+        k: v for k, v in params.items()
+        if k.startswith(f'{method}_') and k not in OUTPUT_CACHE_VOLATILE_PARAMS and k != f'{method}_api_key'
+    }
+    if method in ('opencv', 'lama'):
+        # Салентная маска U2NET задаёт область закрашивания, а при общей сегментации — и альфу (вместо rembg)
+        method_params['segmentation'] = 'shared' if config.get('shared_segmentation', True) else 'separate'
+        precision = get_param('saliency_precision', 'fp32')
+        method_params['saliency'] = (get_param('saliency_model', 'u2net'), saliency_backend(precision), precision)
+    if method == 'runwayml' and resample_kernel('runwayml') != 'lanczos':
+        # Вход RunwayML уменьшен другим ядром — другая вырезка
+        method_params['resample'] = resample_kernel('runwayml')
+    mask_path = task_logo_mask(task)
+    mask_hash = file_sha256(mask_path) if mask_path and os.path.isfile(mask_path) else None
+    return method, method_params, get_param('rembg_model', 'u2net'), mask_hash
+
+def cutout_cache_key(task, orig_path, params):
+    """
+    Ключ: хэш оригинала и cutout_signature. Размер декодирования в ключ не входит — он хранится
+    вместе с вырезкой (см. CutoutCache), и вырезка из большего оригинала уменьшается до нужного размера.
+    """
+    from content_cache import content_key, file_sha256
+    return content_key(CUTOUT_CACHE_VERSION, file_sha256(orig_path), *cutout_signature(task, params))
+
+def scale_cutout(img, stored_size, decode_size):
+    """
+    Вырезка из оригинала размером stored_size — в масштабе оригинала decode_size (место original).
+    """
+    if stored_size == decode_size:
+        return img
+    size = (
+        max(1, round(img.width * decode_size[0] / stored_size[0])),
+        max(1, round(img.height * decode_size[1] / stored_size[1]))
+    )
+    return resize_image(img, size, 'original')
+
+# --- Декодирование оригинала в нужном размере ---
+# Шина рисуется в месте макета (в render_mode: full — на холсте суперсэмплинга), поэтому удаление логотипа,
+# rembg и обрезка выполняются над оригиналом, уменьшенным до этого размера с запасом decode_margin
+# (шина занимает не весь кадр). JPEG сразу декодируется в уменьшенном масштабе (draft: 1/2, 1/4, 1/8).
+# Размер проверяется по заголовку файла до декодирования: больше max_image_pixels — ошибка задачи.
+
+def probe_original(orig_path):
+    """
+    Размер оригинала по заголовку (без декодирования). Слишком большой или нечитаемый файл — PermanentTaskError.
+    """
+    max_pixels = int(config.get('max_image_pixels', 50_000_000))
+    try:
+        with Image.open(orig_path) as img:
+            size = img.size
+    except Image.DecompressionBombError as e:
+        raise PermanentTaskError(f'Оригинал слишком большой: {orig_path} ({e})')
+    except (UnidentifiedImageError, OSError) as e:
+        raise PermanentTaskError(f'Не удалось прочитать оригинал {orig_path}: {e}')
+    if size[0] * size[1] > max_pixels:
+        raise PermanentTaskError(f'Оригинал слишком большой: {orig_path} ({size[0]}x{size[1]}, max_image_pixels {max_pixels})')
+    return size
+
+def original_decode_size(orig_path, params):
+    """
+    (размер оригинала, размер для обработки). Размер для обработки — наименьший, при котором шина
+    в кадре не меньше своего места в макете с запасом decode_margin; не больше оригинала.
+    """
+    def get_param(key, default=None):
+        return params.get(key) or config.get(key) or default
+    size = probe_original(orig_path)
+    if not config.get('early_downscale', True):
+        return size, size
+    width = int(get_param('width', 620))
+    height = int(get_param('height', 826))
+    factor = 1 if get_param('render_mode', 'full') == 'layered' else int(get_param('supersampling_factor', 3))
+    import resampling
+    tire_size = compile_layout(width * factor, height * factor)['tire']['size']
+    return size, resampling.decode_size(size, tire_size, float(config.get('decode_margin', 1.5)))
+
+def load_original(orig_path, decode_size):
+    """
+    Оригинал в RGBA размером decode_size. JPEG декодируется через draft в ближайшем не меньшем масштабе.
+    """
+    import resampling
+    img, full_size, draft_size = resampling.open_scaled(orig_path, decode_size, resample_kernel('original'))
+    if decode_size != full_size:
+        logger.info(f'[PROCESS] Оригинал {full_size[0]}x{full_size[1]} уменьшен до {decode_size[0]}x{decode_size[1]} (декодирование {draft_size[0]}x{draft_size[1]})')
+    return img
+
+def prepare_cutout(task, orig_path, output_path, params, debug_logging=False):
+    """
+    Шина без логотипа и фона, обрезанная по содержимому (RGBA).
+    При попадании в кэш вырезок удаление логотипа (RunwayML и др.) и rembg не вызываются.
+    """
+    def get_param(key, default=None):
+        return params.get(key) or config.get(key) or default
+    logo_removal_method = get_param('logo_removal_method', 'opencv')
+    cache = get_cutout_cache()
+    cache_key = cutout_cache_key(task, orig_path, params) if cache is not None else None
+    decode_size = original_decode_size(orig_path, params)[1]
+    if cache is not None:
+        # Годится вырезка из оригинала не меньше нужного размера (другой размер макета, render_mode)
+        cached = cache.get(cache_key, decode_size)
+        if (cache.hits + cache.misses) % 100 == 0:
+            log_cutout_cache_stats()
+        if cached is not None:
+            cached_img, stored_size = cached
+            logger.info(f'[CACHE] Вырезанная шина взята из кэша ({cache_key[:12]}, оригинал {stored_size[0]}x{stored_size[1]})')
+            return scale_cutout(cached_img, stored_size, decode_size)
+        # Похожий оригинал из того же пакета (см. plan_task_batch): берём вырезку лидера только для этой
+        # задачи — под ключом её оригинала она не сохраняется (другой пакет получит свою вырезку)
+        source_key = task.get(CUTOUT_SOURCE_FIELD)
+        if source_key and source_key != cache_key:
+            cached = cache.get(source_key)
+            if cached is not None:
+                logger.info(f'[DEDUP] Задача {task.get("task_id")}: вырезка похожего оригинала ({source_key[:12]})')
+                task[CUTOUT_REUSED_FIELD] = True
+                return cached[0]
+    # 2. Открываем оригинал (сразу в размере, нужном для отрисовки)
+    orig_img = load_original(orig_path, decode_size)
+    # Одна сегментация на оригинал: маска для удаления логотипа, альфа и рамка обрезки (segmentation.py).
+    # opencv/lama: салентная маска U2NET оригинала (saliency_model/backend/precision) — та же, что нужна
+    # для удаления логотипа, rembg не вызывается. RunwayML перерисовывает изображение — маска rembg по результату
+    shared_segmentation = config.get('shared_segmentation', True)
+    segmentation = None
+    if shared_segmentation and logo_removal_method in ('opencv', 'lama'):
+        segmentation = Segmentation(get_salient_mask_u2net(orig_img, params))
+    logger.info("[PROCESS] Удаление логотипа...")
+    tire_img = remove_logo_from_object(
+        orig_img,
+        task_logo_mask(task),
+        logo_removal_method=logo_removal_method,
+        debug_path_prefix=(str(output_path).replace('.', '_debug1') if debug_logging else None),
+        params=params,
+        segmentation=segmentation
+    )
+    if debug_logging:
+        debug_path = str(output_path).replace('.', '_debug2_nologo.')
+        img_to_save = tire_img
+        if debug_path.lower().endswith(('.jpg', '.jpeg')) and tire_img.mode == 'RGBA':
+            img_to_save = tire_img.convert('RGB')
+        img_to_save.save(debug_path)
+    logger.info("[PROCESS] Удаление фона...")
+    if segmentation is not None:
+        # Закрашенные логотипы — отдельные салентные объекты: в альфе остаётся только шина
+        segmentation = segmentation.main_component()
+    elif shared_segmentation:
+        segmentation = Segmentation.of(tire_img, get_rembg_session(get_param('rembg_model', 'u2net')))
+    if segmentation is not None:
+        tire_img_nobg = segmentation.cutout(tire_img)
+    else:
+        # Удаляем фон и конвертируем в RGBA для сохранения прозрачности
+        tire_img_nobg = remove(tire_img, session=get_rembg_session(get_param('rembg_model', 'u2net')))
+    if tire_img_nobg.mode != 'RGBA':
+        tire_img_nobg = tire_img_nobg.convert('RGBA')
+    if debug_logging:
+        debug_path = str(output_path).replace('.', '_debug3_nobg.')
+        img_to_save = tire_img_nobg
+        if debug_path.lower().endswith(('.jpg', '.jpeg')) and tire_img_nobg.mode == 'RGBA':
+            img_to_save = tire_img_nobg.convert('RGB')
+        img_to_save.save(debug_path)
+    logger.info("[PROCESS] Обрезка по содержимому...")
+    crop_box = segmentation.bbox(tire_img_nobg.size) if segmentation is not None else None
+    if crop_box is not None:
+        logger.debug(f'crop_to_content: crop box по маске сегментации {crop_box}')
+        tire_img_crop = tire_img_nobg.crop(crop_box)
+    else:
+        tire_img_crop = crop_to_content(tire_img_nobg)
+    if debug_logging:
+        debug_path = str(output_path).replace('.', '_debug4_crop.')
+        img_to_save = tire_img_crop
+        if debug_path.lower().endswith(('.jpg', '.jpeg')) and tire_img_crop.mode == 'RGBA':
+            img_to_save = tire_img_crop.convert('RGB')
+        img_to_save.save(debug_path)
+    if cache is not None:
+        # Вырезка из меньшего оригинала (если была) заменяется: большая подходит и для прежнего размера
+        cache.put(cache_key, tire_img_crop, decode_size)
+    return tire_img_crop
+
+# --- Ресайз по местам вызова ---
+# Ядро для каждого места: resample_sites[место] из config.yaml, иначе resample_mode (см. resampling.site_kernel)
+
+def resample_kernel(site):
+    import resampling
+    return resampling.site_kernel(config, site)
+
+def resize_image(img, size, site, box=None):
+    import resampling
+    return resampling.resize(img, size, resample_kernel(site), box=box)
+
+# --- Кэш ассетов шаблона (фоны, иконки) ---
+_asset_cache = None
+
+def get_asset_cache():
+    global _asset_cache
+    if _asset_cache is None:
+        from render_cache import AssetCache
+        disk_dir = None
+        if config.get('template_cache_disk', True):
+            disk_dir = (PROJECT_ROOT / config.get('template_cache_dir', 'uploads/ai_image/cache/templates')).resolve()
+        _asset_cache = AssetCache(max_mb=config.get('template_cache_max_mb', 256), disk_dir=disk_dir)
+    return _asset_cache
+
+def cache_counters():
+    """
+    Счётчики кэшей этого процесса: {название: (попадания, промахи)}.
+    """
+    font_info = _load_font.cache_info()
+    counters = {'шрифты': (font_info.hits, font_info.misses)}
+    if _text_sprites is not None:
+        counters['растры текста'] = (_text_sprites.hits, _text_sprites.misses)
+    if _asset_cache is not None:
+        counters['шаблоны'] = (_asset_cache.hits + _asset_cache.disk_hits, _asset_cache.misses)
+    if _cutout_cache is not None:
+        counters['вырезки'] = (_cutout_cache.hits, _cutout_cache.misses)
+    return counters
+
+def log_cache_summary(counters):
+    parts = []
+    for name, (hits, misses) in counters.items():
+        if hits + misses:
+            parts.append(f'{name} {hits}/{hits + misses} ({hits / (hits + misses):.0%})')
+    if parts:
+        logger.info('[CACHE] Попадания в кэши: ' + ', '.join(parts))
+
+def draw_static_layer(img, width, height, font_path_regular, WHITE):
+    """
+    Элементы, одинаковые для всех товаров на шаблоне: подписи индексов нагрузки и скорости.
+    """
+    layout = compile_layout(width, height)
+    draw = ImageDraw.Draw(img)
+    draw_index_captions(draw, 'индекс', 'нагрузки', layout['load_index'], font_path_regular, WHITE)
+    draw_index_captions(draw, 'индекс', 'скорости', layout['speed_index'], font_path_regular, WHITE)
+
+def get_base_layer(background_path, width, height, font_path_regular=None, WHITE='#FFFFFF', factor=1):
+    """
+    Фон нужного размера с неизменными элементами (при font_path_regular — подписи индексов).
+    factor > 1 (render_mode: layered) — фон и подписи готовятся на холсте в factor раз больше
+    и уменьшаются, как в полном режиме; это делается один раз на шаблон, а не на задачу.
+    Общий для всех задач шаблона: изменять нельзя, только копию.
+    """
+    cache = get_asset_cache()
+    if factor == 1 and not font_path_regular:
+        return cache.get(background_path, (width, height), resample=resample_kernel('template'), persist=True)
+    st = os.stat(background_path)
+    font_key = (str(font_path_regular), os.stat(font_path_regular).st_mtime_ns) if font_path_regular else None
+    key = ('base', str(background_path), st.st_mtime_ns, st.st_size, width, height, font_key, WHITE, factor)
+    def build():
+        base = cache.get(background_path, (width * factor, height * factor), resample=resample_kernel('template'), persist=True).copy()
+        if font_path_regular:
+            draw_static_layer(base, width * factor, height * factor, font_path_regular, WHITE)
+        if factor > 1:
+            base = resize_image(base, (width, height), 'base')
+        return base
+    return cache.derived(key + (resample_kernel('template'), resample_kernel('base')), build)
+
 # --- Основная функция обработки ---
 def process_image(task):
     """
@@ -678,19 +1135,25 @@ def process_image(task):
         params = task.get('params', {})
         def get_param(key, default=None):
             return params.get(key) or config.get(key) or default
+        def get_chain_param(key, default):
+            # Пустой список — допустимое значение (без постобработки), поэтому не через get_param
+            if key in params:
+                return params[key]
+            return config.get(key, default)
         debug_logging = params.get('debug_logging', False)
         width = int(get_param('width', 620))
         height = int(get_param('height', 826))
         logo_removal_method = get_param('logo_removal_method', 'opencv')
         logger.info(f"[PROCESS] Запуск обработки изображения. Метод удаления логотипа: {logo_removal_method}")
         # Пути к файлам
-        orig_path = ORIGINALS_DIR / Path(task['original_image']).name
-        background_path = TEMPLATES_DIR / Path(task['template']).name
-        icon_path = LOGOS_DIR / Path(task.get('icon', 'icon.png')).name
-        output_path = PROCESSED_DIR / Path(task['output_filename']).name
-        FONT_PATH_BOLD = resolve_font_path(get_param('font_bold', 'Inter-Bold.ttf'))
-        FONT_PATH_SEMIBOLD = resolve_font_path(get_param('font_semibold', 'Inter-SemiBold.ttf'))
-        FONT_PATH_REGULAR = resolve_font_path(get_param('font_regular', 'Inter-Regular.ttf'))
+        files = task_files(task)
+        orig_path = files['original']
+        background_path = files['template']
+        icon_path = files['icon']
+        output_path = files['output']
+        FONT_PATH_BOLD = files['font_bold']
+        FONT_PATH_SEMIBOLD = files['font_semibold']
+        FONT_PATH_REGULAR = files['font_regular']
         # Проверка существования файлов
         for p, label in [
             (orig_path, 'оригинал'),
@@ -701,12 +1164,13 @@ def process_image(task):
         ]:
             if p and not os.path.exists(p):
                 logger.error(f"Файл {label} не найден: {p}")
-                return None
+                raise PermanentTaskError(f"Файл {label} не найден: {p}")
         if icon_path and not os.path.exists(icon_path):
             logger.warning(f"Иконка не найдена: {icon_path}")
             icon_img = None
         else:
-            icon_img = Image.open(icon_path).convert('RGBA') if icon_path else None
+            # Иконка читается из кэша ассетов при отрисовке (draw_season принимает путь)
+            icon_img = icon_path
         # Цвета
         WHITE = get_param('color_white', '#FFFFFF')
         BLACK = get_param('color_black', '#222222')
@@ -725,57 +1189,37 @@ def process_image(task):
         SPEED_IDX = pd.get('speed_index', '')
 
         # === SUPER SAMPLING/POSTPROCESSING ===
-        SUPER_SAMPLING_FACTOR = 3  # Можно увеличить до 3 для очень высоких требований
+        # full — весь холст в SUPER_SAMPLING_FACTOR раз больше и уменьшается целиком;
+        # layered — фон и шина сразу в целевом размере, с суперсэмплингом рисуется только слой текста
+        render_mode = get_param('render_mode', 'full')
+        SUPER_SAMPLING_FACTOR = int(get_param('supersampling_factor', 3))  # Можно увеличить до 3 для очень высоких требований
         width_ss = width * SUPER_SAMPLING_FACTOR
         height_ss = height * SUPER_SAMPLING_FACTOR
         # === SUPER SAMPLING/POSTPROCESSING ===
 
-        # 1. Загружаем и подгоняем фон по размеру (Суперсэмплинг)
-        # background = Image.open(background_path).convert('RGBA').resize((width, height), Image.LANCZOS)
-        background = Image.open(background_path).convert('RGBA').resize((width_ss, height_ss), Image.LANCZOS)  # === SUPER SAMPLING/POSTPROCESSING ===
-        img = background.copy()
-        draw = ImageDraw.Draw(img)
-
-        # 2. Открываем оригинал
-        with Image.open(orig_path) as orig_img:
-            orig_img = orig_img.convert('RGBA')
-            logger.info("[PROCESS] Удаление логотипа...")
-            tire_img = remove_logo_from_object(
-                orig_img,
-                task.get('logo_mask'),
-                logo_removal_method=logo_removal_method,
-                debug_path_prefix=(str(output_path).replace('.', '_debug1') if debug_logging else None),
-                params=params
-            )
-            if debug_logging:
-                debug_path = str(output_path).replace('.', '_debug2_nologo.')
-                img_to_save = tire_img
-                if debug_path.lower().endswith(('.jpg', '.jpeg')) and tire_img.mode == 'RGBA':
-                    img_to_save = tire_img.convert('RGB')
-                img_to_save.save(debug_path)
-            logger.info("[PROCESS] Удаление фона...")
-            # Удаляем фон и конвертируем в RGBA для сохранения прозрачности
-            tire_img_nobg = remove(tire_img)
-            if tire_img_nobg.mode != 'RGBA':
-                tire_img_nobg = tire_img_nobg.convert('RGBA')
-            if debug_logging:
-                debug_path = str(output_path).replace('.', '_debug3_nobg.')
-                img_to_save = tire_img_nobg
-                if debug_path.lower().endswith(('.jpg', '.jpeg')) and tire_img_nobg.mode == 'RGBA':
-                    img_to_save = tire_img_nobg.convert('RGB')
-                img_to_save.save(debug_path)
-            logger.info("[PROCESS] Обрезка по содержимому...")
-            tire_img_crop = crop_to_content(tire_img_nobg)
-            if debug_logging:
-                debug_path = str(output_path).replace('.', '_debug4_crop.')
-                img_to_save = tire_img_crop
-                if debug_path.lower().endswith(('.jpg', '.jpeg')) and tire_img_crop.mode == 'RGBA':
-                    img_to_save = tire_img_crop.convert('RGB')
-                img_to_save.save(debug_path)
+        # 1. Базовый слой: фон, подогнанный по размеру (Суперсэмплинг), и неизменные элементы макета.
+        # Готовится один раз на (шаблон, размер) — задача рисует только своё на копии
+        layout = compile_layout(width_ss, height_ss)
+        captions = bool(get_param('draw_index_captions', False))
+        if render_mode == 'layered':
+            base = get_base_layer(background_path, width, height, FONT_PATH_REGULAR if captions else None, WHITE, factor=SUPER_SAMPLING_FACTOR)
+        else:
+            base = get_base_layer(background_path, width_ss, height_ss, FONT_PATH_REGULAR if captions else None, WHITE)  # === SUPER SAMPLING/POSTPROCESSING ===
+        img = base.copy()
+
+        # 2-5. Вырезанная шина (удаление логотипа, фона, обрезка) — из кэша или заново
+        tire_img_crop = prepare_cutout(task, orig_path, output_path, params, debug_logging)
 
         # 6. Отрисовываем все элементы (Суперсэмплинг: подаем увеличенные размеры и шрифты)
-        # draw_tire(img, tire_img_crop, width, height)
-        draw_tire(img, tire_img_crop, width_ss, height_ss)  # === SUPER SAMPLING/POSTPROCESSING ===
+        if render_mode == 'layered':
+            # Шина уменьшается один раз — сразу до размера в макете
+            draw_tire(img, tire_img_crop, width, height, resample_kernel('tire'), factor=SUPER_SAMPLING_FACTOR)
+            text_layer = Image.new('RGBA', (width_ss, height_ss), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(text_layer)
+        else:
+            # draw_tire(img, tire_img_crop, width, height)
+            draw_tire(img, tire_img_crop, width_ss, height_ss, resample_kernel('tire'))  # === SUPER SAMPLING/POSTPROCESSING ===
+            draw = ImageDraw.Draw(img)
 
         # draw_brand(draw, BRAND, width, height, FONT_PATH_BOLD, WHITE, debug_logging)
         draw_brand(draw, BRAND, width_ss, height_ss, FONT_PATH_BOLD, WHITE, debug_logging)  # === SUPER SAMPLING/POSTPROCESSING ===
@@ -787,27 +1231,26 @@ def process_image(task):
         draw_specs(draw, f"{WIDTH_PROFILE}/{HEIGHT_PROFILE}", RIM, width_ss, height_ss, FONT_PATH_SEMIBOLD, FONT_PATH_BOLD, BLACK, CYAN, LIGHT_BG, WHITE, debug_logging)  # === SUPER SAMPLING/POSTPROCESSING ===
 
         # draw_index_box(draw, LOAD_IDX, 'индекс', 'нагрузки', width, height, LOAD_IDX_BG, int(width*COEFF['season_x']), int(height*0.4521), FONT_PATH_BOLD, FONT_PATH_REGULAR, WHITE, debug_logging)
-        draw_index_box(draw, LOAD_IDX, 'индекс', 'нагрузки', width_ss, height_ss, LOAD_IDX_BG, int(width_ss*COEFF['season_x']), int(height_ss*0.4521), FONT_PATH_BOLD, FONT_PATH_REGULAR, WHITE, debug_logging)  # === SUPER SAMPLING/POSTPROCESSING ===
+        draw_index_box(draw, LOAD_IDX, 'индекс', 'нагрузки', width_ss, height_ss, LOAD_IDX_BG, *layout['load_index']['rect'][:2], FONT_PATH_BOLD, FONT_PATH_REGULAR, WHITE, debug_logging)  # === SUPER SAMPLING/POSTPROCESSING ===
 
         # draw_index_box(draw, SPEED_IDX, 'индекс', 'скорости', width, height, SPEED_IDX_BG, int(width*COEFF['season_x']), int(height*0.628), FONT_PATH_BOLD, FONT_PATH_REGULAR, WHITE, debug_logging)
-        draw_index_box(draw, SPEED_IDX, 'индекс', 'скорости', width_ss, height_ss, SPEED_IDX_BG, int(width_ss*COEFF['season_x']), int(height_ss*0.628), FONT_PATH_BOLD, FONT_PATH_REGULAR, WHITE, debug_logging)  # === SUPER SAMPLING/POSTPROCESSING ===
+        draw_index_box(draw, SPEED_IDX, 'индекс', 'скорости', width_ss, height_ss, SPEED_IDX_BG, *layout['speed_index']['rect'][:2], FONT_PATH_BOLD, FONT_PATH_REGULAR, WHITE, debug_logging)  # === SUPER SAMPLING/POSTPROCESSING ===
 
         # --- SUPER SAMPLING: Уменьшаем изображение до целевого размера ---
-        # Сначала применим постобработку для повышения резкости и коррекции цвета (до ресайза)
-        from PIL import ImageEnhance, ImageFilter  # === SUPER SAMPLING/POSTPROCESSING ===
-
-        # Постобработка: Повышение резкости
-        enhancer_sharpness = ImageEnhance.Sharpness(img)
-        img = enhancer_sharpness.enhance(2)  # 1.0 - без изменений, >1 - сильнее
-
-        # Постобработка: Коррекция цвета (насыщенность)
-        enhancer_color = ImageEnhance.Color(img)
-        img = enhancer_color.enhance(1.3)  # 1.0 - без изменений, >1 - сильнее
-
-        # Можно добавить лёгкую фильтрацию для очистки артефактов
-        img = img.filter(ImageFilter.SMOOTH_MORE)  # по желанию
-
-        img = img.resize((width, height), Image.LANCZOS)  # === SUPER SAMPLING/POSTPROCESSING ===
+        # Постобработка (резкость, насыщенность, сглаживание) — цепочка операторов postprocess (см. postprocess.py)
+        post_backend = get_param('postprocess_backend', 'fused')
+        if render_mode == 'layered':
+            img.alpha_composite(downsample_text_layer(text_layer, (width, height), resample_kernel('text_layer')))
+            img = postprocess.apply(img, get_chain_param('postprocess_layered', postprocess.LAYERED_CHAIN), post_backend)
+        else:
+            post_chain = get_chain_param('postprocess', postprocess.DEFAULT_CHAIN)
+            if get_param('postprocess_scale', 'supersampled') == 'target':
+                img = resize_image(img, (width, height), 'final')
+                img = postprocess.apply(img, post_chain, post_backend)
+            else:
+                # Сначала постобработка (до ресайза), затем уменьшение
+                img = postprocess.apply(img, post_chain, post_backend)  # === SUPER SAMPLING/POSTPROCESSING ===
+                img = resize_image(img, (width, height), 'final')  # === SUPER SAMPLING/POSTPROCESSING ===
 
         # --- Сохранение результата ---
         output_filename = task['output_filename']
@@ -823,7 +1266,7 @@ def process_image(task):
 
         if img is None:
             logger.error('[SAVE] Ошибка: img равен None!')
-            return None
+            raise RuntimeError('Итоговое изображение не построено (img равен None)')
 
         img_to_save = img
         if str(final_output_path).lower().endswith(('.jpg', '.jpeg')) and img.mode == 'RGBA':
@@ -832,61 +1275,408 @@ def process_image(task):
 
         final_output_path.parent.mkdir(parents=True, exist_ok=True)
 
-        img_to_save.save(final_output_path, quality=100, subsampling=0)
+        # Запись во временный файл и rename: читатели не видят недописанный файл,
+        # а жёсткая ссылка из кэша результатов (content_cache) не перезаписывается на месте
+        tmp_output_path = final_output_path.with_name(f'.{final_output_path.stem}.{os.getpid()}.tmp{final_output_path.suffix}')
+        img_to_save.save(tmp_output_path, quality=100, subsampling=0)
+        os.replace(tmp_output_path, final_output_path)
         logger.info(f'[SAVE] Файл сохранен: {final_output_path}')
         logger.info(f'[SAVE] Размер файла: {final_output_path.stat().st_size if final_output_path.exists() else "файл не найден"}')
 
         logger.info(f'Результат задачи {task["task_id"]} сохранён: {final_output_path}')
         return str(final_output_path.relative_to(PROCESSED_DIR.parent))
     except Exception as e:
+        # Исключение уходит в process_task: по нему решается, повторять ли задачу
         logger.error(f"[PROCESS] Ошибка обработки изображения: {e}")
-        return None
+        raise
 
-def process_task(task_path):
+def process_task(claim, cutout_source=None):
+    """
+    Обработка захваченной задачи (TaskClaim: файл или запись SQLite) и запись результата.
+    cutout_source — ключ вырезки похожей задачи пакета, которую можно использовать (см. plan_task_batch).
+    Возвращает (статус, текст ошибки, номер попытки); статус: 'success', 'retry' (временная ошибка,
+    попытки ещё есть) или 'error' (постоянная ошибка или попытки исчерпаны).
+    """
+    import traceback
+    task = {}
+    attempt = 1
+    status = 'error'
+    output_image = None
+    cache_hit = False
+    output_sha256 = None
+    error_msg = None
     try:
-        with open(task_path, 'r', encoding='utf-8') as f:
-            task = json.load(f)
+        task = claim.read()
+        attempt = (task.get('_retry') or {}).get('attempts', 0) + 1
         ok, err = validate_task_json(task)
-        task_id = task.get('task_id', task_path.stem)
         if not ok:
-            logger.error(f'Ошибка валидации задачи {task_id}: {err}')
-            return
-        logger.info(f'Обработка задачи {task_id}')
-        error_msg = None
-        output_image = None
-        try:
-            output_image = process_image(task)
-        except Exception as e:
-            import traceback
-            error_msg = str(e) + '\n' + traceback.format_exc()
-            logger.error(f'Ошибка обработки изображения: {error_msg}')
-        status = 'success' if output_image else 'error'
-        result = {
-            'task_id': task_id,
-            'status': status,
-            'output_image': output_image,
-            'message': 'OK' if output_image else (error_msg or 'Ошибка обработки'),
-            'started_at': '',
-            'finished_at': '',
-            'error': error_msg
-        }
-        result_path = RESULTS_DIR / f'{task_id}.json'
+            raise PermanentTaskError(f'Ошибка валидации задачи: {err}')
+        logger.info(f'Обработка задачи {task["task_id"]} (попытка {attempt})')
+        if cutout_source:
+            task[CUTOUT_SOURCE_FIELD] = str(cutout_source)
+        output_image, cache_hit, output_sha256 = process_image_cached(task)
+        status = 'success'
+    except Exception as e:
+        error_msg = str(e) + '\n' + traceback.format_exc()
+        if should_retry(e, attempt, get_task_queue().max_attempts):
+            status = 'retry'
+        logger.error(f'Ошибка обработки задачи {claim.name} (попытка {attempt}, {"будет повтор" if status == "retry" else "без повтора"}): {error_msg}')
+    task_id = task.get('task_id', Path(claim.name).stem) if isinstance(task, dict) else Path(claim.name).stem
+    result = {
+        'task_id': task_id,
+        'status': status,
+        'output_image': output_image,
+        'message': 'OK' if output_image else (error_msg or 'Ошибка обработки'),
+        'started_at': '',
+        'finished_at': '',
+        'error': error_msg,
+        'attempt': attempt,
+        'cache_hit': cache_hit,
+        'output_sha256': output_sha256,
+    }
+    write_task_result(result)
+    return status, error_msg, attempt
+
+def write_task_result(result):
+    """
+    results/<task_id>.json и запись в журнал результатов.
+    """
+    try:
+        result_path = RESULTS_DIR / f'{result["task_id"]}.json'
         with open(result_path, 'w', encoding='utf-8') as f:
             json.dump(result, f, ensure_ascii=False, indent=2)
+        journal = get_results_journal()
+        if journal is not None:
+            journal.append(result)
     except Exception as e:
-        logger.error(f'Ошибка при обработке {task_path}: {e}')
+        logger.error(f'Ошибка записи результата {result["task_id"]}: {e}')
+
+_task_queue = None
 
-def main():
-    task_files = list(TASKS_DIR.glob('*.json'))[:BATCH_SIZE]
-    for task_file in task_files:
-        process_task(task_file)
+def get_task_queue():
+    global _task_queue
+    if _task_queue is None or _task_queue.tasks_dir != TASKS_DIR:
+        options = dict(
+            lease_seconds=config.get('task_lease_seconds', 300),
+            max_attempts=config.get('task_max_attempts', 3),
+            backoff_seconds=config.get('retry_backoff_seconds', 30),
+            backoff_max_seconds=config.get('retry_backoff_max_seconds', 1800),
+        )
+        if config.get('queue_backend', 'files') == 'sqlite':
+            from sqlite_queue import SqliteTaskQueue
+            db_path = (PROJECT_ROOT / config.get('queue_db', 'uploads/ai_image/queue.db')).resolve()
+            _task_queue = SqliteTaskQueue(db_path, tasks_dir=TASKS_DIR, **options)
+        else:
+            from task_queue import TaskQueue
+            _task_queue = TaskQueue(TASKS_DIR, **options)
+    return _task_queue
+
+_results_journal = None
+
+def get_results_journal():
+    """
+    Журнал результатов с курсором для потребителей (results/journal.db); None — если выключен.
+    """
+    global _results_journal
+    if not config.get('results_journal', True):
+        return None
+    db_path = RESULTS_DIR / 'journal.db'
+    if _results_journal is None or _results_journal.db_path != db_path:
+        from results_journal import ResultsJournal
+        _results_journal = ResultsJournal(
+            db_path,
+            retain_days=config.get('results_journal_retain_days', 30),
+            max_records=config.get('results_journal_max_records', 100000),
+            archive_keep=config.get('results_journal_archives', 10),
+        )
+    return _results_journal
+
+def compact_results_journal():
+    try:
+        journal = get_results_journal()
+        if journal is not None:
+            journal.compact()
+    except Exception as e:
+        logger.error(f'[JOURNAL] Ошибка сжатия журнала: {e}')
+
+def run_task(task_file, cutout_source=None):
+    """
+    Захват задачи (rename в processing/), обработка, затем перенос в done/, failed/
+    или обратно в tasks/ с отложенным повтором.
+    False — задачу уже забрал другой воркер или обработка не удалась.
+    """
+    queue = get_task_queue()
+    claim = queue.claim(task_file)
+    if claim is None:
+        return False
+    with claim:
+        status, error_msg, attempt = process_task(claim, cutout_source)
+    if status == 'success':
+        queue.finish(claim, True)
+        return True
+    queue.record_attempt(claim, attempt, error_msg)
+    if status == 'retry':
+        delay = queue.retry_delay(attempt)
+        logger.warning(f'[QUEUE] Задача {claim.name}: попытка {attempt}/{queue.max_attempts} не удалась, повтор через {delay:.0f} с')
+        queue.retry(claim, delay)
+    else:
+        logger.error(f'[QUEUE] Задача {claim.name} перенесена в failed/ после попытки {attempt}')
+        queue.finish(claim, False)
+    return False
+
+def run_planned_task(job):
+    """
+    job = (задача, cutout_source) из plan_task_batch.
+    Возвращает (успех, pid, счётчики кэшей процесса) — для сводки пакета в родителе.
+    """
+    return run_task(*job), os.getpid(), cache_counters()
+
+def plan_task_batch(task_refs):
+    """
+    Этапы пакета: сначала лидеры групп одинаковых и похожих оригиналов, затем остальные задачи групп
+    (их вырезки к этому времени уже в кэше). Каждый этап — список (задача, cutout_source);
+    cutout_source — ключ вырезки лидера (с его параметрами и размером декодирования) для похожих снимков.
+    """
+    jobs = [(ref, None) for ref in task_refs]
+    if len(task_refs) < 2 or not config.get('batch_dedup', True) or get_cutout_cache() is None:
+        return [jobs]
+    from batch_planner import plan_batch
+    from content_cache import canonical_json
+    queue = get_task_queue()
+    items = []
+    standalone = []
+    peeked = {}
+    for ref in task_refs:
+        task = queue.peek(ref)
+        try:
+            ok, _ = validate_task_json(task) if task is not None else (False, None)
+            path = task_files(task)['original'] if ok else None
+        except Exception:
+            path = None
+        if path is None or not os.path.isfile(path):
+            standalone.append((ref, None))
+            continue
+        params = task.get('params') or {}
+        peeked[ref] = (task, path, params)
+        items.append((ref, path, canonical_json(cutout_signature(task, params))))
+    leaders, members = plan_batch(
+        items, config.get('dedup_hamming_threshold', 4), config.get('max_image_pixels', 50_000_000),
+        config.get('dedup_max_thumb_diff', 6.0)
+    )
+    jobs = []
+    for ref, leader in members:
+        source_key = None
+        if leader is not None:
+            try:
+                source_key = cutout_cache_key(*peeked[leader])
+            except Exception as e:
+                logger.warning(f'[DEDUP] Ключ вырезки лидера {getattr(leader, "name", leader)} не вычислен: {e}')
+        jobs.append((ref, source_key))
+    return [stage for stage in (standalone + leaders, jobs) if stage]
+
+def init_pool_worker(log_level=None):
+    """
+    Инициализация процесса пула main(): свои сессии onnxruntime и прогрев моделей (один раз на процесс).
+    log_level задаётся только для spawn — там логгер настраивается заново.
+    """
+    if log_level:
+        # В spawn-процессе модульная настройка логгера (с ротацией) выполнилась заново — заменяем её дозаписью
+        logger.remove()
+        logger.add(str(LOGS_DIR / 'processor.log'), level=log_level, enqueue=True)
+    MODEL_REGISTRY.drop_fork_unsafe()
+    warmup_models()
+
+def main(workers=1):
+    queue = get_task_queue()
+    queue.reclaim_expired()
+    task_files = queue.pending(BATCH_SIZE)
+    started = time.monotonic()
+    stages = plan_task_batch(task_files)
+    if workers > 1 and len(task_files) > 1:
+        from worker_pool import fork_available, run_process_pool
+        if fork_available():
+            preload_models()
+            outcomes = run_process_pool(run_planned_task, stages, workers, 'fork', initializer=init_pool_worker)
+        else:
+            check_model_files()
+            log_level = 'DEBUG' if args.debug else 'INFO'
+            outcomes = run_process_pool(run_planned_task, stages, workers, 'spawn', initializer=init_pool_worker, initargs=(log_level,))
+    else:
+        check_model_files()
+        outcomes = [run_planned_task(job) for stage in stages for job in stage]
+    elapsed = time.monotonic() - started
+    compact_results_journal()
+    # Счётчики накопительные: от каждого процесса берётся последний снимок
+    latest = {pid: counters for _, pid, counters in outcomes}
+    totals = {}
+    for counters in latest.values():
+        for name, (hits, misses) in counters.items():
+            total_hits, total_misses = totals.get(name, (0, 0))
+            totals[name] = (total_hits + hits, total_misses + misses)
+    log_cache_summary(totals)
+    if task_files:
+        logger.info(f'[BATCH] Задач: {len(task_files)}, воркеров: {min(workers, len(task_files))}, время: {elapsed:.1f} с, {len(task_files) / max(elapsed, 1e-6):.2f} задач/с')
+
+def preload_models():
+    """
+    Загрузка весов без инференса (для preload-then-fork): пулы потоков torch/onnxruntime
+    создаются уже в воркерах, а страницы с весами остаются общими.
+    """
+    check_model_files()
+    if saliency_backend(config.get('saliency_precision', 'fp32')) == 'torch':
+        try:
+            get_u2net_predictor()
+        except FileNotFoundError as e:
+            logger.warning(f'[MODELS] Предзагрузка U2NET пропущена: {e}')
+
+def run_daemon(worker_index=0, workers=1):
+    """
+    Постоянный режим: модели загружаются и прогреваются один раз,
+    затем папка задач отслеживается (inotify или опрос) и каждая новая задача обрабатывается сразу.
+    Задачи захватываются атомарно (см. task_queue), поэтому воркеры и узлы могут делить одну папку.
+    """
+    from task_watcher import TaskWatcher
+    stop = {'requested': False}
+    def request_stop(signum, frame):
+        logger.info(f'[DAEMON] Получен сигнал {signum}, завершение после текущей задачи')
+        stop['requested'] = True
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    if workers > 1:
+        MODEL_REGISTRY.drop_fork_unsafe()
+    else:
+        check_model_files()
+    warmup_models()
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    queue = get_task_queue()
+    watcher = TaskWatcher(TASKS_DIR, poll_interval=DAEMON_POLL_INTERVAL)
+    logger.info(f'[DAEMON] Воркер {worker_index + 1}/{workers}: ожидание задач в {TASKS_DIR} (режим: {watcher.mode})')
+    next_sweep = 0
+    next_compact = time.monotonic() + 3600
+    pending = watcher.scan()
+    try:
+        while not stop['requested']:
+            if time.monotonic() >= next_sweep:
+                # Возврат задач с истёкшей арендой и подбор отложенных повторов, время которых подошло
+                queue.reclaim_expired()
+                due = queue.pending()
+                pending = pending + [p for p in due if p not in pending]
+                next_sweep = time.monotonic() + min(queue.lease_seconds / 2, queue.backoff_seconds)
+            if time.monotonic() >= next_compact:
+                if worker_index == 0:
+                    compact_results_journal()
+                log_cache_summary(cache_counters())
+                next_compact = time.monotonic() + 3600
+            jobs = [job for stage in plan_task_batch(pending) for job in stage]
+            for task_file, cutout_source in jobs:
+                if stop['requested']:
+                    break
+                run_task(task_file, cutout_source)
+            pending = watcher.wait()
+    finally:
+        watcher.close()
+    logger.info('[DAEMON] Остановлен')
+
+def retemplate_task(job):
+    """
+    Перерисовка одной готовой задачи: вырезка из кэша, заново только композит, постобработка и сохранение.
+    job = (задача с новыми template/params, compute_missing). Возвращает 'rendered', 'skipped' или 'failed'.
+    """
+    task, compute_missing = job
+    task_id = task.get('task_id')
+    try:
+        files = task_files(task)
+        cache = get_cutout_cache()
+        params = task.get('params') or {}
+        decode_size = original_decode_size(files['original'], params)[1]
+        if not compute_missing and not cache.contains(cutout_cache_key(task, files['original'], params), decode_size):
+            logger.warning(f'[RETEMPLATE] {task_id}: вырезки нужного размера нет в кэше, пропуск (--compute-missing — обработать полностью)')
+            return 'skipped'
+        output_image, cache_hit, output_sha256 = process_image_cached(task)
+    except Exception as e:
+        logger.error(f'[RETEMPLATE] {task_id}: {e}')
+        return 'failed'
+    write_task_result({
+        'task_id': task_id,
+        'status': 'success',
+        'output_image': output_image,
+        'message': 'OK (retemplate)',
+        'started_at': '',
+        'finished_at': '',
+        'error': None,
+        'cache_hit': cache_hit,
+        'output_sha256': output_sha256,
+        'retemplate': True,
+    })
+    return 'rendered'
+
+def run_retemplate(selection, template=None, params=None, workers=1, compute_missing=False):
+    """
+    Массовая перерисовка готовых задач (после смены шаблона, шрифтов, цветов) без удаления логотипа и фона.
+    selection — 'all' или список task_id.
+    """
+    if get_cutout_cache() is None:
+        logger.error('[RETEMPLATE] Кэш вырезок выключен (cutout_cache: false) — перерисовка невозможна')
+        return {}
+    task_ids = None if selection == 'all' else [t.strip() for t in selection.split(',') if t.strip()]
+    jobs = []
+    for task in get_task_queue().done_tasks(task_ids):
+        if template:
+            task['template'] = template
+        if params:
+            task['params'] = dict(task.get('params') or {}, **params)
+        jobs.append((task, compute_missing))
+    logger.info(f'[RETEMPLATE] Задач к перерисовке: {len(jobs)}')
+    started = time.monotonic()
+    if workers > 1 and len(jobs) > 1:
+        from worker_pool import fork_available, run_process_pool
+        start_method = 'fork' if fork_available() else 'spawn'
+        log_level = None if start_method == 'fork' else ('DEBUG' if args.debug else 'INFO')
+        # Модели не нужны: вырезки берутся из кэша (с --compute-missing модели загрузятся по требованию)
+        outcomes = run_process_pool(retemplate_task, [jobs], workers, start_method, initializer=init_retemplate_worker, initargs=(log_level,))
+    else:
+        outcomes = [retemplate_task(job) for job in jobs]
+    elapsed = time.monotonic() - started
+    summary = {outcome: outcomes.count(outcome) for outcome in ('rendered', 'skipped', 'failed')}
+    logger.info(
+        f"[RETEMPLATE] Перерисовано: {summary['rendered']}, пропущено: {summary['skipped']}, ошибок: {summary['failed']}, "
+        f"время: {elapsed:.1f} с, {len(jobs) / max(elapsed, 1e-6):.2f} задач/с"
+    )
+    return summary
+
+def init_retemplate_worker(log_level=None):
+    if log_level:
+        logger.remove()
+        logger.add(str(LOGS_DIR / 'processor.log'), level=log_level, enqueue=True)
+    MODEL_REGISTRY.drop_fork_unsafe()
 
 if __name__ == '__main__':
     debug = args.debug
+    # При нескольких воркерах записи идут через очередь — строки разных процессов не перемешиваются
+    enqueue = args.workers > 1
     if debug:
         logger.remove()
-        logger.add(str(LOGS_DIR / 'processor.log'), level='DEBUG')
+        logger.add(str(LOGS_DIR / 'processor.log'), level='DEBUG', enqueue=enqueue)
     else:
         logger.remove()
-        logger.add(str(LOGS_DIR / 'processor.log'), level='INFO')
-    main()
+        logger.add(str(LOGS_DIR / 'processor.log'), level='INFO', enqueue=enqueue)
+    if args.daemon and args.workers > 1:
+        from worker_pool import fork_available, run_forked_workers
+        if fork_available():
+            run_forked_workers(
+                args.workers, run_daemon, preload=preload_models,
+                memory_report_interval=config.get('memory_report_interval', 300)
+            )
+        else:
+            logger.warning('[WORKERS] fork недоступен на этой платформе, запуск одного воркера')
+            run_daemon()
+    elif args.daemon:
+        run_daemon()
+    elif args.retemplate:
+        run_retemplate(
+            args.retemplate, template=args.template, params=json.loads(args.params) if args.params else None,
+            workers=args.workers, compute_missing=args.compute_missing
+        )
+    else:
+        main(args.workers)
@@ -0,0 +1,136 @@
+import numpy as np
+from loguru import logger
+
+from content_cache import file_sha256
+
+# --- Дедупликация оригиналов внутри пакета ---
+# Задачи пакета группируются по точному хэшу оригинала (sha256) и по перцептивному хэшу (dHash):
+# один и тот же снимок, пересохранённый или уменьшенный, даёт близкие dHash.
+# В группе сначала обрабатывается лидер (оригинал с наибольшим разрешением), затем остальные:
+# точные копии получают вырезку из кэша по тому же ключу, похожие — вырезку лидера (см. prepare_cutout).
+# Похожесть по dHash подтверждается сравнением миниатюр THUMB_SIDE x THUMB_SIDE (средняя разница
+# яркости не больше max_thumb_diff): dHash не видит сдвига яркости и мелких отличий (другая шина той же серии).
+# Группы строятся только среди задач с одинаковым методом удаления логотипа/фона (signature).
+
+THUMB_SIDE = 32
+# Допустимое отличие пропорций похожих снимков
+ASPECT_TOLERANCE = 0.02
+
+
+def dhash(path, hash_size=8, max_pixels=None):
+    """
+    Разностный хэш (dHash) изображения: hash_size * hash_size бит. Возвращает (хэш, (ширина, высота)).
+    Изображение больше max_pixels (по заголовку) не декодируется — ValueError.
+    """
+    from PIL import Image
+    with Image.open(path) as img:
+        size = img.size
+        if max_pixels and size[0] * size[1] > max_pixels:
+            raise ValueError(f'{size[0]}x{size[1]} больше max_image_pixels')
+        # JPEG декодируется сразу в уменьшенном масштабе
+        img.draft('L', (hash_size * 8, hash_size * 8))
+        small = img.convert('L').resize((hash_size + 1, hash_size), Image.BOX)
+    pixels = np.asarray(small, dtype=np.int16)
+    # Бит на пару соседних пикселей строки, по строкам слева направо
+    value = 0
+    for bit in (pixels[:, :-1] > pixels[:, 1:]).ravel():
+        value = (value << 1) | int(bit)
+    return value, size
+
+
+def thumbnail(path, side=THUMB_SIDE):
+    """
+    Миниатюра side x side в оттенках серого (без сохранения пропорций) для подтверждения похожести.
+    """
+    from PIL import Image
+    with Image.open(path) as img:
+        img.draft('L', (side * 4, side * 4))
+        return img.convert('L').resize((side, side), Image.BOX)
+
+
+def thumbnail_diff(a, b):
+    """
+    Средняя абсолютная разница миниатюр (уровней яркости, 0-255).
+    """
+    from PIL import ImageChops, ImageStat
+    return ImageStat.Stat(ImageChops.difference(a, b)).mean[0]
+
+
+def _label(ref):
+    # ref — путь к файлу задачи или task_id (очередь в SQLite)
+    return getattr(ref, 'name', ref)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def plan_batch(items, hamming_threshold=4, max_pixels=None, max_thumb_diff=6.0):
+    """
+    items — список (ref, путь к оригиналу, signature). Порядок items сохраняется внутри этапов.
+    Возвращает (leaders, members): leaders — [(ref, None)], members — [(ref, ref лидера)];
+    для точной копии ref лидера — None (её вырезка в кэше под тем же ключом).
+    hamming_threshold < 0 — только точные копии. max_pixels — оригиналы больше не хэшируются (см. dhash).
+    max_thumb_diff — порог подтверждения похожести по миниатюрам (см. thumbnail_diff).
+    """
+    infos = []
+    for index, (ref, path, signature) in enumerate(items):
+        try:
+            digest = file_sha256(path)
+            phash, size = dhash(path, max_pixels=max_pixels) if hamming_threshold >= 0 else (None, (0, 0))
+        except Exception as e:
+            # Нечитаемый оригинал — задача обрабатывается сама по себе (ошибку сформирует process_image)
+            logger.warning(f'[DEDUP] {_label(ref)}: хэш оригинала не вычислен ({e})')
+            digest, phash, size = None, None, (0, 0)
+        infos.append((index, ref, path, signature, digest, phash, size))
+
+    # Лидером группы становится оригинал с наибольшим разрешением
+    by_area = sorted(infos, key=lambda info: (-info[6][0] * info[6][1], info[0]))
+    exact = {}
+    groups = {}
+    source_of = {}
+    for index, ref, path, signature, digest, phash, size in by_area:
+        if digest is None:
+            continue
+        leader = exact.get((signature, digest))
+        if leader is not None:
+            source_of[index] = None
+            logger.info(f'[DEDUP] {_label(ref)}: тот же оригинал, что у {_label(leader[1])} — вырезка будет взята из кэша')
+            continue
+        if phash is not None:
+            best = None
+            for leader_info in groups.get(signature, []):
+                distance = hamming(phash, leader_info[5])
+                if distance <= hamming_threshold and (best is None or distance < best[0]):
+                    best = (distance, leader_info)
+            if best is not None:
+                distance, leader_info = best
+                confirmed, reason = _confirm_similar(path, size, leader_info[2], leader_info[6], max_thumb_diff)
+                if confirmed:
+                    source_of[index] = leader_info[1]
+                    logger.info(f'[DEDUP] {_label(ref)}: похож на {_label(leader_info[1])} (расстояние dHash {distance}, {reason}) — используется его вырезка')
+                    continue
+                logger.info(f'[DEDUP] {_label(ref)}: dHash близок к {_label(leader_info[1])} ({distance}), но снимки различаются ({reason}) — своя вырезка')
+        exact[(signature, digest)] = (index, ref)
+        groups.setdefault(signature, []).append((index, ref, path, signature, digest, phash, size))
+
+    leaders = [(ref, None) for index, ref, *_ in infos if index not in source_of]
+    members = [(ref, source_of[index]) for index, ref, *_ in infos if index in source_of]
+    if members:
+        logger.info(f'[DEDUP] Задач в пакете: {len(infos)}, уникальных вырезок: {len(leaders)}, повторное использование: {len(members)}')
+    return leaders, members
+
+
+def _confirm_similar(path, size, leader_path, leader_size, max_thumb_diff):
+    """
+    (похожи ли снимки, пояснение для лога): пропорции совпадают и разница миниатюр не больше max_thumb_diff.
+    """
+    aspect, leader_aspect = size[0] / size[1], leader_size[0] / leader_size[1]
+    if abs(aspect - leader_aspect) > ASPECT_TOLERANCE * leader_aspect:
+        return False, 'другие пропорции'
+    try:
+        diff = thumbnail_diff(thumbnail(path), thumbnail(leader_path))
+    except Exception as e:
+        logger.warning(f'[DEDUP] Миниатюра {path} не построена ({e})')
+        return False, 'нет миниатюры'
+    return diff <= max_thumb_diff, f'разница миниатюр {diff:.1f}'
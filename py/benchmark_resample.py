@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+import resampling
+
+# --- Ресайз в местах вызова ai_image_processor.py: время и отличие от LANCZOS по каждому ядру ---
+# python benchmark_resample.py --template ../uploads/ai_image/templates/test_template.jpg --original <фото шины>
+# Размеры — как при отрисовке карточки 620x826 с суперсэмплингом x3 (render_mode full и layered).
+
+KERNELS = ('lanczos', 'reduce', 'area', 'auto')
+
+
+def measure(img, size, kernel, runs, box=None):
+    """
+    Результат и время ресайза (мс, минимум по прогонам).
+    """
+    out = resampling.resize(img, size, kernel, box=box)
+    best = float('inf')
+    for _ in range(runs):
+        started = time.perf_counter()
+        resampling.resize(img, size, kernel, box=box)
+        best = min(best, (time.perf_counter() - started) * 1000)
+    return out, best
+
+
+def build_sites(template, original, width, height, factor):
+    """
+    [(место, изображение, целевой размер, box)] с размерами, как в process_image.
+    """
+    width_ss, height_ss = width * factor, height * factor
+    canvas = template.convert('RGBA').resize((width_ss, height_ss), Image.LANCZOS)
+    # Шина в макете занимает около 0.8 ширины холста; вырезка — RGBA с прозрачным фоном
+    tire = original.convert('RGBA')
+    tire_w = int(width_ss * 0.8)
+    tire_size = (tire_w, int(tire_w * tire.height / tire.width))
+    text_layer = Image.new('RGBa', (width_ss, height_ss), (0, 0, 0, 0))
+    text_layer.paste(canvas.crop((0, 0, width_ss, height_ss // 3)).convert('RGBa'), (0, 0))
+    scale = max(original.size) / 720
+    runway_size = (max(1, int(original.width / scale)), max(1, int(original.height / scale))) if scale > 1 else original.size
+    return [
+        ('template', template.convert('RGBA'), (width_ss, height_ss), None),
+        ('base', canvas, (width, height), None),
+        ('tire', tire, tire_size, None),
+        ('tire (layered)', tire, (tire_size[0] // factor, tire_size[1] // factor), (0.5, 0.5, tire.width - 0.5, tire.height - 0.5)),
+        ('text_layer', text_layer, (width, height), None),
+        ('final', canvas, (width, height), None),
+        ('runwayml', original.convert('RGB'), runway_size, None),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение ядер ресайза по местам вызова')
+    parser.add_argument('--template', default='../uploads/ai_image/templates/test_template.jpg')
+    parser.add_argument('--original', default=None, help='Фото шины (по умолчанию — синтетическое 2000x2000)')
+    parser.add_argument('--width', type=int, default=620)
+    parser.add_argument('--height', type=int, default=826)
+    parser.add_argument('--factor', type=int, default=3, help='supersampling_factor')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    if not Path(args.template).exists():
+        print(f'Шаблон не найден: {args.template}')
+        sys.exit(1)
+    template = Image.open(args.template)
+    if args.original:
+        original = Image.open(args.original)
+    else:
+        rng = np.random.default_rng(0)
+        original = Image.fromarray(rng.integers(0, 256, (250, 250, 3), dtype=np.uint8)).resize((2000, 2000), Image.BICUBIC)
+
+    print(f'{"место":<16}{"размер":>24}  ' + ''.join(f'{k:>18}' for k in KERNELS))
+    for site, img, size, box in build_sites(template, original, args.width, args.height, args.factor):
+        reference = None
+        cells = []
+        for kernel in KERNELS:
+            out, ms = measure(img, size, kernel, args.runs, box=box)
+            arr = np.asarray(out.convert('RGBA')).astype(np.int16)
+            if reference is None:
+                reference = arr
+                cells.append(f'{ms:8.1f} мс')
+            else:
+                cells.append(f'{ms:8.1f} мс ±{np.abs(arr - reference).mean():.2f}')
+        chosen = resampling.choose_kernel(img.size, size, box)
+        dims = f'{img.width}x{img.height}->{size[0]}x{size[1]}'
+        print(f'{site:<16}{dims:>24}  ' + ''.join(f'{c:>18}' for c in cells) + f'   auto={chosen}')
+    print('±: среднее отличие от LANCZOS (уровней на канал)')
+
+
+if __name__ == '__main__':
+    main()
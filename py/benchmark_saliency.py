@@ -0,0 +1,113 @@
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+# --- Сравнение вариантов модели салентности (бэкенд/модель) по скорости и совпадению масок ---
+# python benchmark_saliency.py --images ../uploads/ai_image/originals --reference torch:u2net --candidate onnx:u2net
+# Вариант задаётся строкой "бэкенд:модель[:точность]", например torch:u2net, onnx:u2net, onnx:u2net:int8.
+# Дрейф INT8 относительно fp32 на валидационной папке:
+# python benchmark_saliency.py --images <папка> --reference onnx:u2net --candidate onnx:u2net:int8 --min-iou 0.97
+# Быстрый режим U2NETP против U2NET (отчёт по каждому изображению в CSV):
+# python benchmark_saliency.py --images <папка> --reference torch:u2net --candidate torch:u2netp --min-iou 0.9 --report u2netp.csv
+
+IMG_EXTS = ['.jpg', '.jpeg', '.png', '.webp']
+
+
+def load_predictor(spec, weights_dir, num_threads):
+    from u2net import U2NETPredictor
+    backend, model_name, *rest = spec.split(':')
+    precision = rest[0] if rest else 'fp32'
+    weights_path = Path(weights_dir) / f'{model_name}.pth'
+    return U2NETPredictor(weights_path=weights_path, device='cpu', model_name=model_name, backend=backend, num_threads=num_threads, precision=precision)
+
+
+def run_variant(predictor, images, runs):
+    """
+    Карты и время на каждое изображение (мс, минимум по прогонам).
+    """
+    # Первый прогон — прогрев, в замер не входит
+    predictor.predict_batch(images[:1])
+    timings = [float('inf')] * len(images)
+    maps = [None] * len(images)
+    for _ in range(runs):
+        for i, img in enumerate(images):
+            started = time.perf_counter()
+            maps[i] = predictor.predict_batch([img])[0]
+            timings[i] = min(timings[i], (time.perf_counter() - started) * 1000)
+    return maps, timings
+
+
+def compare_maps(reference, candidate, level=128):
+    """
+    Для каждой пары карт: макс. отклонение вероятности, доля несовпавших пикселей маски и IoU масок.
+    """
+    stats = []
+    for ref, cand in zip(reference, candidate):
+        ref_mask = ref.threshold(level)
+        cand_mask = cand.threshold(level)
+        union = np.count_nonzero(ref_mask | cand_mask)
+        iou = np.count_nonzero(ref_mask & cand_mask) / union if union else 1.0
+        stats.append({
+            'max_diff': float(np.abs(ref.prob - cand.prob).max()),
+            'mismatch': float(np.count_nonzero(ref_mask != cand_mask) / ref_mask.size),
+            'iou': iou,
+        })
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк и сверка масок U2NET для разных бэкендов')
+    parser.add_argument('--images', type=str, default=str(Path(__file__).parent / 'test_assets'))
+    parser.add_argument('--weights-dir', type=str, default=str(Path(__file__).parent))
+    parser.add_argument('--reference', type=str, default='torch:u2net')
+    parser.add_argument('--candidate', type=str, default='onnx:u2net')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='Число потоков onnxruntime (0 — по умолчанию)')
+    parser.add_argument('--limit', type=int, default=50, help='Максимум изображений из папки')
+    parser.add_argument('--tolerance', type=float, default=0.001, help='Допустимая доля несовпавших пикселей маски (>128)')
+    parser.add_argument('--min-iou', type=float, default=None, help='Минимальный допустимый IoU масок (вместо --tolerance)')
+    parser.add_argument('--report', type=str, default=None, help='Сохранить отчёт по изображениям в CSV')
+    cli_args = parser.parse_args()
+
+    paths = sorted(p for p in Path(cli_args.images).iterdir() if p.suffix.lower() in IMG_EXTS)[:cli_args.limit]
+    if not paths:
+        print(f'Нет изображений в {cli_args.images}')
+        sys.exit(1)
+    images = [Image.open(p).convert('RGB') for p in paths]
+    print(f'Изображений: {len(images)}')
+
+    ref_maps, ref_times = run_variant(load_predictor(cli_args.reference, cli_args.weights_dir, cli_args.threads), images, cli_args.runs)
+    cand_maps, cand_times = run_variant(load_predictor(cli_args.candidate, cli_args.weights_dir, cli_args.threads), images, cli_args.runs)
+    stats = compare_maps(ref_maps, cand_maps)
+
+    for path, st, ref_t, cand_t in zip(paths, stats, ref_times, cand_times):
+        st.update({'image': path.name, 'reference_ms': ref_t, 'candidate_ms': cand_t})
+        print(f'{path.name}: max_diff={st["max_diff"]:.5f}, mismatch={st["mismatch"]:.5f}, IoU={st["iou"]:.4f}, {ref_t:.1f} мс -> {cand_t:.1f} мс')
+    if cli_args.report:
+        with open(cli_args.report, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['image', 'iou', 'mismatch', 'max_diff', 'reference_ms', 'candidate_ms'])
+            writer.writeheader()
+            writer.writerows(stats)
+        print(f'Отчёт сохранён: {cli_args.report}')
+    ref_ms = float(np.mean(ref_times))
+    cand_ms = float(np.mean(cand_times))
+    worst = max(st['mismatch'] for st in stats)
+    worst_iou = min(st['iou'] for st in stats)
+    print(f'{cli_args.reference}: {ref_ms:.1f} мс/изобр.')
+    print(f'{cli_args.candidate}: {cand_ms:.1f} мс/изобр. (x{ref_ms / cand_ms:.2f})')
+    print(f'Средний IoU: {np.mean([st["iou"] for st in stats]):.4f}, худший IoU: {worst_iou:.4f}, худшая доля несовпадений: {worst:.5f}')
+    if cli_args.min_iou is not None:
+        if worst_iou < cli_args.min_iou:
+            print(f'ВНИМАНИЕ: IoU ниже допуска {cli_args.min_iou}')
+            sys.exit(1)
+    elif worst > cli_args.tolerance:
+        print(f'ВНИМАНИЕ: несовпадение масок выше допуска {cli_args.tolerance}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from loguru import logger
+
+# --- Кэш по содержимому входов ---
+# file_sha256 — хэш файла с запоминанием по (путь, размер, mtime): повторно файл не читается, пока не изменился.
+# OutputCache — готовые изображения по ключу из хэшей входных файлов и канонического JSON
+# product_data/params: повторная отправка той же задачи не запускает удаление логотипа, rembg и композит.
+# CutoutCache — вырезанная шина (после удаления логотипа, фона и обрезки) по хэшу оригинала и методу:
+# разные размеры одной модели с общим фото не вызывают RunwayML/rembg повторно. Размер, до которого
+# был уменьшен оригинал, записан в EXIF вырезки: вырезка из большего оригинала подходит и для меньшего.
+
+_HASH_CACHE = {}
+_HASH_CACHE_MAX = 4096
+_HASH_LOCK = threading.Lock()
+# Тег EXIF ImageDescription: "decode_size WxH" — размер оригинала, из которого получена вырезка
+DECODE_SIZE_TAG = 0x010E
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """
+    sha256 содержимого файла (hex). Результат запоминается, пока не изменились размер и mtime.
+    """
+    path = os.path.abspath(str(path))
+    st = os.stat(path)
+    stamp = (path, st.st_size, st.st_mtime_ns)
+    with _HASH_LOCK:
+        digest = _HASH_CACHE.get(stamp)
+    if digest is not None:
+        return digest
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _HASH_LOCK:
+        if len(_HASH_CACHE) >= _HASH_CACHE_MAX:
+            _HASH_CACHE.clear()
+        _HASH_CACHE[stamp] = digest
+    return digest
+
+
+def canonical_json(obj):
+    """
+    Однозначная сериализация: порядок ключей и пробелы не влияют на ключ кэша.
+    """
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def content_key(*parts):
+    return hashlib.sha256(canonical_json(parts).encode('utf-8')).hexdigest()
+
+
+def link_or_copy(src, dst, link=True):
+    """
+    Жёсткая ссылка (мгновенно, без лишнего места), если нельзя — копия. Существующий dst заменяется.
+    """
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f'.{dst.name}.{os.getpid()}.tmp')
+    if link:
+        try:
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class OutputCache:
+    """
+    <cache_dir>/<key[:2]>/<key><расширение> + <key>.json (sha256 и размер готового файла).
+    В кэш кладётся копия (только для чтения), из кэша в processed/ — жёсткая ссылка:
+    поэтому файлы в processed/ нельзя перезаписывать на месте, только заменять (запись во временный файл + rename).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, key, suffix):
+        base = self.cache_dir / key[:2] / key
+        return base.with_name(key + suffix), base.with_name(key + '.json')
+
+    def fetch(self, key, output_path):
+        """
+        Кладёт закэшированный результат в output_path. Возвращает sha256 результата или None (промах).
+        """
+        output_path = Path(output_path)
+        data_path, meta_path = self._paths(key, output_path.suffix.lower())
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if data_path.stat().st_size != meta['size']:
+                return None
+            link_or_copy(data_path, output_path)
+        except (OSError, ValueError, KeyError):
+            return None
+        return meta['sha256']
+
+    def store(self, key, output_path):
+        """
+        Сохраняет готовый файл под ключом. Возвращает его sha256.
+        """
+        output_path = Path(output_path)
+        data_path, meta_path = self._paths(key, output_path.suffix.lower())
+        digest = file_sha256(output_path)
+        try:
+            link_or_copy(output_path, data_path, link=False)
+            os.chmod(data_path, 0o444)
+            tmp_meta = meta_path.with_name(meta_path.name + '.tmp')
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({'sha256': digest, 'size': data_path.stat().st_size, 'created_at': time.time()}, f)
+            os.replace(tmp_meta, meta_path)
+        except OSError as e:
+            logger.warning(f'[CACHE] Не удалось сохранить результат в кэш: {e}')
+        return digest
+
+
+def covers(stored_size, decode_size):
+    """
+    Вырезка из оригинала размером stored_size годится для decode_size (не меньше по обеим сторонам).
+    """
+    if decode_size is None:
+        return True
+    return stored_size is not None and stored_size[0] >= decode_size[0] and stored_size[1] >= decode_size[1]
+
+
+def _read_decode_size(img):
+    value = img.getexif().get(DECODE_SIZE_TAG)
+    if not isinstance(value, str) or not value.startswith('decode_size '):
+        return None
+    try:
+        w, h = value.split(' ', 1)[1].split('x')
+        return int(w), int(h)
+    except ValueError:
+        return None
+
+
+class CutoutCache:
+    """
+    Дисковый кэш вырезанной шины (RGBA после удаления логотипа, фона и обрезки).
+    Без потерь: PNG или WebP lossless. Объём ограничен max_mb: при переполнении удаляются
+    давно не использованные файлы (mtime обновляется при каждом попадании).
+    Вместе с вырезкой хранится размер декодирования оригинала (EXIF), ключ от него не зависит.
+    """
+
+    def __init__(self, cache_dir, max_mb=2048, image_format='png'):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 2 ** 20)
+        self.image_format = image_format.lower()
+        self.suffix = '.webp' if self.image_format == 'webp' else '.png'
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / (key + self.suffix)
+
+    def contains(self, key, decode_size=None):
+        """
+        Есть ли вырезка, годная для оригинала размером decode_size (None — любая).
+        """
+        from PIL import Image
+        try:
+            with Image.open(self._path(key)) as cached:
+                return covers(_read_decode_size(cached), decode_size)
+        except (OSError, ValueError):
+            return False
+
+    def get(self, key, decode_size=None):
+        """
+        (изображение RGBA, размер декодирования оригинала, из которого оно получено) или None (промах).
+        decode_size — нужный размер: вырезка из меньшего оригинала считается промахом.
+        """
+        from PIL import Image
+        path = self._path(key)
+        try:
+            with Image.open(path) as cached:
+                stored_size = _read_decode_size(cached)
+                if not covers(stored_size, decode_size):
+                    raise ValueError('вырезка из меньшего оригинала')
+                img = cached.convert('RGBA')
+            os.utime(path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return img, stored_size
+
+    def put(self, key, img, decode_size=None):
+        from PIL import Image
+        exif = Image.Exif()
+        if decode_size is not None:
+            exif[DECODE_SIZE_TAG] = f'decode_size {decode_size[0]}x{decode_size[1]}'
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'.{path.stem}.{os.getpid()}.tmp{self.suffix}')
+        try:
+            if self.image_format == 'webp':
+                # exact: сохранить RGB и под полностью прозрачными пикселями (иначе libwebp их меняет)
+                img.save(tmp, format='WEBP', lossless=True, exact=True, quality=50, method=2, exif=exif)
+            else:
+                img.save(tmp, format='PNG', compress_level=3, exif=exif)
+            size = tmp.stat().st_size
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f'[CACHE] Не удалось сохранить вырезку в кэш: {e}')
+            return
+        with self._lock:
+            self.stores += 1
+            if self._size is not None:
+                self._size += size
+            need_evict = self._size is None or self._size > self.max_bytes
+        if need_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Пересчитывает объём кэша и удаляет самые давно использованные файлы сверх max_bytes.
+        """
+        entries = []
+        for path in self.cache_dir.glob('*/*' + self.suffix):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        if total > self.max_bytes:
+            entries.sort()
+            # С запасом 10%, чтобы не пересчитывать объём после каждой записи
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+        with self._lock:
+            self._size = total
+            self.evictions += removed
+        if removed:
+            logger.info(f'[CACHE] Кэш вырезок: удалено {removed} файлов, объём {total / 2 ** 20:.0f} МБ')
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'size_mb': (self._size or 0) / 2 ** 20,
+            }
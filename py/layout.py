@@ -0,0 +1,139 @@
+from functools import lru_cache
+
+from PIL import Image, ImageOps
+
+import resampling
+
+# --- Макет карточки ---
+# Доли ширины и высоты холста для элементов карточки
+COEFF = {
+    'brand_font': 0.103,
+    'brand_y': 0.058,
+    'model_font': 0.052,
+    'model_y': 0.156,
+    'specs_main_font': 0.083,
+    'specs_rim_font': 0.083,
+    'specs_x': 0.5,
+    'specs_y': 0.213,
+    'specs_main_w': 0.5596,
+    'specs_main_h': 0.0859,
+	'main_text_x': 0.0505,
+    'main_text_y': 0.279,
+    'index_box_w': 0.1951,
+    'index_box_h': 0.1295,
+    'season_font': 0.0419,
+    'season_x': 0.0639,
+    'season_y': 0.7966,
+    'season_y2': 0.8329,
+    'tire_w': 0.5677,
+    'tire_h': 0.6392,
+    'tire_x': 0.3725,
+    'tire_y': 0.3087,
+}
+
+# Все координаты и размеры шрифтов, производные от COEFF, вычисляются один раз на (ширина, высота)
+# в compile_layout; draw_* в ai_image_processor.py только берут готовые значения.
+
+
+@lru_cache(maxsize=64)
+def index_box_layout(width, height, x, y):
+    box_w = int(width * COEFF['index_box_w'])
+    box_h = int(height * COEFF['index_box_h'])
+    cx = x + int(box_w * 0.0682)
+    return {
+        'rect': (x, y, x + box_w, y + box_h),
+        'num_font_size': int(width * 0.0629),
+        'text_font_size': int(width * 0.037),
+        'value_pos': (cx, y + int(box_h * 0.0526)),
+        'text1_pos': (cx, y + int(box_h * 0.4834)),
+        'text2_pos': (cx, y + int(box_h * 0.7255)),
+        'text1_debug_y': y + int(box_h * 0.4554),
+        'text2_debug_y': y + int(box_h * 0.6883),
+    }
+
+
+@lru_cache(maxsize=64)
+def compile_layout(width, height):
+    """
+    Макет для размера холста (ширина, высота): координаты, прямоугольники и размеры шрифтов всех элементов.
+    Результат общий для всех задач этого размера — не изменять.
+    """
+    specs_x = int(width * COEFF['specs_x'])
+    specs_y = int(height * COEFF['specs_y'])
+    main_w = int(width * COEFF['specs_main_w'])
+    main_h = int(height * COEFF['specs_main_h'])
+    main_text_x = int(main_w * COEFF['main_text_x'])
+    main_text_y = int(height * COEFF['main_text_y'])
+    rim_space = int(main_h * 0.0698)
+    rim_x = (specs_x - main_w//2) + int(main_w * 0.6379)
+    rim_x2 = (specs_x + main_w//2) - rim_space
+    rim_y = specs_y + rim_space
+    rim_y2 = (specs_y + main_h) - rim_space
+    index_x = int(width * COEFF['season_x'])
+    return {
+        'brand': {'font_size': int(width * COEFF['brand_font']), 'pos': (width // 2, int(height * COEFF['brand_y']))},
+        'model': {'font_size': int(width * COEFF['model_font']), 'pos': (width // 2, int(height * COEFF['model_y']))},
+        'specs': {
+            'main_font_size': int(width * COEFF['specs_main_font']),
+            'rim_font_size': int(width * COEFF['specs_rim_font']),
+            'rect': (specs_x - main_w//2, specs_y, specs_x + main_w//2, specs_y + main_h),
+            'main_pos': ((specs_x - main_w//2) + main_text_x, main_text_y),
+            'main_debug_y': specs_y + main_text_y,
+            'rim_rect': (rim_x, rim_y, rim_x2, rim_y2),
+            'rim_pos': (rim_x + (rim_x2 - rim_x)//2, main_text_y),
+            'rim_debug_y': rim_y + int((rim_y2 - rim_y) * 0.0746),
+        },
+        'load_index': index_box_layout(width, height, index_x, int(height * 0.4521)),
+        'speed_index': index_box_layout(width, height, index_x, int(height * 0.628)),
+        'season': {
+            'font_size': int(width * COEFF['season_font']),
+            'line1_pos': (int(width * COEFF['season_x']), int(height * COEFF['season_y'])),
+            'line2_pos': (int(width * COEFF['season_x']), int(height * COEFF['season_y2'])),
+            'icon_size': (int(width * 0.087), int(height * 0.0726)),
+            'icon_pos': (int(width * 0.267), int(height * 0.79)),
+        },
+        'tire': {
+            'size': (int(width * COEFF['tire_w']), int(height * COEFF['tire_h'])),
+            'pos': (int(width * COEFF['tire_x']), int(height * COEFF['tire_y'])),
+        },
+    }
+
+
+# --- Перенос на холст: шина и слой текста (render_mode: layered) ---
+# kernel — ядро resampling.py для места вызова ('tire', 'text_layer' в resample_sites).
+
+def draw_tire(img, tire_img, width, height, kernel='auto', factor=1):
+    """
+    factor > 1 (render_mode: layered): место шины берётся из макета холста в factor раз больше и переносится
+    на холст (width, height) с дробной точностью — шина оказывается там же, где в полном режиме,
+    но уменьшается один раз.
+    """
+    if factor == 1:
+        layout = compile_layout(width, height)['tire']
+        tire_resized = resampling.resize(tire_img, layout['size'], kernel)
+        img.paste(tire_resized, layout['pos'], tire_resized)
+        return
+    layout = compile_layout(width * factor, height * factor)['tire']
+    (x, y), (w, h) = layout['pos'], layout['size']
+    x0, y0 = x // factor, y // factor
+    x1, y1 = -(-(x + w) // factor), -(-(y + h) // factor)
+    sx = tire_img.width / w
+    sy = tire_img.height / h
+    # Прозрачная рамка: область источника для крайних пикселей выходит за края шины
+    pad = int(factor * max(sx, sy)) + 2
+    padded = ImageOps.expand(tire_img, pad, fill=(0, 0, 0, 0))
+    box = (
+        pad + (x0 * factor - x) * sx, pad + (y0 * factor - y) * sy,
+        pad + (x1 * factor - x) * sx, pad + (y1 * factor - y) * sy,
+    )
+    tire_resized = resampling.resize(padded, (x1 - x0, y1 - y0), kernel, box=box)
+    img.paste(tire_resized, (x0, y0), tire_resized)
+
+
+def downsample_text_layer(layer, size, kernel='auto'):
+    """
+    Уменьшение прозрачного слоя текста. draw.text на прозрачном холсте даёт цвет, уже умноженный на альфу
+    (RGB = ink * a), поэтому слой читается как RGBa: наложение и уменьшение без тёмной каймы.
+    """
+    premultiplied = Image.frombytes('RGBa', layer.size, layer.tobytes())
+    return resampling.resize(premultiplied, size, kernel).convert('RGBA')
@@ -0,0 +1,163 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from loguru import logger
+
+# --- Реестр моделей сегментации ---
+# Один экземпляр на процесс: rembg-сессии (u2net, isnet-general-use, silueta) и U2NET/U2NETP (torch или onnxruntime).
+# Модели создаются лениво при первом обращении и вытесняются по LRU, если суммарная оценка памяти
+# превышает лимит. Оценка памяти — размер файла весов (для ONNX и torch это близко к реальному RSS).
+
+PY_DIR = Path(__file__).parent.resolve()
+
+U2NET_WEIGHTS = {
+    'u2net': PY_DIR / 'u2net.pth',
+    'u2netp': PY_DIR / 'u2netp.pth',
+}
+
+# Размеры по умолчанию (МБ), если файл весов ещё не скачан
+DEFAULT_MODEL_MB = {
+    'u2net': 176,
+    'u2netp': 5,
+    'isnet-general-use': 179,
+    'silueta': 43,
+}
+
+
+def rembg_model_file(model_name):
+    """
+    Путь, по которому rembg ищет (или скачает) ONNX-файл модели.
+    Учитывает и новую раскладку (<home>/models/<name>/), и старую плоскую (~/.u2net/<name>.onnx).
+    """
+    fname = f'{model_name}.onnx'
+    try:
+        from rembg.sessions import sessions_class
+        for session_class in sessions_class:
+            if session_class.name() != model_name:
+                continue
+            if hasattr(session_class, 'resolve_existing'):
+                existing = session_class.resolve_existing(fname)
+                if existing is not None:
+                    return Path(existing)
+                return Path(session_class.model_dir()) / fname
+            return Path(session_class.u2net_home()) / fname
+    except ImportError:
+        pass
+    u2net_home = os.path.expanduser(os.getenv('U2NET_HOME', os.path.join(os.getenv('XDG_DATA_HOME', '~'), '.u2net')))
+    return Path(u2net_home) / fname
+
+
+def _file_mb(path, fallback_name):
+    try:
+        return Path(path).stat().st_size / (1024 * 1024)
+    except (OSError, TypeError):
+        return DEFAULT_MODEL_MB.get(fallback_name, 100)
+
+
+class ModelRegistry:
+    def __init__(self, max_memory_mb=2048, u2net_weights=None):
+        self.max_memory_mb = float(max_memory_mb)
+        # Пути к весам U2NET/U2NETP: значения по умолчанию + переопределения из конфига
+        self.u2net_weights = dict(U2NET_WEIGHTS)
+        self.u2net_weights.update({name: Path(path) for name, path in (u2net_weights or {}).items() if path})
+        self._entries = OrderedDict()  # key -> (instance, size_mb)
+        self._lock = threading.RLock()
+
+    def _get(self, key, factory, size_mb):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self._evict(size_mb)
+            logger.info(f'[MODELS] Загрузка модели {key} (~{size_mb:.0f} МБ)')
+            instance = factory()
+            self._entries[key] = (instance, size_mb)
+            return instance
+
+    def _evict(self, incoming_mb):
+        # Вытесняем самые давно использованные модели, пока новая не поместится в лимит.
+        # Одна модель больше лимита всё равно загружается — иначе задачу не выполнить.
+        while self._entries and self.memory_mb() + incoming_mb > self.max_memory_mb:
+            key, (_, size_mb) = self._entries.popitem(last=False)
+            logger.info(f'[MODELS] Вытеснение модели {key} (~{size_mb:.0f} МБ) по лимиту {self.max_memory_mb:.0f} МБ')
+
+    def memory_mb(self):
+        return sum(size_mb for _, size_mb in self._entries.values())
+
+    def loaded(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def drop_fork_unsafe(self):
+        """
+        Вызывается в дочернем процессе после fork: сессии onnxruntime (rembg и backend=onnx)
+        держат пулы потоков родителя и в ребёнке зависнут — удаляем, они пересоздадутся лениво.
+        Модели torch остаются: их веса общие с родителем (copy-on-write).
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == 'rembg' or (key[0] == 'u2net' and key[3] == 'onnx'):
+                    del self._entries[key]
+
+    def rembg_session(self, model_name='u2net'):
+        def factory():
+            from rembg import new_session
+            return new_session(model_name)
+        return self._get(('rembg', model_name), factory, _file_mb(rembg_model_file(model_name), model_name))
+
+    def u2net(self, model_name='u2net', weights_path=None, backend='torch', num_threads=0, precision='fp32'):
+        weights_path = Path(weights_path or self.u2net_weights[model_name]).resolve()
+        def factory():
+            from u2net import U2NETPredictor
+            return U2NETPredictor(weights_path=weights_path, model_name=model_name, backend=backend, num_threads=num_threads, precision=precision)
+        size_mb = _file_mb(weights_path, model_name)
+        if precision == 'int8':
+            size_mb /= 4
+        return self._get(('u2net', model_name, str(weights_path), backend, precision), factory, size_mb)
+
+    def missing_model_files(self, rembg_models=(), u2net_models=()):
+        """
+        Список (вид, имя, путь) моделей, файлов которых нет на диске; вид — 'rembg' или 'u2net'
+        (имена пересекаются: u2net — и ONNX-модель rembg, и веса torch).
+        """
+        missing = []
+        for model_name in rembg_models:
+            path = rembg_model_file(model_name)
+            if not path.exists():
+                missing.append(('rembg', model_name, path))
+        for model_name in u2net_models:
+            path = Path(self.u2net_weights.get(model_name, model_name))
+            # Для бэкенда onnx достаточно экспортированной модели рядом с весами
+            if not path.exists() and not path.with_suffix('.onnx').exists():
+                missing.append(('u2net', model_name, path))
+        return missing
+
+    def ensure_model_files(self, rembg_models=(), u2net_models=(), allow_download=True):
+        """
+        Проверка при старте: все модели должны лежать локально, чтобы первая задача не ждала скачивания.
+        Недостающие rembg-модели скачиваются сразу (если allow_download), иначе — RuntimeError.
+        Веса U2NET скачиваются вручную, для них выводится предупреждение.
+        """
+        missing = self.missing_model_files(rembg_models, u2net_models)
+        for kind, model_name, path in missing:
+            if kind == 'rembg':
+                if not allow_download:
+                    raise RuntimeError(f'Файл модели rembg не найден: {path} (models_allow_download=false)')
+                logger.warning(f'[MODELS] Модель {model_name} не найдена локально, скачивание при старте: {path}')
+                self.rembg_session(model_name)
+            else:
+                logger.warning(f'[MODELS] Весовой файл {model_name} не найден: {path}. Скачайте с https://github.com/xuebinqin/U-2-Net/releases')
+        return missing
+
+REGISTRY = None
+
+
+def get_registry(max_memory_mb=2048, u2net_weights=None):
+    """
+    Общий реестр процесса (создаётся при первом вызове).
+    """
+    global REGISTRY
+    if REGISTRY is None:
+        REGISTRY = ModelRegistry(max_memory_mb=max_memory_mb, u2net_weights=u2net_weights)
+    return REGISTRY
@@ -0,0 +1,134 @@
+import numpy as np
+from loguru import logger
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# --- Постобработка итогового изображения ---
+# Цепочка операторов из config.yaml/params (postprocess), по умолчанию — прежняя цепочка Pillow:
+# ImageEnhance.Sharpness(2) -> ImageEnhance.Color(1.3) -> ImageFilter.SMOOTH_MORE.
+# backend 'fused': каждый оператор — один проход OpenCV по uint8-массиву (размытие и смешивание Sharpness
+# сведены в одно ядро 3x3, Color — в матрицу 4x4), без промежуточных изображений Pillow.
+# Буферов всего два (вход и выход по очереди). backend 'pillow' — исходная цепочка (эталон).
+# Результаты совпадают с точностью до округления (см. test_postprocess.py).
+
+SMOOTH_KERNEL = np.array([
+    [1, 1, 1],
+    [1, 5, 1],
+    [1, 1, 1],
+], dtype=np.float32) / 13
+SMOOTH_MORE_KERNEL = np.array([
+    [1, 1, 1, 1, 1],
+    [1, 5, 5, 5, 1],
+    [1, 5, 44, 5, 1],
+    [1, 5, 5, 5, 1],
+    [1, 1, 1, 1, 1],
+], dtype=np.float32) / 100
+# Яркость для ImageEnhance.Color: image.convert('L') (ITU-R 601-2)
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+DEFAULT_CHAIN = [
+    {'op': 'sharpness', 'factor': 2.0},
+    {'op': 'color', 'factor': 1.3},
+    {'op': 'smooth_more'},
+]
+# render_mode: layered — в целевом размере: резкость и сглаживание полного режима (на холсте x3
+# перед уменьшением) почти компенсируют друг друга, остаётся насыщенность
+LAYERED_CHAIN = [
+    {'op': 'color', 'factor': 1.3},
+]
+OPERATORS = ('sharpness', 'color', 'smooth', 'smooth_more')
+
+
+def normalize_chain(chain):
+    """
+    Список операторов [{'op': ..., 'factor': ...}] -> [(op, factor)]. Неизвестный оператор — ValueError.
+    """
+    ops = []
+    for item in chain or []:
+        if isinstance(item, str):
+            item = {'op': item}
+        op = item.get('op')
+        if op not in OPERATORS:
+            raise ValueError(f'Неизвестный оператор постобработки: {op} (доступны: {", ".join(OPERATORS)})')
+        ops.append((op, float(item.get('factor', 1.0))))
+    return ops
+
+
+def apply_pillow(img, chain):
+    from PIL import ImageEnhance, ImageFilter
+    for op, factor in normalize_chain(chain):
+        if op == 'sharpness':
+            img = ImageEnhance.Sharpness(img).enhance(factor)
+        elif op == 'color':
+            img = ImageEnhance.Color(img).enhance(factor)
+        elif op == 'smooth':
+            img = img.filter(ImageFilter.SMOOTH)
+        elif op == 'smooth_more':
+            img = img.filter(ImageFilter.SMOOTH_MORE)
+    return img
+
+
+def _filter(src, dst, kernel, keep_alpha=False):
+    """
+    Свёртка с насыщением в uint8; крайние пиксели, как в Pillow, копируются из источника без изменений.
+    """
+    cv2.filter2D(src, -1, kernel, dst=dst, borderType=cv2.BORDER_REPLICATE)
+    r = kernel.shape[0] // 2
+    dst[:r] = src[:r]
+    dst[-r:] = src[-r:]
+    dst[:, :r] = src[:, :r]
+    dst[:, -r:] = src[:, -r:]
+    if keep_alpha and dst.shape[2] == 4:
+        dst[..., 3] = src[..., 3]
+
+
+def _color_matrix(factor, channels):
+    # Color(f): L + f * (C - L) = f * C + (1 - f) * L для каждого канала C; альфа без изменений
+    matrix = np.eye(channels, dtype=np.float32) * factor
+    matrix[:3, :3] += (1 - factor) * LUMA[np.newaxis, :]
+    if channels == 4:
+        matrix[3, 3] = 1.0
+    return matrix
+
+
+def apply_fused(img, chain):
+    from PIL import Image
+    ops = normalize_chain(chain)
+    if not ops:
+        return img
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    src = np.array(img)
+    dst = np.empty_like(src)
+    channels = src.shape[2]
+    for op, factor in ops:
+        if op == 'sharpness':
+            # blend(SMOOTH(I), I, f) = f * I + (1 - f) * SMOOTH(I): одно ядро; альфа не меняется
+            kernel = (1 - factor) * SMOOTH_KERNEL
+            kernel[1, 1] += factor
+            _filter(src, dst, kernel, keep_alpha=True)
+        elif op == 'color':
+            matrix = _color_matrix(factor, channels)
+            cv2.transform(src, matrix, dst=dst)
+        elif op == 'smooth':
+            _filter(src, dst, SMOOTH_KERNEL)
+        elif op == 'smooth_more':
+            _filter(src, dst, SMOOTH_MORE_KERNEL)
+        src, dst = dst, src
+    return Image.fromarray(src)
+
+
+def apply(img, chain=None, backend='fused'):
+    """
+    Постобработка цепочкой chain (None — DEFAULT_CHAIN). backend: 'fused' (OpenCV) или 'pillow'.
+    """
+    if chain is None:
+        chain = DEFAULT_CHAIN
+    if backend == 'fused':
+        if cv2 is not None:
+            return apply_fused(img, chain)
+        logger.warning('[POST] OpenCV не установлен, постобработка через Pillow')
+    return apply_pillow(img, chain)
@@ -0,0 +1,84 @@
+import argparse
+from pathlib import Path
+from PIL import Image
+from onnxruntime.quantization import CalibrationDataReader
+
+# --- INT8-квантование ONNX-модели U2NET/U2NETP ---
+# Статическое (по умолчанию): калибровка на выборке наших оригиналов, формат QDQ — лучшая скорость на CPU.
+# Динамическое: без калибровки, веса в INT8, активации квантуются на лету.
+#
+# python quantize_u2net.py --weights u2net.pth --calibration ../uploads/ai_image/originals
+# python benchmark_saliency.py --images <валидационная папка> --reference onnx:u2net --candidate onnx:u2net:int8
+#
+# Включение: saliency_backend: onnx и saliency_precision: int8 (config.yaml или params задачи).
+
+IMG_EXTS = ['.jpg', '.jpeg', '.png', '.webp']
+
+
+class OriginalsCalibrationReader(CalibrationDataReader):
+    """
+    Подаёт в калибратор изображения из папки с той же предобработкой, что и U2NETPredictor.
+    """
+
+    def __init__(self, images_dir, input_name, limit=100):
+        self.paths = sorted(p for p in Path(images_dir).iterdir() if p.suffix.lower() in IMG_EXTS)[:limit]
+        self.input_name = input_name
+        self._iter = iter(self.paths)
+
+    def get_next(self):
+        from u2net import preprocess_batch
+        path = next(self._iter, None)
+        if path is None:
+            return None
+        with Image.open(path) as img:
+            return {self.input_name: preprocess_batch([img])}
+
+    def rewind(self):
+        self._iter = iter(self.paths)
+
+
+def quantize(weights_path, mode='static', calibration_dir=None, model_name='u2net', limit=100):
+    import onnx
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from u2net_onnx import export_onnx, int8_paths, onnx_paths
+
+    weights_path = Path(weights_path)
+    onnx_path = onnx_paths(weights_path)[0]
+    int8_path = int8_paths(weights_path)[0]
+    if not onnx_path.exists():
+        export_onnx(weights_path, onnx_path, model_name=model_name)
+
+    if mode == 'dynamic':
+        quantize_dynamic(str(onnx_path), str(int8_path), weight_type=QuantType.QUInt8)
+    else:
+        if not calibration_dir:
+            raise ValueError('Для статического квантования нужна папка калибровки (--calibration)')
+        input_name = onnx.load(str(onnx_path)).graph.input[0].name
+        reader = OriginalsCalibrationReader(calibration_dir, input_name, limit=limit)
+        if not reader.paths:
+            raise ValueError(f'Нет изображений для калибровки в {calibration_dir}')
+        print(f'[QUANTIZE] Калибровка на {len(reader.paths)} изображениях из {calibration_dir}')
+        quantize_static(
+            str(onnx_path), str(int8_path), reader,
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    # Старый оптимизированный граф INT8 больше не соответствует модели
+    optimized_path = int8_paths(weights_path)[1]
+    if optimized_path.exists():
+        optimized_path.unlink()
+    print(f'[QUANTIZE] Сохранено ({mode}): {int8_path}')
+    return int8_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='INT8-квантование U2NET/U2NETP для onnxruntime')
+    parser.add_argument('--weights', type=str, default=str(Path(__file__).parent / 'u2net.pth'))
+    parser.add_argument('--model', type=str, default='u2net', choices=['u2net', 'u2netp'])
+    parser.add_argument('--mode', type=str, default='static', choices=['static', 'dynamic'])
+    parser.add_argument('--calibration', type=str, default=None, help='Папка с оригиналами для калибровки (static)')
+    parser.add_argument('--limit', type=int, default=100, help='Максимум изображений для калибровки')
+    cli_args = parser.parse_args()
+    quantize(cli_args.weights, mode=cli_args.mode, calibration_dir=cli_args.calibration, model_name=cli_args.model, limit=cli_args.limit)
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from loguru import logger
+
+# --- Кэш ассетов шаблона: декодированные и уменьшенные фоны и иконки; растры текста ---
+# Шаблонов немного, а фон каждой задачи — LANCZOS-ресайз до размера суперсэмплинга (~1860x2478).
+# Ключ: (путь, mtime, размер файла, целевой размер, режим, фильтр) — изменённый шаблон перечитывается.
+# Фильтр — константа Pillow или ядро resampling.py ('auto', 'lanczos', ...).
+# Память: LRU с ограничением объёма. Диск (для холодного старта): несжатый .npy, читается быстрее,
+# чем JPEG декодируется и ресайзится. На каждый (путь, размер, режим) на диске хранится одна версия.
+# Возвращаемые изображения общие: вызывающий код не должен их изменять (только copy()).
+
+
+class ImageLRU:
+    """
+    LRU изображений PIL в памяти с ограничением суммарного объёма пикселей.
+    Значением может быть и кортеж с изображением — тогда объём передаётся в put (nbytes).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_bytes(img):
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, nbytes=None):
+        size = self.image_bytes(value) if nbytes is None else nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+
+class TextSprites:
+    """
+    Растры текста: маска (L) и смещение относительно точки привязки по ключу (текст, файл шрифта, размер, anchor).
+    Цвет в ключ не входит — маска рисуется нужным цветом через ImageDraw.bitmap, как это делает draw.text.
+    """
+
+    def __init__(self, max_mb=64):
+        self.memory = ImageLRU(int(max_mb * 2 ** 20))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, text, font, anchor=None):
+        """
+        (маска, (dx, dy)) или None, если шрифт не FreeType или текст пустой (тогда рисовать draw.text).
+        """
+        from PIL import Image, ImageDraw
+        path = getattr(font, 'path', None)
+        if not path or not text:
+            return None
+        key = (text, str(path), font.size, anchor)
+        sprite = self.memory.get(key)
+        with self._lock:
+            if sprite is not None:
+                self.hits += 1
+                return sprite
+            self.misses += 1
+        left, top, right, bottom = font.getbbox(text, anchor=anchor)
+        if right <= left or bottom <= top:
+            return None
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255, anchor=anchor)
+        sprite = (mask, (left, top))
+        self.memory.put(key, sprite, mask.width * mask.height)
+        return sprite
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.memory),
+                'memory_mb': self.memory.nbytes / 2 ** 20,
+            }
+
+
+class AssetCache:
+    """
+    Ассеты шаблона: память (ImageLRU на max_mb) и, для persist=True, диск (disk_dir).
+    """
+
+    def __init__(self, max_mb=256, disk_dir=None):
+        self.memory = ImageLRU(int(max_mb * 2 ** 20))
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def _disk_path(self, path, size, mode, resample, stamp):
+        slot = hashlib.sha256(repr((path, size, mode, resample)).encode('utf-8')).hexdigest()[:16]
+        version = hashlib.sha256(repr(stamp).encode('utf-8')).hexdigest()[:16]
+        return self.disk_dir / f'{slot}_{version}.npy'
+
+    def get(self, path, size=None, mode='RGBA', resample=None, persist=False):
+        """
+        Изображение из файла path в режиме mode, уменьшенное до size (None — исходный размер).
+        persist — сохранять на диск (для крупных фонов; иконки достаточно держать в памяти).
+        """
+        from PIL import Image
+        path = os.path.abspath(str(path))
+        st = os.stat(path)
+        if resample is None:
+            resample = Image.LANCZOS
+        size = tuple(size) if size else None
+        key = (path, st.st_mtime_ns, st.st_size, size, mode, resample)
+        img = self.memory.get(key)
+        if img is not None:
+            self._count('hits')
+            return img
+        disk_path = None
+        if persist and self.disk_dir is not None:
+            disk_path = self._disk_path(path, size, mode, resample, key[1:3])
+            img = self._load_disk(disk_path)
+            if img is not None:
+                self._count('disk_hits')
+                self.memory.put(key, img)
+                return img
+        self._count('misses')
+        with Image.open(path) as src:
+            img = src.convert(mode)
+        if size and img.size != size:
+            if isinstance(resample, str):
+                import resampling
+                img = resampling.resize(img, size, resample)
+            else:
+                img = img.resize(size, resample)
+        self.memory.put(key, img)
+        if disk_path is not None:
+            self._store_disk(disk_path, img)
+        return img
+
+    def derived(self, key, build):
+        """
+        Производное изображение (например, фон с неизменными подписями макета) — только в памяти.
+        build() вызывается при промахе; key должен включать всё, от чего результат зависит.
+        """
+        img = self.memory.get(key)
+        if img is not None:
+            self._count('hits')
+            return img
+        self._count('misses')
+        img = build()
+        self.memory.put(key, img)
+        return img
+
+    @staticmethod
+    def _load_disk(disk_path):
+        import numpy as np
+        from PIL import Image
+        try:
+            arr = np.load(disk_path, allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+        return Image.fromarray(arr)
+
+    def _store_disk(self, disk_path, img):
+        import numpy as np
+        slot = disk_path.name.split('_')[0]
+        tmp = disk_path.with_name(f'.{disk_path.stem}.{os.getpid()}.tmp')
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, np.asarray(img), allow_pickle=False)
+            os.replace(tmp, disk_path)
+            # Прежние версии того же ассета (шаблон изменился) больше не нужны
+            for stale in self.disk_dir.glob(f'{slot}_*.npy'):
+                if stale != disk_path:
+                    try:
+                        stale.unlink()
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            logger.warning(f'[CACHE] Не удалось сохранить ассет шаблона на диск: {e}')
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self.memory),
+                'memory_mb': self.memory.nbytes / 2 ** 20,
+            }
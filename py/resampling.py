@@ -0,0 +1,132 @@
+from PIL import Image
+
+try:
+    import cv2
+    import numpy as np
+except ImportError:
+    cv2 = None
+
+# --- Ресайз изображений с выбором ядра по соотношению размеров ---
+# 'auto': целый одинаковый коэффициент уменьшения (итоговое x3 суперсэмплинга) — Image.reduce (усреднение
+# блоков, без свёртки); сильное уменьшение (от AREA_MIN_RATIO раз) — cv2.INTER_AREA; увеличение и
+# небольшое уменьшение — LANCZOS, как раньше. 'lanczos' — всегда LANCZOS (прежнее поведение).
+# Уменьшение с прозрачностью выполняется над RGBa (цвет, умноженный на альфу), как в Pillow —
+# иначе на краях прозрачных областей появляется тёмная кайма.
+# Режим задаётся в config.yaml: resample_mode, по местам вызова — resample_sites (см. README).
+
+KERNELS = ('auto', 'lanczos', 'reduce', 'area')
+# Места вызова в ai_image_processor.py. Вход RunwayML по умолчанию уменьшается LANCZOS, как раньше:
+# от него зависят вырезки в кэше и результат API
+SITES = ('original', 'template', 'base', 'tire', 'text_layer', 'final', 'runwayml')
+SITE_DEFAULTS = {'runwayml': 'lanczos'}
+AREA_MIN_RATIO = 2.0
+# Для уменьшения с дробной областью источника (box) cv2 не подходит: Pillow сначала уменьшает
+# в целое число раз (reduce), затем применяет LANCZOS с коэффициентом не больше REDUCING_GAP
+REDUCING_GAP = 2.0
+AREA_MODES = ('L', 'RGB', 'RGBA', 'RGBa')
+
+
+def site_kernel(config, site):
+    """
+    Ядро для места вызова site: resample_sites[site] из конфига, иначе SITE_DEFAULTS, иначе resample_mode.
+    """
+    sites = config.get('resample_sites') or {}
+    return sites.get(site) or SITE_DEFAULTS.get(site) or config.get('resample_mode', 'auto')
+
+
+def choose_kernel(src_size, size, box=None):
+    """
+    Ядро для уменьшения src_size -> size в режиме 'auto': 'reduce', 'area' или 'lanczos'.
+    """
+    if box is not None:
+        src_w, src_h = box[2] - box[0], box[3] - box[1]
+    else:
+        src_w, src_h = src_size
+    w, h = size
+    if w >= src_w or h >= src_h:
+        return 'lanczos'
+    if box is None and src_w % w == 0 and src_h % h == 0 and src_w // w == src_h // h:
+        return 'reduce'
+    if min(src_w / w, src_h / h) >= AREA_MIN_RATIO:
+        return 'area'
+    return 'lanczos'
+
+
+def _has_transparency(img):
+    return img.mode == 'RGBA' and img.getchannel('A').getextrema()[0] < 255
+
+
+def _reduce(img, factor):
+    if _has_transparency(img):
+        return img.convert('RGBa').reduce(factor).convert('RGBA')
+    return img.reduce(factor)
+
+
+def _area(img, size):
+    premultiply = _has_transparency(img)
+    source = img.convert('RGBa') if premultiply else img
+    arr = cv2.resize(np.asarray(source), size, interpolation=cv2.INTER_AREA)
+    out = Image.frombytes(source.mode, size, arr.tobytes())
+    return out.convert('RGBA') if premultiply else out
+
+
+def _lanczos_reducing(img, size, box):
+    # Для RGBA Pillow сам переводит изображение в RGBa, но reducing_gap при этом теряется
+    if img.mode == 'RGBA':
+        return img.convert('RGBa').resize(size, Image.LANCZOS, box=box, reducing_gap=REDUCING_GAP).convert('RGBA')
+    return img.resize(size, Image.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
+
+
+def resize(img, size, kernel='auto', box=None):
+    """
+    Ресайз img до size. kernel: 'auto' (выбор по choose_kernel), 'lanczos', 'reduce', 'area'.
+    box — область источника (дробная), как в Image.resize.
+    Результат того же режима, что и img; при невозможности reduce/area (не целый коэффициент,
+    нет OpenCV, другой режим изображения) используется LANCZOS.
+    """
+    size = tuple(size)
+    if kernel not in KERNELS:
+        raise ValueError(f'Неизвестное ядро ресайза: {kernel} (доступны: {", ".join(KERNELS)})')
+    if kernel == 'lanczos':
+        return img.resize(size, Image.LANCZOS, box=box)
+    if kernel == 'auto':
+        kernel = choose_kernel(img.size, size, box)
+    if kernel == 'reduce' and box is None:
+        factor = img.width // size[0]
+        if factor >= 1 and img.width == size[0] * factor and img.height == size[1] * factor:
+            return _reduce(img, factor)
+    if kernel == 'area' and box is None and cv2 is not None and img.mode in AREA_MODES:
+        return _area(img, size)
+    if kernel in ('reduce', 'area'):
+        return _lanczos_reducing(img, size, box)
+    return img.resize(size, Image.LANCZOS, box=box)
+
+
+# --- Декодирование оригинала в нужном размере ---
+# JPEG декодируется сразу в уменьшенном масштабе (draft: 1/2, 1/4, 1/8 — ближайший не меньше нужного),
+# остаток — ресайзом. Остальные форматы декодируются целиком и уменьшаются.
+
+def decode_size(size, target, margin=1.5):
+    """
+    Наименьший размер изображения size, при котором оно не меньше target с запасом margin; не больше size.
+    """
+    scale = max(target[0] * margin / size[0], target[1] * margin / size[1])
+    if scale >= 1:
+        return tuple(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def open_scaled(path, size, kernel='auto'):
+    """
+    (изображение RGBA размером size, исходный размер, размер декодирования).
+    """
+    size = tuple(size)
+    with Image.open(path) as img:
+        full_size = img.size
+        if size != full_size:
+            img.draft(img.mode, size)
+        draft_size = img.size
+        img = img.convert('RGBA')
+    if img.size != size:
+        img = resize(img, size, kernel)
+    return img, full_size, draft_size
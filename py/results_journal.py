@@ -0,0 +1,208 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from loguru import logger
+
+# --- Журнал результатов (results/journal.db) ---
+# Помимо results/<task_id>.json каждый результат дописывается в журнал с монотонным номером seq
+# (AUTOINCREMENT: номера не переиспользуются даже после удаления записей).
+# Потребитель читает только записи после своего курсора: read_since(cursor) и сохраняет курсор через ack().
+# compact() удаляет записи, прочитанные всеми потребителями и старше retain_days
+# (или вытесненные более новой записью той же задачи), и ограничивает журнал max_records записями.
+# Удалённые записи ротируются в архив results/journal-archive/journal-<первый seq>-<последний seq>.jsonl.gz;
+# хранится archive_keep последних архивов (0 — без архива). Из архива можно дочитать записи,
+# вытесненные ограничением max_records до того, как их прочитал потребитель.
+#
+# python results_journal.py --db ../uploads/ai_image/results/journal.db --since 0
+# python results_journal.py --db ../uploads/ai_image/results/journal.db --compact
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS results (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_task ON results (task_id, seq);
+CREATE TABLE IF NOT EXISTS cursors (
+    consumer TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+
+class ResultsJournal:
+    def __init__(self, db_path, retain_days=30, max_records=100000, archive_keep=10):
+        self.db_path = Path(db_path)
+        self.retain_days = retain_days
+        self.max_records = max_records
+        self.archive_keep = archive_keep
+        self.archive_dir = self.db_path.parent / 'journal-archive'
+        self._local = threading.local()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        # Отдельное соединение на поток и процесс (после fork соединения sqlite3 непригодны)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def append(self, result):
+        """
+        Дописывает компактную запись результата. Возвращает её seq.
+        """
+        error = result.get('error') or ''
+        record = {
+            'task_id': result['task_id'],
+            'status': result['status'],
+            'output_image': result.get('output_image'),
+            'attempt': result.get('attempt'),
+            'cache_hit': result.get('cache_hit'),
+            'output_sha256': result.get('output_sha256'),
+            # В журнал — только первая строка ошибки, полный traceback остаётся в results/<task_id>.json
+            'error': error.splitlines()[0] if error else None,
+            'finished_at': result.get('finished_at') or time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        cursor = self._conn().execute(
+            'INSERT INTO results (task_id, status, created_at, record) VALUES (?, ?, ?, ?)',
+            (str(record['task_id']), record['status'], time.time(), json.dumps(record, ensure_ascii=False))
+        )
+        return cursor.lastrowid
+
+    def read_since(self, cursor=0, limit=1000):
+        """
+        Записи с seq > cursor по возрастанию seq: список (seq, запись).
+        """
+        rows = self._conn().execute(
+            'SELECT seq, record FROM results WHERE seq > ? ORDER BY seq LIMIT ?', (int(cursor), int(limit))
+        ).fetchall()
+        return [(seq, json.loads(record)) for seq, record in rows]
+
+    def ack(self, consumer, seq):
+        """
+        Сохраняет курсор потребителя: записи до seq включительно им прочитаны.
+        """
+        self._conn().execute(
+            'INSERT INTO cursors (consumer, seq, updated_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (consumer) DO UPDATE SET seq = MAX(cursors.seq, excluded.seq), updated_at = excluded.updated_at',
+            (consumer, int(seq), time.time())
+        )
+
+    def cursor(self, consumer):
+        row = self._conn().execute('SELECT seq FROM cursors WHERE consumer = ?', (consumer,)).fetchone()
+        return row[0] if row else 0
+
+    def last_seq(self):
+        row = self._conn().execute("SELECT seq FROM sqlite_sequence WHERE name = 'results'").fetchone()
+        return row[0] if row else 0
+
+    def compact(self):
+        """
+        Удаляет прочитанные всеми потребителями записи, которые старше retain_days или вытеснены
+        более новой записью той же задачи; затем ограничивает журнал max_records записями.
+        Удалённые записи переносятся в архив (rotate). Возвращает число удалённых записей.
+        """
+        conn = self._conn()
+        row = conn.execute('SELECT MIN(seq) FROM cursors').fetchone()
+        # Пока потребителей нет, прочитанным ничего не считается
+        safe_seq = row[0] if row and row[0] is not None else 0
+        removed = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if safe_seq:
+                removed += self._delete(
+                    conn, 'seq <= ? AND (created_at < ? OR EXISTS ('
+                    'SELECT 1 FROM results newer WHERE newer.task_id = results.task_id AND newer.seq > results.seq))',
+                    (safe_seq, time.time() - self.retain_days * 86400)
+                )
+            total = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+            if self.max_records and total > self.max_records:
+                overflow = self._delete(
+                    conn, 'seq IN (SELECT seq FROM results ORDER BY seq LIMIT ?)', (total - self.max_records,)
+                )
+                unread = sum(1 for seq, _ in overflow if seq > safe_seq)
+                if unread:
+                    logger.warning(f'[JOURNAL] Журнал переполнен: {unread} непрочитанных записей вытеснены из журнала')
+                removed += overflow
+            if removed:
+                self.rotate(removed)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        if removed:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            logger.info(f'[JOURNAL] Сжатие журнала: удалено записей {len(removed)}')
+        return len(removed)
+
+    def _delete(self, conn, where, params):
+        rows = conn.execute(f'SELECT seq, record FROM results WHERE {where} ORDER BY seq', params).fetchall()
+        conn.execute(f'DELETE FROM results WHERE {where}', params)
+        return rows
+
+    def rotate(self, rows):
+        """
+        Записывает удалённые записи [(seq, record)] в новый архив и удаляет архивы сверх archive_keep.
+        """
+        if not self.archive_keep:
+            return None
+        rows = sorted(rows)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        path = self.archive_dir / f'journal-{rows[0][0]:012d}-{rows[-1][0]:012d}.jsonl.gz'
+        tmp_path = path.with_name(path.name + '.tmp')
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            for seq, record in rows:
+                f.write(json.dumps({'seq': seq, **json.loads(record)}, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+        # Имена с seq фиксированной ширины: лексикографический порядок совпадает с порядком записей
+        for old in sorted(self.archive_dir.glob('journal-*.jsonl.gz'))[:-self.archive_keep]:
+            old.unlink()
+        return path
+
+    def read_archive(self, cursor=0):
+        """
+        Записи с seq > cursor из архивов ротации: список (seq, запись).
+        """
+        records = []
+        for path in sorted(self.archive_dir.glob('journal-*.jsonl.gz')):
+            if int(path.name.split('-')[2].split('.')[0]) <= cursor:
+                continue
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    record = json.loads(line)
+                    seq = record.pop('seq')
+                    if seq > cursor:
+                        records.append((seq, record))
+        return records
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Журнал результатов: чтение после курсора и сжатие')
+    parser.add_argument('--db', type=str, required=True)
+    parser.add_argument('--since', type=int, default=None, help='Вывести записи после этого seq')
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--retain-days', type=float, default=30)
+    parser.add_argument('--max-records', type=int, default=100000)
+    parser.add_argument('--archive-keep', type=int, default=10, help='Сколько архивов ротации хранить (0 — без архива)')
+    cli_args = parser.parse_args()
+    journal = ResultsJournal(
+        cli_args.db, retain_days=cli_args.retain_days, max_records=cli_args.max_records, archive_keep=cli_args.archive_keep
+    )
+    if cli_args.since is not None:
+        for seq, record in journal.read_since(cli_args.since, cli_args.limit):
+            print(seq, json.dumps(record, ensure_ascii=False))
+    if cli_args.compact:
+        print(f'Удалено: {journal.compact()}')
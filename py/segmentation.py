@@ -0,0 +1,115 @@
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# --- Одна сегментация шины на оригинал ---
+# Маска переднего плана (модель rembg) вычисляется один раз и используется трижды: как салентная маска
+# для удаления логотипа (opencv/lama), как альфа вырезки (вместо повторного rembg) и для рамки обрезки
+# (вместо поиска по альфе). Если удаление логотипа меняет размер изображения, маска масштабируется.
+# Маска, полученная до удаления логотипа, сводится к крупнейшей связной области (шине): остальные
+# салентные объекты — логотипы, которые к этому моменту закрашены.
+
+# Порог альфы, как в crop_to_content, и отступ рамки обрезки
+ALPHA_THRESHOLD = 10
+CROP_PADDING = 5
+
+
+def predict_mask(img, session):
+    """
+    Маска переднего плана (L, размер img) моделью сессии rembg или None, если модель даёт несколько масок.
+    """
+    masks = session.predict(img)
+    if len(masks) != 1:
+        return None
+    mask = masks[0]
+    if mask.size != img.size:
+        mask = mask.resize(img.size, Image.BILINEAR)
+    return mask.convert('L')
+
+
+def main_component(mask, threshold=128):
+    """
+    Маска без салентных объектов, кроме крупнейшего (шины): области остальных связных компонент
+    (с полосой в несколько пикселей по краю) обнуляются, полупрозрачные части шины остаются.
+    """
+    import cv2
+    arr = np.asarray(mask)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats((arr > threshold).astype(np.uint8), connectivity=8)
+    if count <= 2:
+        return mask
+    largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    kernel = np.ones((5, 5), np.uint8)
+    others = cv2.dilate(((labels > 0) & (labels != largest)).astype(np.uint8), kernel)
+    tire = cv2.dilate((labels == largest).astype(np.uint8), kernel)
+    return Image.fromarray(np.where((others > 0) & (tire == 0), 0, arr).astype(np.uint8))
+
+
+def resolve_logo_mask(mask, originals_dir):
+    """
+    Путь к маске логотипа задачи (logo_mask): файл в папке оригиналов, как original_image
+    (путь в задаче — относительно проекта или другого узла, берётся только имя). None, если не задана.
+    """
+    return Path(originals_dir) / Path(mask).name if mask else None
+
+
+def logo_inpaint_mask(mask_salient, mask_logo, threshold=128):
+    """
+    Область закрашивания (uint8, 0/255): логотип внутри шины, как в remove_logo_opencv.
+    Пустая маска шины — весь логотип. Остальная шина не закрашивается.
+    Пустой результат (логотип целиком вне шины) — закрашивать нечего, remove_logo_lama возвращает кадр как есть.
+    """
+    logo = np.asarray(mask_logo) > threshold
+    tire = np.asarray(mask_salient) > threshold
+    if tire.any():
+        logo = logo & tire
+    return logo.astype(np.uint8) * 255
+
+
+class Segmentation:
+    """
+    Маска переднего плана одного оригинала. mask — L-изображение; warp(size) — она же в другом размере.
+    """
+
+    def __init__(self, mask):
+        self.mask = mask
+        self._warped = {mask.size: mask}
+
+    @classmethod
+    def of(cls, img, session):
+        mask = predict_mask(img, session)
+        return cls(mask) if mask is not None else None
+
+    def warp(self, size):
+        size = tuple(size)
+        if size not in self._warped:
+            self._warped[size] = self.mask.resize(size, Image.BILINEAR)
+        return self._warped[size]
+
+    def array(self, size=None):
+        return np.array(self.warp(size or self.mask.size))
+
+    def main_component(self):
+        return Segmentation(main_component(self.mask))
+
+    def bbox(self, size=None):
+        """
+        Рамка содержимого (x0, y0, x1, y1) с отступом CROP_PADDING или None, если маска пуста.
+        """
+        arr = np.asarray(self.warp(size or self.mask.size)) > ALPHA_THRESHOLD
+        rows = np.flatnonzero(arr.any(axis=1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(arr.any(axis=0))
+        h, w = arr.shape
+        return (
+            max(0, int(cols[0]) - CROP_PADDING), max(0, int(rows[0]) - CROP_PADDING),
+            min(w, int(cols[-1]) + 1 + CROP_PADDING), min(h, int(rows[-1]) + 1 + CROP_PADDING),
+        )
+
+    def cutout(self, img):
+        """
+        Вырезка img по маске — как rembg.remove без alpha matting (naive_cutout).
+        """
+        empty = Image.new('RGBA', img.size, 0)
+        return Image.composite(img, empty, self.warp(img.size))
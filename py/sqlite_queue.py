@@ -0,0 +1,345 @@
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from loguru import logger
+
+from task_queue import TaskClaim
+
+# --- Очередь задач в SQLite (queue_backend: sqlite) ---
+# Альтернатива папке tasks/: выбор следующей задачи — по индексу (status, priority, created_at),
+# без glob и разбора JSON всей очереди. Журнал WAL: читатели не блокируют писателя.
+# tasks/*.json по-прежнему принимаются: перед выбором задач они импортируются в базу
+# и переносятся в tasks/imported/. Только для одного узла: SQLite по NFS ненадёжен.
+#
+# python sqlite_queue.py --db ../uploads/ai_image/queue.db --import ../uploads/ai_image/tasks
+# python sqlite_queue.py --db ../uploads/ai_image/queue.db --stats
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    owner TEXT,
+    lease_until REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_next ON tasks (status, priority DESC, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_lease ON tasks (status, lease_until);
+'''
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class SqliteTaskQueue:
+    """
+    Тот же интерфейс, что у task_queue.TaskQueue (claim/finish/retry/record_attempt/reclaim_expired/pending),
+    плюс enqueue и claim_next. Ссылка на задачу — task_id или путь к JSON из tasks/ (импортируется при захвате).
+    """
+
+    def __init__(self, db_path, tasks_dir=None, lease_seconds=300, owner=None, max_attempts=3, backoff_seconds=30, backoff_max_seconds=1800):
+        self.db_path = Path(db_path)
+        self.tasks_dir = Path(tasks_dir) if tasks_dir else None
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = max(1.0, lease_seconds / 5)
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self._owner = owner
+        self._local = threading.local()
+        # Файлы задач, отложенные до конца обработки прежней версии (для одного предупреждения на файл)
+        self._deferred = set()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def owner(self):
+        return self._owner or f'{socket.gethostname()}:{os.getpid()}'
+
+    def _connect(self):
+        # Отдельное соединение на поток и процесс: соединения sqlite3 нельзя делить после fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return _Transaction(conn)
+
+    def retry_delay(self, attempt):
+        delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** max(0, attempt - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    # --- Постановка в очередь ---
+
+    def enqueue(self, task, priority=None):
+        """
+        Добавляет задачу (или заменяет задачу с тем же task_id, если та не в обработке).
+        """
+        if priority is None:
+            priority = int(task.get('priority', 0) or 0)
+        now = time.time()
+        sql = '''
+            INSERT INTO tasks (task_id, payload, status, priority, created_at, available_at)
+            VALUES (?, ?, 'pending', ?, ?, ?)
+            ON CONFLICT (task_id) DO UPDATE SET
+                payload = excluded.payload, status = 'pending', priority = excluded.priority,
+                created_at = excluded.created_at, available_at = excluded.available_at,
+                attempts = 0, last_error = NULL, owner = NULL, lease_until = NULL, finished_at = NULL
+            WHERE tasks.status != 'processing'
+        '''
+        params = (str(task['task_id']), json.dumps(task, ensure_ascii=False), priority, now, now)
+        with self._connect() as tx:
+            return tx.execute(sql, params).rowcount > 0
+
+    def import_file(self, path):
+        """
+        Импорт одного tasks/<id>.json: запись в базу и перенос файла в tasks/imported/. Возвращает task_id.
+        Если задача с тем же task_id сейчас в обработке, файл остаётся в tasks/ и импортируется,
+        когда обработка закончится (None).
+        """
+        path = Path(path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                task = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            # Файл может быть ещё недописан — попробуем при следующем проходе
+            logger.warning(f'[QUEUE] Не удалось прочитать {path.name}: {e}')
+            return None
+        if not isinstance(task, dict):
+            task = {}
+        task.setdefault('task_id', path.stem)
+        if not self.enqueue(task):
+            if path not in self._deferred:
+                self._deferred.add(path)
+                logger.warning(f'[QUEUE] Задача {task["task_id"]} сейчас в обработке, {path.name} будет импортирован после неё')
+            return None
+        self._deferred.discard(path)
+        imported_dir = path.parent / 'imported'
+        imported_dir.mkdir(exist_ok=True)
+        try:
+            os.replace(path, imported_dir / path.name)
+        except FileNotFoundError:
+            pass
+        return task['task_id']
+
+    def import_json_dir(self, tasks_dir=None):
+        """
+        Импорт всех tasks/*.json (совместимость с PHP-плагином и старой папкой задач).
+        """
+        tasks_dir = Path(tasks_dir) if tasks_dir else self.tasks_dir
+        if tasks_dir is None or not tasks_dir.is_dir():
+            return 0
+        count = 0
+        for path in sorted(tasks_dir.glob('*.json')):
+            if self.import_file(path) is not None:
+                count += 1
+        if count:
+            logger.info(f'[QUEUE] Импортировано задач из {tasks_dir}: {count}')
+        return count
+
+    # --- Выбор и захват ---
+
+    def pending(self, limit=None):
+        """
+        task_id ожидающих задач в порядке выбора (приоритет, затем время постановки).
+        """
+        self.import_json_dir()
+        with self._connect() as tx:
+            rows = tx.execute(
+                "SELECT task_id FROM tasks WHERE status = 'pending' AND available_at <= ? "
+                "ORDER BY priority DESC, created_at LIMIT ?",
+                (time.time(), limit if limit else -1)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def claim_next(self, n=1):
+        """
+        Атомарно захватывает до n следующих задач (BEGIN IMMEDIATE). Возвращает список TaskClaim.
+        """
+        now = time.time()
+        with self._connect() as tx:
+            tx.begin_immediate()
+            ids = [row[0] for row in tx.execute(
+                "SELECT task_id FROM tasks WHERE status = 'pending' AND available_at <= ? "
+                "ORDER BY priority DESC, created_at LIMIT ?",
+                (now, n)
+            )]
+            tx.executemany(
+                "UPDATE tasks SET status = 'processing', owner = ?, lease_until = ? WHERE task_id = ?",
+                [(self.owner, now + self.lease_seconds, task_id) for task_id in ids]
+            )
+        return [TaskClaim(self, None, task_id) for task_id in ids]
+
+    def claim(self, ref):
+        """
+        Захватывает задачу по task_id (или по пути к JSON из tasks/, который сначала импортируется).
+        None — если задачу уже забрал другой воркер или время повтора не подошло.
+        """
+        task_id = self.import_file(ref) if isinstance(ref, Path) else ref
+        if task_id is None:
+            return None
+        now = time.time()
+        with self._connect() as tx:
+            claimed = tx.execute(
+                "UPDATE tasks SET status = 'processing', owner = ?, lease_until = ? "
+                "WHERE task_id = ? AND status = 'pending' AND available_at <= ?",
+                (self.owner, now + self.lease_seconds, task_id, now)
+            ).rowcount
+        return TaskClaim(self, None, task_id) if claimed else None
+
+    def read_task(self, claim):
+        with self._connect() as tx:
+            row = tx.execute('SELECT payload, attempts FROM tasks WHERE task_id = ?', (claim.name,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f'Задача {claim.name} не найдена в очереди')
+        task = json.loads(row[0])
+        if row[1]:
+            task['_retry'] = {'attempts': row[1]}
+        return task
+
+    def peek(self, ref):
+        """
+        Задача без захвата (для планирования пакета). None — если её нет в очереди.
+        """
+        if isinstance(ref, Path):
+            try:
+                with open(ref, 'r', encoding='utf-8') as f:
+                    task = json.load(f)
+            except (OSError, ValueError):
+                return None
+            return task if isinstance(task, dict) else None
+        with self._connect() as tx:
+            row = tx.execute('SELECT payload FROM tasks WHERE task_id = ?', (str(ref),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def heartbeat(self, claim):
+        with self._connect() as tx:
+            return tx.execute(
+                "UPDATE tasks SET lease_until = ? WHERE task_id = ? AND status = 'processing' AND owner = ?",
+                (time.time() + self.lease_seconds, claim.name, self.owner)
+            ).rowcount > 0
+
+    # --- Завершение ---
+
+    def record_attempt(self, claim, attempt, error):
+        with self._connect() as tx:
+            tx.execute('UPDATE tasks SET attempts = ?, last_error = ? WHERE task_id = ?', (attempt, error, claim.name))
+        return True
+
+    def retry(self, claim, delay):
+        claim.release()
+        with self._connect() as tx:
+            tx.execute(
+                "UPDATE tasks SET status = 'pending', available_at = ?, owner = NULL, lease_until = NULL "
+                "WHERE task_id = ? AND status = 'processing'",
+                (time.time() + delay, claim.name)
+            )
+        return claim.name
+
+    def finish(self, claim, ok):
+        claim.release()
+        with self._connect() as tx:
+            tx.execute(
+                "UPDATE tasks SET status = ?, finished_at = ?, owner = NULL, lease_until = NULL "
+                "WHERE task_id = ? AND status = 'processing'",
+                (DONE if ok else FAILED, time.time(), claim.name)
+            )
+        return claim.name
+
+    complete = finish
+
+    def reclaim_expired(self):
+        with self._connect() as tx:
+            count = tx.execute(
+                "UPDATE tasks SET status = 'pending', owner = NULL, lease_until = NULL "
+                "WHERE status = 'processing' AND lease_until < ?",
+                (time.time(),)
+            ).rowcount
+        if count:
+            logger.warning(f'[QUEUE] Аренда истекла у {count} задач, задачи возвращены в очередь')
+        return count
+
+    def done_tasks(self, task_ids=None):
+        """
+        Успешно обработанные задачи: все или только с указанными task_id.
+        """
+        with self._connect() as tx:
+            if task_ids:
+                rows = []
+                ids = list(task_ids)
+                for i in range(0, len(ids), 500):
+                    chunk = ids[i:i + 500]
+                    rows += tx.execute(
+                        f"SELECT payload FROM tasks WHERE status = 'done' AND task_id IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall()
+            else:
+                rows = tx.execute("SELECT payload FROM tasks WHERE status = 'done' ORDER BY id").fetchall()
+        for (payload,) in rows:
+            yield json.loads(payload)
+
+    def stats(self):
+        with self._connect() as tx:
+            return dict(tx.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+
+class _Transaction:
+    """
+    with-обёртка над соединением в режиме autocommit: BEGIN по требованию, COMMIT/ROLLBACK на выходе.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._began = False
+
+    def begin_immediate(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        self._began = True
+
+    def execute(self, sql, params=()):
+        return self.conn.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        return self.conn.executemany(sql, rows)
+
+    def executescript(self, script):
+        return self.conn.executescript(script)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._began:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Очередь задач в SQLite: импорт tasks/*.json и статистика')
+    parser.add_argument('--db', type=str, required=True)
+    parser.add_argument('--import', dest='import_dir', type=str, default=None, help='Импортировать задачи из папки')
+    parser.add_argument('--stats', action='store_true')
+    cli_args = parser.parse_args()
+    queue = SqliteTaskQueue(cli_args.db)
+    if cli_args.import_dir:
+        print(f'Импортировано: {queue.import_json_dir(cli_args.import_dir)}')
+    if cli_args.stats:
+        print(queue.stats())
@@ -0,0 +1,363 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+from pathlib import Path
+from loguru import logger
+
+# --- Захват задач из общей папки tasks/ несколькими процессами и узлами (в т.ч. по NFS) ---
+# tasks/<id>.json            — ожидает обработки
+# tasks/processing/<id>.json — захвачена воркером; mtime файла — отметка аренды (heartbeat)
+# tasks/processing/<id>.lease — кто захватил (узел, pid, время) — для логов
+# tasks/done/, tasks/failed/ — обработанные задачи
+# Захват — атомарный rename: из нескольких претендентов его выполняет ровно один.
+# Аренда, которую не продлевали дольше lease_seconds (воркер упал), возвращается в tasks/.
+# Повтор после временной ошибки: задача возвращается в tasks/ с mtime в будущем (время следующей попытки),
+# счётчик попыток и последняя ошибка — в поле "_retry" самой задачи. После max_attempts попыток
+# или при постоянной ошибке задача уходит в failed/ (dead letter) вместе с "_retry".
+# Истёкшая аренда (воркер упал на задаче) тоже считается попыткой.
+# Пока задача с тем же id в processing/, новая версия в tasks/ не захватывается (ждёт окончания обработки).
+
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+RETRY_FIELD = '_retry'
+
+
+class PermanentTaskError(RuntimeError):
+    """
+    Ошибка, которую повтор не исправит: нет входного файла, задача не проходит проверку и т.п.
+    """
+
+
+def _permanent_types():
+    types = [PermanentTaskError, FileNotFoundError, json.JSONDecodeError]
+    try:
+        from jsonschema import ValidationError
+        types.append(ValidationError)
+    except ImportError:
+        pass
+    try:
+        from PIL import Image, UnidentifiedImageError
+        types += [UnidentifiedImageError, Image.DecompressionBombError]
+    except ImportError:
+        pass
+    return tuple(types)
+
+
+def _http_status(exc):
+    for obj in (exc, getattr(exc, 'response', None)):
+        status = getattr(obj, 'status_code', None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def _is_network_error(exc):
+    if isinstance(exc, (TimeoutError, ConnectionError, socket.timeout)):
+        return True
+    try:
+        import requests
+        if isinstance(exc, (requests.Timeout, requests.ConnectionError)):
+            return True
+    except ImportError:
+        pass
+    # Исключения SDK (RunwayML и др.): APITimeoutError, APIConnectionError
+    name = type(exc).__name__
+    return 'Timeout' in name or 'ConnectionError' in name
+
+
+def is_permanent_error(exc):
+    """
+    Классификация по цепочке исключений (__cause__/__context__): True — повторять бесполезно.
+    Таймауты, обрывы соединения, HTTP 5xx/408/429 — временные; прочие HTTP 4xx — постоянные.
+    Неизвестные ошибки считаются временными: число попыток всё равно ограничено.
+    """
+    permanent_types = _permanent_types()
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if _is_network_error(exc):
+            return False
+        status = _http_status(exc)
+        if status is not None:
+            return 400 <= status < 500 and status not in (408, 425, 429)
+        if isinstance(exc, permanent_types):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def should_retry(exc, attempt, max_attempts):
+    """
+    Повторять ли задачу после ошибки exc на попытке attempt: временная ошибка и попытки ещё есть.
+    """
+    return not is_permanent_error(exc) and attempt < max_attempts
+
+
+class TaskClaim:
+    """
+    Захваченная задача. Пока claim открыт (with), фоновый поток продлевает аренду.
+    path — файл в processing/ (для очереди в SQLite — None), name — имя файла или task_id.
+    """
+
+    def __init__(self, queue, path, name):
+        self.queue = queue
+        self.path = path
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+
+    def read(self):
+        return self.queue.read_task(self)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.heartbeat_interval):
+            if not self.queue.heartbeat(self):
+                logger.warning(f'[QUEUE] Аренда {self.name} потеряна (задача возвращена в очередь)')
+                return
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._heartbeat, name=f'lease-{self.name}', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class TaskQueue:
+    def __init__(self, tasks_dir, lease_seconds=300, owner=None, max_attempts=3, backoff_seconds=30, backoff_max_seconds=1800):
+        self.tasks_dir = Path(tasks_dir)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.heartbeat_interval = max(1.0, lease_seconds / 5)
+        self._owner = owner
+        # Задачи, отложенные до конца обработки прежней версии (для одного предупреждения на файл)
+        self._deferred = set()
+        for sub in (PROCESSING, DONE, FAILED):
+            (self.tasks_dir / sub).mkdir(parents=True, exist_ok=True)
+
+    @property
+    def owner(self):
+        # pid берётся в момент захвата: очередь может быть создана до fork
+        return self._owner or f'{socket.gethostname()}:{os.getpid()}'
+
+    def _lease_path(self, name):
+        return self.tasks_dir / PROCESSING / (Path(name).stem + '.lease')
+
+    def retry_delay(self, attempt):
+        """
+        Экспоненциальная задержка перед попыткой attempt + 1 (со случайным разбросом ±20%).
+        """
+        delay = min(self.backoff_max_seconds, self.backoff_seconds * 2 ** max(0, attempt - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    def pending(self, limit=None):
+        """
+        Ожидающие задачи, время которых подошло, самые старые первыми.
+        """
+        now = time.time()
+        files = []
+        for path in self.tasks_dir.glob('*.json'):
+            try:
+                mtime = path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if mtime <= now:
+                files.append((mtime, path))
+        files.sort()
+        files = [path for _, path in files]
+        return files[:limit] if limit else files
+
+    def read_task(self, claim):
+        with open(claim.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def peek(self, task_file):
+        """
+        Задача без захвата (для планирования пакета). None — если файла уже нет или он недописан.
+        """
+        try:
+            with open(task_file, 'r', encoding='utf-8') as f:
+                task = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return task if isinstance(task, dict) else None
+
+    def heartbeat(self, claim):
+        try:
+            os.utime(claim.path, None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def claim(self, task_file):
+        """
+        Захватывает задачу. None — если её уже забрал другой воркер или время повтора не подошло.
+        """
+        task_file = Path(task_file)
+        target = self.tasks_dir / PROCESSING / task_file.name
+        if target.exists():
+            # Прежняя версия задачи ещё в обработке: rename заменил бы её файл и аренду
+            if task_file.name not in self._deferred:
+                self._deferred.add(task_file.name)
+                logger.warning(f'[QUEUE] Задача {task_file.name} ещё в обработке, новая версия будет взята после неё')
+            return None
+        self._deferred.discard(task_file.name)
+        try:
+            if task_file.stat().st_mtime > time.time():
+                return None
+            # Отметка ставится до rename: в processing/ файл попадает уже со свежей арендой
+            os.utime(task_file, None)
+            os.rename(task_file, target)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(self._lease_path(task_file.name), 'w', encoding='utf-8') as f:
+                json.dump({'owner': self.owner, 'claimed_at': time.time()}, f)
+        except OSError as e:
+            logger.warning(f'[QUEUE] Не удалось записать аренду {task_file.name}: {e}')
+        return TaskClaim(self, target, task_file.name)
+
+    def record_attempt(self, claim, attempt, error):
+        """
+        Записывает в захваченную задачу номер попытки и последнюю ошибку (поле "_retry").
+        """
+        return self._write_attempt(claim.path, attempt, error)
+
+    def _write_attempt(self, path, attempt, error):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                task = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not isinstance(task, dict):
+            return False
+        task[RETRY_FIELD] = {
+            'attempts': attempt,
+            'last_error': error,
+            'last_attempt_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(task, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return True
+
+    def _attempts(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                task = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        retry = task.get(RETRY_FIELD) if isinstance(task, dict) else None
+        return (retry or {}).get('attempts', 0)
+
+    def retry(self, claim, delay):
+        """
+        Возвращает задачу в tasks/; захватить её можно будет не раньше чем через delay секунд.
+        """
+        claim.release()
+        due = time.time() + delay
+        target = self.tasks_dir / claim.name
+        if target.exists():
+            # Пока задача обрабатывалась, её поставили заново — повтор не нужен
+            return self.finish(claim, False)
+        try:
+            os.utime(claim.path, (due, due))
+            os.rename(claim.path, target)
+        except FileNotFoundError:
+            logger.warning(f'[QUEUE] Задача {claim.name} уже не в processing/ (аренда истекла?)')
+            return None
+        try:
+            self._lease_path(claim.name).unlink()
+        except FileNotFoundError:
+            pass
+        return target
+
+    def finish(self, claim, ok):
+        """
+        Переносит задачу в done/ или failed/.
+        """
+        claim.release()
+        target = self.tasks_dir / (DONE if ok else FAILED) / claim.name
+        try:
+            os.replace(claim.path, target)
+        except FileNotFoundError:
+            logger.warning(f'[QUEUE] Задача {claim.name} уже не в processing/ (аренда истекла?)')
+            return None
+        try:
+            self._lease_path(claim.name).unlink()
+        except FileNotFoundError:
+            pass
+        return target
+
+    def done_tasks(self, task_ids=None):
+        """
+        Успешно обработанные задачи (из done/): все или только с указанными task_id (= имя файла).
+        """
+        wanted = set(task_ids) if task_ids else None
+        for path in sorted((self.tasks_dir / DONE).glob('*.json')):
+            if wanted is not None and path.stem not in wanted:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f'[QUEUE] Не удалось прочитать {path.name}: {e}')
+
+    def reclaim_expired(self):
+        """
+        Возвращает в tasks/ задачи с истёкшей арендой (попытка засчитывается, после max_attempts — в failed/).
+        Возвращает число таких задач.
+        """
+        now = time.time()
+        count = 0
+        for path in (self.tasks_dir / PROCESSING).glob('*.json'):
+            try:
+                age = now - path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age < self.lease_seconds:
+                continue
+            lease_path = self._lease_path(path.name)
+            try:
+                with open(lease_path, 'r', encoding='utf-8') as f:
+                    owner = json.load(f).get('owner')
+            except (OSError, ValueError):
+                owner = None
+            # Воркер упал или завис на задаче — это тоже попытка: иначе такая задача повторяется бесконечно
+            attempt = self._attempts(path) + 1
+            self._write_attempt(path, attempt, f'Аренда истекла ({age:.0f} с, владелец {owner})')
+            target = self.tasks_dir / path.name
+            if target.exists():
+                # Задачу с тем же id уже поставили заново — старую копию убираем в failed/
+                target = self.tasks_dir / FAILED / path.name
+            elif attempt >= self.max_attempts:
+                target = self.tasks_dir / FAILED / path.name
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            try:
+                lease_path.unlink()
+            except FileNotFoundError:
+                pass
+            count += 1
+            if target.parent.name == FAILED:
+                logger.error(f'[QUEUE] Аренда {path.name} истекла ({age:.0f} с, владелец {owner}), попытка {attempt}/{self.max_attempts} — задача в failed/')
+            else:
+                logger.warning(f'[QUEUE] Аренда {path.name} истекла ({age:.0f} с, владелец {owner}), попытка {attempt}/{self.max_attempts} — задача возвращена в очередь')
+        return count
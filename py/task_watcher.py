@@ -0,0 +1,110 @@
+import time
+from pathlib import Path
+
+# --- Наблюдение за папкой задач ---
+# На Linux используется inotify (пакет inotify_simple), иначе — опрос папки с интервалом.
+# pip install inotify_simple  # опционально, только Linux
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+    inotify_flags = None
+
+
+class TaskWatcher:
+    """
+    Отслеживает появление новых *.json в папке задач.
+    wait(timeout) возвращает список путей к новым/изменённым файлам задач.
+    """
+
+    def __init__(self, tasks_dir, poll_interval=2.0, use_inotify=True):
+        self.tasks_dir = Path(tasks_dir)
+        self.poll_interval = float(poll_interval)
+        self._seen = {}
+        self._inotify = None
+        self._rescan = False
+        if use_inotify and INotify is not None:
+            try:
+                self._inotify = INotify()
+                # CLOSE_WRITE — файл дописан (file_put_contents), MOVED_TO — атомарное переименование;
+                # DELETE/MOVED_FROM — файл удалён или захвачен воркером (забываем его)
+                self._inotify.add_watch(
+                    str(self.tasks_dir),
+                    inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.DELETE | inotify_flags.MOVED_FROM
+                )
+            except OSError:
+                self._inotify = None
+
+    @property
+    def mode(self):
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    def scan(self):
+        """
+        Полный проход по папке: возвращает файлы, которые ещё не видели (или которые изменились).
+        """
+        found = []
+        existing = set()
+        for task_file in sorted(self.tasks_dir.glob('*.json')):
+            try:
+                mtime = task_file.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            existing.add(task_file.name)
+            if self._seen.get(task_file.name) != mtime:
+                self._seen[task_file.name] = mtime
+                found.append(task_file)
+        # Забываем удалённые файлы (по тому же проходу), чтобы словарь не рос бесконечно
+        for name in list(self._seen):
+            if name not in existing:
+                del self._seen[name]
+        self._rescan = False
+        return found
+
+    def wait(self, timeout=None):
+        """
+        Ждёт новые задачи не дольше timeout секунд (None — poll_interval).
+        """
+        timeout = self.poll_interval if timeout is None else timeout
+        if self._inotify is None:
+            deadline = time.monotonic() + timeout
+            while True:
+                found = self.scan()
+                if found or time.monotonic() >= deadline:
+                    return found
+                time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+        events = self._inotify.read(timeout=int(timeout * 1000))
+        # Один файл может прийти в пачке несколько раз (CLOSE_WRITE, затем MOVED_TO и т.п.)
+        changed = {}
+        for event in events:
+            if event.mask & inotify_flags.Q_OVERFLOW:
+                # Очередь ядра переполнена, часть событий потеряна — сверяемся с папкой
+                self._rescan = True
+                continue
+            if not event.name.endswith('.json'):
+                continue
+            if event.mask & (inotify_flags.DELETE | inotify_flags.MOVED_FROM):
+                changed.pop(event.name, None)
+                self._seen.pop(event.name, None)
+                continue
+            changed[event.name] = True
+        found = []
+        for name in changed:
+            task_file = self.tasks_dir / name
+            try:
+                mtime = task_file.stat().st_mtime
+            except FileNotFoundError:
+                # Файл пропал между событием и чтением — состояние папки неизвестно, сверяемся полностью
+                self._rescan = True
+                continue
+            self._seen[name] = mtime
+            found.append(task_file)
+        if self._rescan:
+            found += [p for p in self.scan() if p not in found]
+        return found
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,58 @@
+import numpy as np
+from PIL import Image
+
+from batch_planner import plan_batch
+
+
+def save(img, path):
+    img.save(path)
+    return path
+
+
+def tire_photo(size=(400, 300)):
+    # Плавный фон и тёмное «колесо»: dHash устойчив к пересохранению и уменьшению
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w]
+    arr = (x * 255 / w * 0.6 + y * 255 / h * 0.3).astype(np.uint8)
+    arr[(x - w / 2) ** 2 + (y - h / 2) ** 2 < (h / 3) ** 2] = 30
+    return Image.fromarray(arr).convert('RGB')
+
+
+def test_exact_and_resized_copies_follow_leader(tmp_path):
+    photo = tire_photo()
+    big = save(photo, tmp_path / 'big.png')
+    copy = save(photo, tmp_path / 'copy.png')
+    small = save(photo.resize((200, 150), Image.LANCZOS), tmp_path / 'small.jpg')
+    items = [('small', small, 'opencv'), ('big', big, 'opencv'), ('copy', copy, 'opencv')]
+    leaders, members = plan_batch(items)
+    assert leaders == [('big', None)]
+    # Точная копия берёт вырезку из кэша по своему ключу, похожий снимок — вырезку лидера
+    assert members == [('small', 'big'), ('copy', None)]
+
+
+def test_brightness_shift_is_rejected_by_thumbnails(tmp_path):
+    photo = tire_photo()
+    a = save(photo, tmp_path / 'a.png')
+    # Тот же рисунок ярче на 60 уровней: dHash совпадает, миниатюры — нет
+    b = save(Image.eval(photo, lambda v: min(255, v + 60)), tmp_path / 'b.png')
+    items = [('a', a, 'opencv'), ('b', b, 'opencv')]
+    leaders, members = plan_batch(items)
+    assert leaders == [('a', None), ('b', None)] and members == []
+    _, members = plan_batch(items, max_thumb_diff=255)
+    assert members == [('b', 'a')]
+
+
+def test_other_aspect_ratio_is_not_similar(tmp_path):
+    photo = tire_photo()
+    a = save(photo, tmp_path / 'a.png')
+    b = save(photo.resize((400, 200)), tmp_path / 'b.png')
+    _, members = plan_batch([('a', a, 'opencv'), ('b', b, 'opencv')], hamming_threshold=64, max_thumb_diff=255)
+    assert members == []
+
+
+def test_groups_only_within_same_signature(tmp_path):
+    photo = tire_photo()
+    a = save(photo, tmp_path / 'a.png')
+    b = save(photo, tmp_path / 'b.png')
+    leaders, members = plan_batch([('a', a, 'opencv'), ('b', b, 'runwayml')])
+    assert len(leaders) == 2 and members == []
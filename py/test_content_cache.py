@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from content_cache import CutoutCache, OutputCache, content_key, file_sha256
+
+
+def make_cutout(size=(40, 30)):
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 4), dtype=np.uint8), 'RGBA')
+
+
+def test_content_key_ignores_key_order():
+    assert content_key(1, {'a': 1, 'b': [2, 3]}) == content_key(1, {'b': [2, 3], 'a': 1})
+    assert content_key(1, {'a': 1}) != content_key(2, {'a': 1})
+
+
+def test_file_hash_follows_content(tmp_path):
+    path = tmp_path / 'original.png'
+    path.write_bytes(b'first')
+    first = file_sha256(path)
+    assert file_sha256(path) == first
+    # Тот же размер, другое содержимое и mtime — хэш пересчитывается
+    path.write_bytes(b'other')
+    os.utime(path, ns=(0, 0))
+    assert file_sha256(path) != first
+
+
+def test_output_cache_roundtrip(tmp_path):
+    cache = OutputCache(tmp_path / 'cache')
+    output = tmp_path / 'processed' / 'a.png'
+    output.parent.mkdir()
+    make_cutout().save(output)
+    digest = cache.store('ab' * 32, output)
+    assert digest == file_sha256(output)
+    # Промах: другой ключ или другое расширение
+    assert cache.fetch('cd' * 32, tmp_path / 'processed' / 'b.png') is None
+    assert cache.fetch('ab' * 32, tmp_path / 'processed' / 'b.jpg') is None
+    target = tmp_path / 'processed' / 'b.png'
+    assert cache.fetch('ab' * 32, target) == digest
+    assert target.read_bytes() == output.read_bytes()
+    # В кэше — копия: замена результата задачи не меняет закэшированный файл
+    output.unlink()
+    make_cutout((10, 10)).save(output)
+    assert cache.fetch('ab' * 32, target) == digest
+
+
+def test_output_cache_rejects_truncated_entry(tmp_path):
+    cache = OutputCache(tmp_path / 'cache')
+    output = tmp_path / 'a.png'
+    make_cutout().save(output)
+    cache.store('ab' * 32, output)
+    data_path, _ = cache._paths('ab' * 32, '.png')
+    os.chmod(data_path, 0o644)
+    data_path.write_bytes(b'broken')
+    assert cache.fetch('ab' * 32, tmp_path / 'b.png') is None
+
+
+def test_cutout_roundtrip_is_lossless_and_keeps_decode_size(tmp_path):
+    for image_format in ('png', 'webp'):
+        cache = CutoutCache(tmp_path / image_format, image_format=image_format)
+        img = make_cutout()
+        cache.put('ab' * 32, img, (800, 600))
+        cached, stored_size = cache.get('ab' * 32)
+        assert stored_size == (800, 600)
+        assert np.array_equal(np.asarray(cached), np.asarray(img))
+
+
+def test_cutout_from_larger_original_serves_smaller_decode_size(tmp_path):
+    cache = CutoutCache(tmp_path)
+    cache.put('cd' * 32, make_cutout(), (800, 600))
+    # Другой размер макета или render_mode: нужен меньший оригинал — вырезка подходит
+    assert cache.contains('cd' * 32, (400, 300))
+    assert cache.get('cd' * 32, (400, 300))[1] == (800, 600)
+    # Нужен больший оригинал — промах, вырезку надо вычислить заново
+    assert not cache.contains('cd' * 32, (1600, 1200))
+    assert cache.get('cd' * 32, (1600, 1200)) is None
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_cutout_without_decode_size_only_matches_any_size(tmp_path):
+    cache = CutoutCache(tmp_path)
+    cache.put('ef' * 32, make_cutout())
+    assert cache.get('ef' * 32)[1] is None
+    assert cache.get('ef' * 32, (10, 10)) is None
+
+
+def test_cutout_cache_evicts_least_recently_used(tmp_path):
+    cache = CutoutCache(tmp_path)
+    keys = [f'{i:02d}' * 32 for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, make_cutout(), (80, 60))
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    # Попадание обновляет mtime: самой давней становится вторая вырезка
+    assert cache.get(keys[0]) is not None
+    entry = cache._path(keys[0]).stat().st_size
+    cache.max_bytes = int(entry * 2.5)
+    cache.evict()
+    assert [cache.contains(key) for key in keys] == [True, False, False, True]
+    assert cache.evictions == 2
+    assert cache.stats()['size_mb'] * 2 ** 20 <= cache.max_bytes * 0.9
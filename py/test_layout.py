@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import resampling
+from layout import COEFF, compile_layout, downsample_text_layer, draw_tire, index_box_layout
+
+ASSETS = Path(__file__).parent / 'test_assets'
+FONTS = Path(__file__).parent.parent / 'uploads' / 'ai_image' / 'fonts'
+BACKGROUND = (52, 159, 205, 255)
+
+
+def sample_tire():
+    # Вырезка шины: круг с прозрачным фоном и мягким краем
+    with Image.open(ASSETS / 'test_image.png') as src:
+        tire = src.convert('RGBA')
+    y, x = np.mgrid[0:tire.height, 0:tire.width]
+    r = np.hypot(x - tire.width / 2, y - tire.height / 2)
+    alpha = np.clip((tire.width / 2 - r) * 32, 0, 255).astype(np.uint8)
+    tire.putalpha(Image.fromarray(alpha))
+    return tire
+
+
+def mean_diff(a, b):
+    return np.abs(np.asarray(a, dtype=np.int16) - np.asarray(b, dtype=np.int16)).mean()
+
+
+def test_layout_is_compiled_once_per_size():
+    layout = compile_layout(620, 826)
+    assert compile_layout(620, 826) is layout
+    assert compile_layout(1860, 2478) is not layout
+
+
+@pytest.mark.parametrize('width, height', [(620, 826), (1860, 2478), (1000, 1000)])
+def test_layout_matches_coefficients(width, height):
+    layout = compile_layout(width, height)
+    assert layout['brand']['font_size'] == int(width * COEFF['brand_font'])
+    assert layout['brand']['pos'] == (width // 2, int(height * COEFF['brand_y']))
+    assert layout['tire']['size'] == (int(width * COEFF['tire_w']), int(height * COEFF['tire_h']))
+    assert layout['tire']['pos'] == (int(width * COEFF['tire_x']), int(height * COEFF['tire_y']))
+    # Блоки индексов — те же, что рисует draw_index_box по своим координатам
+    for name in ('load_index', 'speed_index'):
+        x, y = layout[name]['rect'][:2]
+        assert layout[name] == index_box_layout(width, height, x, y)
+    # Все элементы в пределах холста
+    tire_x, tire_y = layout['tire']['pos']
+    tire_w, tire_h = layout['tire']['size']
+    assert tire_x + tire_w <= width and tire_y + tire_h <= height
+    for rect in (layout['specs']['rect'], layout['specs']['rim_rect'], layout['load_index']['rect'], layout['speed_index']['rect']):
+        assert 0 <= rect[0] < rect[2] <= width and 0 <= rect[1] < rect[3] <= height
+
+
+def test_supersampled_layout_scales_with_factor():
+    small = compile_layout(620, 826)
+    large = compile_layout(620 * 3, 826 * 3)
+    # Целочисленное округление: отличие от масштабированного макета — не больше factor пикселей
+    for (x, y), (x3, y3) in ((small['tire']['pos'], large['tire']['pos']), (small['tire']['size'], large['tire']['size'])):
+        assert abs(x * 3 - x3) < 3 and abs(y * 3 - y3) < 3
+    assert abs(small['brand']['font_size'] * 3 - large['brand']['font_size']) < 3
+
+
+def test_layered_tire_matches_full_render():
+    tire = sample_tire()
+    # full: шина на холсте суперсэмплинга, затем уменьшение всего холста
+    full = Image.new('RGBA', (620 * 3, 826 * 3), BACKGROUND)
+    draw_tire(full, tire, 620 * 3, 826 * 3)
+    full = resampling.resize(full, (620, 826))
+    # layered: шина сразу в целевом размере, в том же месте макета
+    layered = Image.new('RGBA', (620, 826), BACKGROUND)
+    draw_tire(layered, tire, 620, 826, factor=3)
+    assert mean_diff(layered, full) < 0.5
+    # Без дробного переноса (макет целевого холста) шина смещается
+    shifted = Image.new('RGBA', (620, 826), BACKGROUND)
+    draw_tire(shifted, tire, 620, 826)
+    assert mean_diff(shifted, full) > mean_diff(layered, full)
+
+
+def test_layered_text_matches_full_render():
+    layout = compile_layout(620 * 3, 826 * 3)['brand']
+    font = ImageFont.truetype(str(FONTS / 'Inter-Bold.ttf'), layout['font_size'])
+    full = Image.new('RGBA', (620 * 3, 826 * 3), BACKGROUND)
+    ImageDraw.Draw(full).text(layout['pos'], 'MICHELIN', font=font, fill='#FFFFFF', anchor='mt')
+    full = resampling.resize(full, (620, 826))
+    # layered: текст на прозрачном слое суперсэмплинга, уменьшается только слой
+    layer = Image.new('RGBA', (620 * 3, 826 * 3), (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text(layout['pos'], 'MICHELIN', font=font, fill='#FFFFFF', anchor='mt')
+    layered = Image.new('RGBA', (620, 826), BACKGROUND)
+    layered.alpha_composite(downsample_text_layer(layer, (620, 826)))
+    assert mean_diff(layered, full) < 0.1
+    # Без тёмной каймы: белый текст на голубом фоне не темнее фона
+    rgb = np.asarray(layered)[..., :3].astype(int)
+    assert (rgb - np.array(BACKGROUND[:3]) >= -2).all()
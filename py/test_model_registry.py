@@ -0,0 +1,31 @@
+import pytest
+
+import model_registry
+from model_registry import ModelRegistry
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    # rembg-модели — в tmp_path/rembg, веса torch — в tmp_path/weights
+    (tmp_path / 'rembg').mkdir()
+    (tmp_path / 'weights').mkdir()
+    monkeypatch.setattr(model_registry, 'rembg_model_file', lambda name: tmp_path / 'rembg' / f'{name}.onnx')
+    return ModelRegistry(u2net_weights={'u2net': tmp_path / 'weights' / 'u2net.pth'})
+
+
+def test_missing_torch_weights_do_not_look_like_rembg_model(tmp_path, registry):
+    (tmp_path / 'rembg' / 'u2net.onnx').write_bytes(b'onnx')
+    missing = registry.ensure_model_files(rembg_models=['u2net'], u2net_models=['u2net'], allow_download=False)
+    assert missing == [('u2net', 'u2net', tmp_path / 'weights' / 'u2net.pth')]
+
+
+def test_missing_rembg_model_without_download(tmp_path, registry):
+    (tmp_path / 'weights' / 'u2net.pth').write_bytes(b'pth')
+    with pytest.raises(RuntimeError):
+        registry.ensure_model_files(rembg_models=['u2net'], u2net_models=['u2net'], allow_download=False)
+
+
+def test_exported_onnx_counts_as_weights(tmp_path, registry):
+    (tmp_path / 'rembg' / 'u2net.onnx').write_bytes(b'onnx')
+    (tmp_path / 'weights' / 'u2net.onnx').write_bytes(b'onnx')
+    assert registry.missing_model_files(['u2net'], ['u2net']) == []
@@ -0,0 +1,107 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from PIL import Image, ImageDraw, ImageFont
+
+import postprocess
+import resampling
+
+ASSETS = Path(__file__).parent / 'test_assets'
+FONTS = Path(__file__).parent.parent / 'uploads' / 'ai_image' / 'fonts'
+
+
+def sample_image():
+    # Градиент, резкие края (текст, рамки) и полупрозрачная область — как холст карточки перед уменьшением
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:240, 0:320]
+    arr = np.zeros((240, 320, 4), dtype=np.uint8)
+    arr[..., 0] = x * 255 // 319
+    arr[..., 1] = y * 255 // 239
+    arr[..., 2] = rng.integers(0, 256, (240, 320))
+    arr[..., 3] = 255
+    arr[150:200, 40:140, 3] = 100
+    img = Image.fromarray(arr)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((180, 40, 300, 120), outline=(255, 255, 255, 255), width=3)
+    draw.text((20, 20), 'MICHELIN 205/55 R16', fill=(255, 255, 255, 255))
+    return img
+
+
+@pytest.mark.parametrize('chain', [
+    postprocess.DEFAULT_CHAIN,
+    postprocess.LAYERED_CHAIN,
+    [{'op': 'sharpness', 'factor': 2.0}],
+    [{'op': 'smooth'}],
+    [{'op': 'smooth_more'}],
+    [{'op': 'color', 'factor': 0.5}, {'op': 'sharpness', 'factor': 0.3}],
+])
+@pytest.mark.parametrize('mode', ['RGBA', 'RGB'])
+def test_fused_matches_pillow(chain, mode):
+    img = sample_image().convert(mode)
+    expected = np.asarray(postprocess.apply_pillow(img, chain)).astype(int)
+    actual = np.asarray(postprocess.apply(img, chain, backend='fused')).astype(int)
+    assert actual.shape == expected.shape
+    diff = np.abs(actual - expected)
+    # Расхождения — только округление промежуточных uint8 в цепочке Pillow (яркость L в Color и т.п.)
+    assert diff.max() <= 2
+    assert diff.mean() < 1
+
+
+def test_empty_chain_and_unknown_operator():
+    img = sample_image()
+    assert postprocess.apply(img, []) is img
+    with pytest.raises(ValueError):
+        postprocess.apply(img, [{'op': 'unsharp'}])
+
+
+def draw_text(draw, f):
+    # Надписи карточки (бренд, модель, плашка размера) в масштабе f
+    draw.text((20 * f, 20 * f), 'MICHELIN', font=ImageFont.truetype(str(FONTS / 'Inter-Bold.ttf'), 22 * f), fill='#FFFFFF')
+    draw.text((20 * f, 50 * f), 'Pilot Sport 4', font=ImageFont.truetype(str(FONTS / 'Inter-SemiBold.ttf'), 14 * f), fill='#FFFFFF')
+    draw.rounded_rectangle((20 * f, 330 * f, 120 * f, 370 * f), radius=6 * f, fill='#349FCD')
+    draw.text((30 * f, 338 * f), '205/55 R16', font=ImageFont.truetype(str(FONTS / 'Inter-Bold.ttf'), 12 * f), fill='#222222')
+
+
+def render(mode, chain, size=(310, 413), factor=3):
+    """
+    Карточка из test_assets так же, как в process_image: full — весь холст x factor, постобработка и уменьшение;
+    layered — фон и шина сразу в целевом размере, с суперсэмплингом только слой текста.
+    """
+    arr = np.array(Image.open(ASSETS / 'test_image.png').convert('RGBA'))
+    arr[(arr[..., :3] > 240).all(-1), 3] = 0
+    tire = Image.fromarray(arr)
+    width, height = size
+    template = Image.open(ASSETS / 'test_template.jpg').convert('RGBA').resize((width * factor, height * factor), Image.LANCZOS)
+    if mode == 'full':
+        canvas = template
+        tire = resampling.resize(tire, (180 * factor, 180 * factor))
+        canvas.paste(tire, (120 * factor, 90 * factor), tire)
+        draw_text(ImageDraw.Draw(canvas), factor)
+        return resampling.resize(postprocess.apply(canvas, chain), size)
+    canvas = resampling.resize(template, size)
+    tire = resampling.resize(tire, (180, 180))
+    canvas.paste(tire, (120, 90), tire)
+    layer = Image.new('RGBA', template.size, (0, 0, 0, 0))
+    draw_text(ImageDraw.Draw(layer), factor)
+    layer = Image.frombytes('RGBa', layer.size, layer.tobytes())
+    canvas.alpha_composite(resampling.resize(layer, size).convert('RGBA'))
+    return postprocess.apply(canvas, chain)
+
+
+def render_diff(a, b):
+    return np.abs(np.asarray(a.convert('RGB')).astype(int) - np.asarray(b.convert('RGB')).astype(int))
+
+
+def test_layered_chain_stays_within_full_render_budget():
+    full = render('full', postprocess.DEFAULT_CHAIN)
+    diff = render_diff(full, render('layered', postprocess.LAYERED_CHAIN))
+    # Бюджет отличия layered от full: в среднем меньше уровня, 99% пикселей — не больше 10 уровней
+    assert diff.mean() < 1
+    assert np.percentile(diff, 99) <= 10
+    # Полная цепочка в целевом размере дальше от full: резкость и сглаживание x3 компенсируются при уменьшении
+    full_chain = render_diff(full, render('layered', postprocess.DEFAULT_CHAIN))
+    assert full_chain.mean() > diff.mean()
@@ -0,0 +1,112 @@
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from render_cache import AssetCache, ImageLRU, TextSprites
+
+ASSETS = Path(__file__).parent / 'test_assets'
+FONTS = Path(__file__).parent.parent / 'uploads' / 'ai_image' / 'fonts'
+
+
+def test_template_is_resized_once_and_shared(tmp_path):
+    cache = AssetCache(disk_dir=tmp_path / 'disk')
+    template = ASSETS / 'test_template.jpg'
+    first = cache.get(template, (310, 413), persist=True)
+    assert first.size == (310, 413) and first.mode == 'RGBA'
+    assert cache.get(template, (310, 413), persist=True) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Другой размер или фильтр — отдельная запись
+    assert cache.get(template, (155, 206)) is not first
+    assert cache.get(template, (310, 413), resample=Image.BICUBIC) is not first
+    with Image.open(template) as src:
+        expected = src.convert('RGBA').resize((310, 413), Image.LANCZOS)
+    assert np.array_equal(np.asarray(first), np.asarray(expected))
+
+
+def test_disk_cache_survives_restart(tmp_path):
+    template = ASSETS / 'test_template.jpg'
+    first = AssetCache(disk_dir=tmp_path / 'disk').get(template, (310, 413), persist=True)
+    # Новый процесс: фон читается с диска, без декодирования JPEG и ресайза
+    cache = AssetCache(disk_dir=tmp_path / 'disk')
+    again = cache.get(template, (310, 413), persist=True)
+    assert (cache.disk_hits, cache.misses) == (1, 0)
+    assert np.array_equal(np.asarray(again), np.asarray(first))
+    # Без persist на диск не пишется
+    cache.get(template, (155, 206))
+    assert len(list((tmp_path / 'disk').glob('*.npy'))) == 1
+
+
+def test_changed_template_is_reread_and_stale_version_removed(tmp_path):
+    template = tmp_path / 'template.jpg'
+    shutil.copyfile(ASSETS / 'test_template.jpg', template)
+    cache = AssetCache(disk_dir=tmp_path / 'disk')
+    first = cache.get(template, (310, 413), persist=True)
+    Image.new('RGB', (620, 826), (10, 20, 30)).save(template)
+    os.utime(template, ns=(0, 10 ** 9))
+    second = cache.get(template, (310, 413), persist=True)
+    assert second is not first
+    assert second.getpixel((0, 0))[:3] == (10, 20, 30)
+    # На диске одна (новая) версия этого фона
+    assert len(list((tmp_path / 'disk').glob('*.npy'))) == 1
+
+
+def test_derived_builds_once():
+    cache = AssetCache()
+    calls = []
+
+    def build():
+        calls.append(1)
+        return Image.new('RGBA', (10, 10))
+
+    base = cache.derived(('base', 1), build)
+    assert cache.derived(('base', 1), build) is base
+    assert len(calls) == 1
+
+
+def test_image_lru_respects_memory_limit():
+    lru = ImageLRU(max_bytes=3 * 10 * 10 * 4)
+    for i in range(4):
+        lru.put(i, Image.new('RGBA', (10, 10)))
+    assert lru.get(0) is None
+    assert lru.get(3) is not None
+    assert len(lru) == 3 and lru.nbytes == 3 * 400
+    # Больше лимита целиком — не кэшируется
+    lru.put('big', Image.new('RGBA', (100, 100)))
+    assert lru.get('big') is None
+
+
+@pytest.mark.parametrize('font_file, size, text, anchor', [
+    ('Inter-Bold.ttf', 64, 'MICHELIN', 'mt'),
+    ('Inter-SemiBold.ttf', 51, '205/55', 'ls'),
+    ('Inter-Bold.ttf', 51, 'R16', 'ms'),
+    ('Inter-Bold.ttf', 26, 'ЗИМНЯЯ', 'lt'),
+    ('Inter-Regular.ttf', 23, 'индекс', None),
+])
+def test_text_sprite_matches_draw_text(font_file, size, text, anchor):
+    font = ImageFont.truetype(str(FONTS / font_file), size)
+    sprites = TextSprites()
+    for background in ((0, 0, 0, 0), (52, 159, 205, 255)):
+        expected = Image.new('RGBA', (400, 150), background)
+        ImageDraw.Draw(expected).text((200, 75), text, font=font, fill='#222222', anchor=anchor)
+        # Как draw_text в ai_image_processor.py: маска из кэша закрашивается цветом
+        actual = Image.new('RGBA', (400, 150), background)
+        mask, (dx, dy) = sprites.get(text, font, anchor)
+        ImageDraw.Draw(actual).bitmap((200 + dx, 75 + dy), mask, fill='#222222')
+        assert np.array_equal(np.asarray(actual), np.asarray(expected))
+    assert (sprites.hits, sprites.misses) == (1, 1)
+
+
+def test_text_sprite_key_ignores_color_but_not_font_size():
+    sprites = TextSprites()
+    font = ImageFont.truetype(str(FONTS / 'Inter-Bold.ttf'), 40)
+    first = sprites.get('XL', font, 'mt')
+    assert sprites.get('XL', font, 'mt') is first
+    assert sprites.get('XL', ImageFont.truetype(str(FONTS / 'Inter-Bold.ttf'), 41), 'mt') is not first
+    # Пустой текст и не-FreeType шрифт — рисовать через draw.text
+    assert sprites.get('', font, 'mt') is None
+    bitmap_font = getattr(ImageFont, 'load_default_imagefont', ImageFont.load_default)()
+    assert sprites.get('XL', bitmap_font, 'mt') is None
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import resampling
+
+
+def noise(size, mode='RGB', seed=0):
+    rng = np.random.default_rng(seed)
+    arr = rng.integers(0, 256, (size[1], size[0], len(mode)), dtype=np.uint8)
+    return Image.fromarray(arr, mode)
+
+
+def photo(size, mode='RGB'):
+    # Плавное изображение (как фото шины или фон шаблона), а не шум: ядра отличаются только на деталях
+    return noise((size[0] // 20, size[1] // 20), mode).resize(size, Image.BICUBIC)
+
+
+def edge(size):
+    # Левая часть — прозрачная с чёрным цветом, правая — белая непрозрачная; граница не кратна коэффициенту
+    arr = np.zeros((size[1], size[0], 4), dtype=np.uint8)
+    arr[:, size[0] // 2 + 1:] = 255
+    return Image.fromarray(arr)
+
+
+@pytest.mark.parametrize('src, size, box, kernel', [
+    ((600, 300), (200, 100), None, 'reduce'),
+    ((600, 300), (200, 150), None, 'area'),
+    ((1000, 1000), (300, 300), None, 'area'),
+    ((300, 300), (200, 200), None, 'lanczos'),
+    ((200, 200), (400, 400), None, 'lanczos'),
+    ((600, 600), (200, 200), (0.5, 0.5, 599.5, 599.5), 'area'),
+])
+def test_choose_kernel(src, size, box, kernel):
+    assert resampling.choose_kernel(src, size, box) == kernel
+
+
+def test_integer_factor_uses_block_average():
+    img = noise((600, 300))
+    assert resampling.resize(img, (200, 100)).tobytes() == img.reduce(3).tobytes()
+
+
+@pytest.mark.parametrize('size', [(200, 100), (170, 85), (250, 125)])
+@pytest.mark.parametrize('kernel', ['auto', 'reduce', 'area'])
+def test_close_to_lanczos(size, kernel):
+    img = photo((600, 300))
+    out = resampling.resize(img, size, kernel)
+    assert out.size == size and out.mode == 'RGB'
+    diff = np.abs(np.asarray(out).astype(int) - np.asarray(img.resize(size, Image.LANCZOS)).astype(int))
+    assert diff.mean() < 2
+
+
+@pytest.mark.parametrize('size', [(100, 50), (90, 45), (140, 70)])
+@pytest.mark.parametrize('kernel', ['auto', 'reduce', 'area'])
+def test_rgba_edges_have_no_dark_fringe(size, kernel):
+    out = np.asarray(resampling.resize(edge((300, 150)), size, kernel))
+    assert out.shape == (size[1], size[0], 4)
+    visible = out[..., 3] > 0
+    assert visible.any() and (out[..., 3][visible] < 255).any()
+    # Полупрозрачные пиксели края — белые: чёрный цвет прозрачных пикселей не подмешивается
+    assert out[..., :3][visible].min() >= 250
+
+
+def test_rgba_box_resize_keeps_mode():
+    img = edge((300, 150))
+    out = resampling.resize(img, (110, 55), box=(0.5, 0.5, 299.5, 149.5))
+    assert out.mode == 'RGBA' and out.size == (110, 55)
+    visible = np.asarray(out)[..., 3] > 0
+    assert np.asarray(out)[..., :3][visible].min() >= 250
+
+
+@pytest.mark.parametrize('size', [(100, 50), (90, 45)])
+def test_premultiplied_input_stays_premultiplied(size):
+    img = photo((300, 150), 'RGBA').convert('RGBa')
+    out = resampling.resize(img, size)
+    assert out.mode == 'RGBa' and out.size == size
+    expected = img.resize(size, Image.LANCZOS)
+    diff = np.abs(np.asarray(out).astype(int) - np.asarray(expected).astype(int))
+    assert diff.mean() < 2
+
+
+def test_site_kernel_overrides():
+    assert resampling.site_kernel({}, 'final') == 'auto'
+    # Вход RunwayML — LANCZOS, пока не задано иное
+    assert resampling.site_kernel({'resample_mode': 'auto'}, 'runwayml') == 'lanczos'
+    assert resampling.site_kernel({'resample_mode': 'lanczos'}, 'tire') == 'lanczos'
+    config = {'resample_mode': 'lanczos', 'resample_sites': {'final': 'reduce', 'runwayml': 'area'}}
+    assert resampling.site_kernel(config, 'final') == 'reduce'
+    assert resampling.site_kernel(config, 'runwayml') == 'area'
+    assert resampling.site_kernel(config, 'template') == 'lanczos'
+    assert set(resampling.SITE_DEFAULTS) <= set(resampling.SITES)
+
+
+def test_unknown_kernel():
+    with pytest.raises(ValueError):
+        resampling.resize(noise((30, 30)), (10, 10), 'bicubic')
+
+
+def test_decode_size_keeps_margin_and_never_upscales():
+    assert resampling.decode_size((4000, 4000), (527, 527), 1.5) == (790, 790)
+    assert resampling.decode_size((4000, 2000), (500, 500), 1.5) == (1500, 750)
+    assert resampling.decode_size((600, 600), (527, 527), 1.5) == (600, 600)
+
+
+def test_jpeg_is_decoded_at_draft_scale(tmp_path):
+    path = tmp_path / 'original.jpg'
+    photo((1600, 1200)).save(path, quality=95)
+    img, full_size, draft_size = resampling.open_scaled(path, (390, 293))
+    # Ближайший масштаб draft не меньше нужного — 1/4, остаток уменьшается ресайзом
+    assert full_size == (1600, 1200) and draft_size == (400, 300)
+    assert img.size == (390, 293) and img.mode == 'RGBA'
+    with Image.open(path) as src:
+        expected = resampling.resize(src.convert('RGBA'), (390, 293))
+    diff = np.abs(np.asarray(img, dtype=np.int16) - np.asarray(expected, dtype=np.int16))
+    assert diff.mean() < 1.5
+
+
+def test_png_is_decoded_in_full_and_resized(tmp_path):
+    path = tmp_path / 'original.png'
+    photo((800, 600)).save(path)
+    img, full_size, draft_size = resampling.open_scaled(path, (200, 150))
+    assert full_size == draft_size == (800, 600)
+    with Image.open(path) as src:
+        expected = resampling.resize(src.convert('RGBA'), (200, 150))
+    assert np.array_equal(np.asarray(img), np.asarray(expected))
+    # Нужен исходный размер — без ресайза
+    same, _, _ = resampling.open_scaled(path, (800, 600))
+    assert same.size == (800, 600)
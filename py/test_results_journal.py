@@ -0,0 +1,77 @@
+import gzip
+import json
+import time
+
+from results_journal import ResultsJournal
+
+
+def append(journal, task_id, status='done'):
+    return journal.append({'task_id': task_id, 'status': status})
+
+
+def seqs(journal):
+    return [seq for seq, _ in journal.read_since(0)]
+
+
+def test_compaction_keeps_records_after_slowest_cursor(tmp_path):
+    journal = ResultsJournal(tmp_path / 'journal.db', retain_days=0)
+    first = [append(journal, f't{i}') for i in range(5)]
+    journal.ack('wordpress', first[-1])
+    journal.ack('export', first[1])
+    after = [append(journal, f'n{i}') for i in range(3)]
+    time.sleep(0.01)
+    # Старше retain_days всё, но удаляются только записи, прочитанные обоими потребителями
+    assert journal.compact() == 2
+    assert seqs(journal) == first[2:] + after
+    assert journal.read_since(journal.cursor('wordpress'))[0][0] == after[0]
+
+
+def test_compaction_without_consumers_keeps_everything(tmp_path):
+    journal = ResultsJournal(tmp_path / 'journal.db', retain_days=0)
+    for i in range(3):
+        append(journal, 't1')
+    assert journal.compact() == 0
+    assert len(seqs(journal)) == 3
+
+
+def test_superseded_records_are_dropped_before_retain_days(tmp_path):
+    journal = ResultsJournal(tmp_path / 'journal.db', retain_days=30)
+    old = append(journal, 't1', 'error')
+    other = append(journal, 't2')
+    new = append(journal, 't1')
+    journal.ack('wordpress', new)
+    assert journal.compact() == 1
+    assert seqs(journal) == [other, new]
+    # seq не переиспользуются после удаления
+    assert append(journal, 't3') > new and old not in seqs(journal)
+
+
+def test_max_records_rotates_unread_records_to_archive(tmp_path):
+    journal = ResultsJournal(tmp_path / 'journal.db', max_records=3, archive_keep=2)
+    written = [append(journal, f't{i}') for i in range(5)]
+    assert journal.compact() == 2
+    assert seqs(journal) == written[2:]
+    archive, = journal.archive_dir.glob('*.jsonl.gz')
+    with gzip.open(archive, 'rt', encoding='utf-8') as f:
+        assert [json.loads(line)['task_id'] for line in f] == ['t0', 't1']
+    # Потребитель с отставшим курсором дочитывает вытесненное из архива
+    assert [seq for seq, _ in journal.read_archive(written[0])] == [written[1]]
+
+
+def test_archive_rotation_keeps_newest(tmp_path):
+    journal = ResultsJournal(tmp_path / 'journal.db', max_records=1, archive_keep=2)
+    for i in range(4):
+        append(journal, f't{i}')
+        append(journal, f'u{i}')
+        journal.compact()
+    archives = sorted(p.name for p in journal.archive_dir.glob('*.jsonl.gz'))
+    assert len(archives) == 2
+    assert [record['task_id'] for _, record in journal.read_archive()] == ['u1', 't2', 'u2', 't3']
+
+
+def test_archive_disabled(tmp_path):
+    journal = ResultsJournal(tmp_path / 'journal.db', max_records=1, archive_keep=0)
+    append(journal, 't1')
+    append(journal, 't2')
+    assert journal.compact() == 1
+    assert not journal.archive_dir.exists()
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('cv2')
+
+from PIL import Image
+
+from segmentation import Segmentation, logo_inpaint_mask, main_component, resolve_logo_mask
+
+
+class FakeSession:
+    # Сессия rembg: predict возвращает список масок размера входа
+    def __init__(self, mask):
+        self.mask = mask
+        self.calls = 0
+
+    def predict(self, img):
+        self.calls += 1
+        return [self.mask.resize(img.size)]
+
+
+def tire_mask():
+    # Крупный объект (шина) с полупрозрачной серединой и мелкий отдельный объект (логотип)
+    arr = np.zeros((200, 300), dtype=np.uint8)
+    arr[20:180, 100:260] = 255
+    arr[80:120, 160:200] = 60
+    arr[150:170, 10:50] = 255
+    return Image.fromarray(arr)
+
+
+def test_cutout_and_bbox_match_rembg_style_crop():
+    img = Image.new('RGBA', (300, 200), (200, 100, 50, 255))
+    session = FakeSession(tire_mask())
+    segmentation = Segmentation.of(img, session)
+    cutout = segmentation.cutout(img)
+    alpha = np.asarray(cutout)[..., 3]
+    assert (alpha == np.asarray(segmentation.mask)).all()
+    # Рамка по маске — как crop_to_content по альфе: порог 10 и отступ 5
+    assert segmentation.bbox() == (5, 15, 265, 185)
+    assert session.calls == 1
+
+
+def test_main_component_drops_other_objects_only():
+    cleaned = np.asarray(main_component(tire_mask()))
+    assert cleaned[160, 30] == 0
+    assert cleaned[100, 180] == 60
+    assert cleaned[50, 150] == 255
+    assert Segmentation(Image.fromarray(cleaned)).bbox() == (95, 15, 265, 185)
+
+
+def test_warp_to_new_size():
+    segmentation = Segmentation(tire_mask())
+    warped = segmentation.warp((150, 100))
+    assert warped.size == (150, 100)
+    assert segmentation.warp((150, 100)) is warped
+    assert segmentation.array((150, 100)).shape == (100, 150)
+
+
+def test_logo_inpaint_mask_keeps_tire_outside_logo():
+    tire = np.asarray(tire_mask())
+    logo = np.zeros_like(tire)
+    logo[150:190, 0:300] = 255
+    mask = logo_inpaint_mask(tire, logo)
+    # Закрашивается только логотип на шине; остальная шина и логотип вне салентной области — нет
+    assert mask[160, 150] == 255 and mask[160, 30] == 255
+    assert mask[50, 150] == 0 and mask[185, 150] == 0
+    assert np.count_nonzero(mask) < np.count_nonzero(tire > 128)
+    # Без маски шины — весь логотип
+    assert (logo_inpaint_mask(np.zeros_like(tire), logo) == logo).all()
+
+
+def test_logo_outside_tire_leaves_nothing_to_inpaint():
+    tire = np.asarray(tire_mask())
+    logo = np.zeros_like(tire)
+    logo[0:15, 0:300] = 255
+    # Пустая область: lama не вызывается, кадр остаётся как есть
+    assert not logo_inpaint_mask(tire, logo).any()
+
+
+def test_logo_mask_is_resolved_in_originals_dir(tmp_path):
+    originals = tmp_path / 'originals'
+    # Как original_image: из пути в задаче берётся только имя файла
+    assert resolve_logo_mask('originals/x_mask.png', originals) == originals / 'x_mask.png'
+    assert resolve_logo_mask('/other/node/x_mask.png', originals) == originals / 'x_mask.png'
+    assert resolve_logo_mask(None, originals) is None
+    assert resolve_logo_mask('', originals) is None
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+
+from sqlite_queue import DONE, SqliteTaskQueue
+
+
+def write_task(tasks_dir, task_id, **fields):
+    path = tasks_dir / f'{task_id}.json'
+    path.write_text(json.dumps({'task_id': task_id, **fields}), encoding='utf-8')
+    return path
+
+
+def make_queue(tmp_path, **kwargs):
+    tasks_dir = tmp_path / 'tasks'
+    tasks_dir.mkdir(exist_ok=True)
+    return SqliteTaskQueue(tmp_path / 'queue.db', tasks_dir, **kwargs), tasks_dir
+
+
+def test_resubmit_while_processing_waits_for_finish(tmp_path):
+    queue, tasks_dir = make_queue(tmp_path)
+    path = write_task(tasks_dir, 't1', version=1)
+    claim = queue.claim(path)
+    assert claim is not None
+    # Новая версия той же задачи, пока старая в обработке: файл не теряется
+    path = write_task(tasks_dir, 't1', version=2)
+    assert queue.import_json_dir() == 0
+    assert path.exists()
+    assert queue.read_task(claim)['version'] == 1
+    queue.finish(claim, True)
+    # После завершения новая версия импортируется и снова ждёт обработки
+    assert queue.pending() == ['t1']
+    assert not path.exists() and (tasks_dir / 'imported' / path.name).exists()
+    claim = queue.claim('t1')
+    assert queue.read_task(claim)['version'] == 2
+
+
+def test_reimport_after_finish_resets_task(tmp_path):
+    queue, tasks_dir = make_queue(tmp_path)
+    claim = queue.claim(write_task(tasks_dir, 't1'))
+    queue.record_attempt(claim, 1, 'timeout')
+    queue.finish(claim, True)
+    assert queue.stats() == {DONE: 1}
+    write_task(tasks_dir, 't1')
+    assert queue.pending() == ['t1']
+    assert queue.read_task(queue.claim('t1')).get('_retry') is None
+
+
+def test_priority_order(tmp_path):
+    queue, tasks_dir = make_queue(tmp_path)
+    write_task(tasks_dir, 'a')
+    write_task(tasks_dir, 'b', priority=5)
+    assert queue.pending() == ['b', 'a']
+
+
+def test_racing_claim_next_gets_each_task_once(tmp_path):
+    queue, _ = make_queue(tmp_path)
+    for i in range(30):
+        queue.enqueue({'task_id': f't{i}'})
+    workers = [SqliteTaskQueue(tmp_path / 'queue.db', owner=f'w{i}') for i in range(6)]
+    barrier = threading.Barrier(len(workers))
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(q):
+        barrier.wait()
+        while True:
+            claims = q.claim_next(4)
+            if not claims:
+                break
+            with lock:
+                claimed.extend(c.name for c in claims)
+
+    threads = [threading.Thread(target=worker, args=(q,)) for q in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(f't{i}' for i in range(30))
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue, _ = make_queue(tmp_path, lease_seconds=0.05, owner='w1')
+    queue.enqueue({'task_id': 't1'})
+    claim, = queue.claim_next()
+    assert queue.reclaim_expired() == 0
+    time.sleep(0.1)
+    assert queue.reclaim_expired() == 1
+    # Старый владелец аренду потерял, задачу забирает другой воркер
+    assert not queue.heartbeat(claim)
+    other = SqliteTaskQueue(tmp_path / 'queue.db', owner='w2')
+    assert [c.name for c in other.claim_next()] == ['t1']
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from task_queue import FAILED, PROCESSING, RETRY_FIELD, PermanentTaskError, TaskQueue, is_permanent_error, should_retry
+
+
+def make_tasks(tasks_dir, count):
+    paths = []
+    for i in range(count):
+        path = tasks_dir / f't{i}.json'
+        path.write_text(json.dumps({'task_id': f't{i}'}), encoding='utf-8')
+        paths.append(path)
+    return paths
+
+
+def test_racing_claimers_get_each_task_once(tmp_path):
+    paths = make_tasks(tmp_path, 20)
+    queues = [TaskQueue(tmp_path, owner=f'w{i}') for i in range(8)]
+    barrier = threading.Barrier(len(queues))
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(queue):
+        barrier.wait()
+        for path in paths:
+            claim = queue.claim(path)
+            if claim is not None:
+                with lock:
+                    claimed.append(claim.name)
+
+    threads = [threading.Thread(target=worker, args=(q,)) for q in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(p.name for p in paths)
+    assert len(list((tmp_path / PROCESSING).glob('*.json'))) == 20
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_loses_it(tmp_path):
+    path, = make_tasks(tmp_path, 1)
+    queue = TaskQueue(tmp_path, lease_seconds=60)
+    claim = queue.claim(path)
+    assert claim is not None
+    # Продлённая аренда не возвращается
+    assert queue.heartbeat(claim)
+    assert queue.reclaim_expired() == 0
+    # Воркер «упал»: аренду не продлевали дольше lease_seconds
+    stale = time.time() - 120
+    os.utime(claim.path, (stale, stale))
+    assert queue.reclaim_expired() == 1
+    assert path.exists()
+    assert not queue.heartbeat(claim)
+    assert queue.finish(claim, True) is None
+    again = TaskQueue(tmp_path, owner='other').claim(path)
+    assert again is not None and again.path.exists()
+
+
+def test_retry_waits_for_backoff(tmp_path):
+    path, = make_tasks(tmp_path, 1)
+    queue = TaskQueue(tmp_path)
+    claim = queue.claim(path)
+    queue.retry(claim, 60)
+    assert path.exists()
+    assert queue.claim(path) is None
+    assert queue.pending() == []
+
+
+def test_max_attempts_exhaustion_moves_task_to_failed(tmp_path):
+    path, = make_tasks(tmp_path, 1)
+    queue = TaskQueue(tmp_path, max_attempts=3)
+    attempts = []
+    while True:
+        claim = queue.claim(path)
+        assert claim is not None
+        with claim:
+            attempt = (claim.read().get(RETRY_FIELD) or {}).get('attempts', 0) + 1
+        attempts.append(attempt)
+        error = TimeoutError('RunwayML timeout')
+        queue.record_attempt(claim, attempt, str(error))
+        if should_retry(error, attempt, queue.max_attempts):
+            queue.retry(claim, 0)
+            continue
+        queue.finish(claim, False)
+        break
+    assert attempts == [1, 2, 3]
+    failed = tmp_path / FAILED / path.name
+    assert failed.exists() and not path.exists()
+    assert json.loads(failed.read_text(encoding='utf-8'))[RETRY_FIELD]['attempts'] == 3
+
+
+class HttpError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.status_code = status_code
+
+
+@pytest.mark.parametrize('exc, permanent', [
+    (PermanentTaskError('нет шаблона'), True),
+    (FileNotFoundError('original.jpg'), True),
+    (HttpError(400), True),
+    (HttpError(429), False),
+    (HttpError(503), False),
+    (TimeoutError(), False),
+    (ValueError('неизвестная ошибка'), False),
+])
+def test_error_classification(exc, permanent):
+    assert is_permanent_error(exc) is permanent
+    assert should_retry(exc, 1, 3) is (not permanent)
+
+
+def test_classification_follows_cause_chain():
+    try:
+        try:
+            raise TimeoutError('read timeout')
+        except TimeoutError as e:
+            raise RuntimeError('RunwayML API error') from e
+    except RuntimeError as e:
+        assert not is_permanent_error(e)
+    assert not should_retry(TimeoutError(), 3, 3)
+
+
+def test_resubmitted_task_waits_for_in_flight_copy(tmp_path):
+    path, = make_tasks(tmp_path, 1)
+    queue = TaskQueue(tmp_path)
+    claim = queue.claim(path)
+    assert claim is not None
+    # Задачу с тем же id поставили заново, пока старая версия в обработке
+    path.write_text(json.dumps({'task_id': 't0', 'version': 2}), encoding='utf-8')
+    assert queue.claim(path) is None
+    assert path.exists()
+    assert 'version' not in json.loads(claim.path.read_text(encoding='utf-8'))
+    assert queue.heartbeat(claim)
+    queue.finish(claim, True)
+    again = queue.claim(path)
+    assert again is not None
+    assert json.loads(again.path.read_text(encoding='utf-8'))['version'] == 2
+
+
+def test_reclaimed_lease_counts_as_attempt(tmp_path):
+    path, = make_tasks(tmp_path, 1)
+    queue = TaskQueue(tmp_path, lease_seconds=60, max_attempts=2)
+    stale = time.time() - 120
+    for attempt in (1, 2):
+        claim = queue.claim(path)
+        assert claim is not None
+        # Воркер упал, не записав попытку
+        os.utime(claim.path, (stale, stale))
+        assert queue.reclaim_expired() == 1
+    # Вторая истёкшая аренда исчерпала max_attempts — задача в failed/
+    assert not path.exists()
+    task = json.loads((tmp_path / FAILED / path.name).read_text(encoding='utf-8'))
+    assert task[RETRY_FIELD]['attempts'] == 2
+    assert 'Аренда истекла' in task[RETRY_FIELD]['last_error']
@@ -0,0 +1,37 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from u2net_arch import U2NET, U2NETP
+from u2net_fast import to_inference
+
+
+def randomize_batchnorm(model):
+    # У свежесозданной модели BN тождественен — задаём статистики, как после обучения
+    generator = torch.Generator().manual_seed(0)
+    for module in model.modules():
+        if isinstance(module, torch.nn.BatchNorm2d):
+            n = module.num_features
+            module.running_mean.copy_(torch.randn(n, generator=generator) * 0.1)
+            module.running_var.copy_(torch.rand(n, generator=generator) + 0.5)
+            module.weight.data.copy_(torch.rand(n, generator=generator) + 0.5)
+            module.bias.data.copy_(torch.randn(n, generator=generator) * 0.1)
+    return model
+
+
+@pytest.mark.parametrize('arch', [U2NET, U2NETP])
+def test_inference_matches_first_output(arch):
+    torch.manual_seed(0)
+    reference = randomize_batchnorm(arch(3, 1)).eval()
+    state = reference.state_dict()
+
+    fast = arch(3, 1)
+    fast.load_state_dict(state)
+    fast = to_inference(fast)
+
+    x = torch.rand(2, 3, 320, 320)
+    with torch.no_grad():
+        expected = reference(x)[0]
+        actual = fast(x)
+    assert actual.shape == expected.shape
+    assert torch.allclose(actual, expected, atol=1e-5)
@@ -1,5 +1,3 @@
-import torch
-import torch.nn.functional as F
 import numpy as np
 from PIL import Image
 from pathlib import Path
@@ -7,17 +5,38 @@ from pathlib import Path
 # --- Минимальный модуль U2NETPredictor ---
 # Скачайте веса u2net.pth отсюда: https://github.com/xuebinqin/U-2-Net/releases
 # Поместите файл u2net.pth рядом с этим модулем или укажите путь явно
+# backend='onnx' — инференс через onnxruntime (см. u2net_onnx.py), torch в этом режиме не импортируется
+# precision='int8' — квантованная ONNX-модель (см. quantize_u2net.py), только для backend='onnx'
+
+
+def preprocess_batch(pil_imgs):
+    # Вход сети: float32 [N, 3, 320, 320] в диапазоне 0..1
+    return np.stack([
+        np.array(img.convert('RGB').resize((320, 320))).astype(np.float32).transpose((2, 0, 1)) / 255.0
+        for img in pil_imgs
+    ])
 
 class U2NETPredictor:
-    def __init__(self, weights_path=None, device=None):
+    def __init__(self, weights_path=None, device=None, model_name='u2net', backend='torch', num_threads=0, precision='fp32'):
         print(f'[U2NETPredictor] __file__ = {__file__}')
+        self.model_name = model_name
+        self.backend = backend
+        self.precision = precision
+        if precision != 'fp32' and backend != 'onnx':
+            raise ValueError(f'precision={precision} поддерживается только для backend=onnx')
         if weights_path is None:
-            weights_path = (Path(__file__).parent / 'u2net.pth').resolve()
+            weights_path = (Path(__file__).parent / f'{model_name}.pth').resolve()
         else:
             weights_path = Path(weights_path).resolve()
         print(f'[U2NETPredictor] type(weights_path): {type(weights_path)}')
         print(f'[U2NETPredictor] Проверка наличия весов по пути: {weights_path}')
         print(f'[U2NETPredictor] Файл существует: {weights_path.exists()}')
+        if backend == 'onnx':
+            self.device = 'cpu'
+            self.model = None
+            self.onnx = self._load_onnx(weights_path, num_threads)
+            return
+        import torch
         print(f'[U2NETPredictor] Содержимое папки: {list(weights_path.parent.glob("*"))}')
         self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
         if not weights_path.exists():
@@ -27,26 +46,106 @@ class U2NETPredictor:
         self.model.eval()
 
     def _load_model(self, weights_path):
-        from u2net_arch import U2NET  # абсолютный импорт
-        net = U2NET(3, 1)
+        import torch
+        from u2net_arch import U2NET, U2NETP  # абсолютный импорт
+        from u2net_fast import to_inference
+        net = U2NETP(3, 1) if self.model_name == 'u2netp' else U2NET(3, 1)
         net.load_state_dict(torch.load(weights_path, map_location=self.device))
+        # BatchNorm свёрнут в свёртки, считается только итоговая карта (см. u2net_fast.py)
+        net = to_inference(net)
         net.to(self.device)
         return net
 
-    def predict(self, pil_img):
-        # pil_img: PIL.Image (RGB)
-        img = pil_img.convert('RGB').resize((320, 320))
-        img_np = np.array(img).astype(np.float32) / 255.0
-        img_np = img_np.transpose((2, 0, 1))[None, ...]
-        img_tensor = torch.from_numpy(img_np).to(self.device)
+    def _load_onnx(self, weights_path, num_threads):
+        from u2net_onnx import OnnxU2NETBackend, export_onnx, onnx_paths, int8_paths
+        if self.precision == 'int8':
+            int8_path, optimized_path = int8_paths(weights_path)
+            if not int8_path.exists():
+                raise FileNotFoundError(f'Квантованная модель не найдена: {int8_path}\nСоздайте её: python quantize_u2net.py --weights {weights_path}')
+            print(f'[U2NETPredictor] ONNX Runtime (int8): {int8_path}')
+            return OnnxU2NETBackend(int8_path, optimized_path, num_threads=num_threads)
+        onnx_path, optimized_path = onnx_paths(weights_path)
+        if not onnx_path.exists():
+            if not weights_path.exists():
+                raise FileNotFoundError(f'Не найдены ни ONNX-модель {onnx_path}, ни веса {weights_path}')
+            export_onnx(weights_path, onnx_path, model_name=self.model_name)
+        print(f'[U2NETPredictor] ONNX Runtime: {onnx_path}')
+        return OnnxU2NETBackend(onnx_path, optimized_path, num_threads=num_threads)
+
+    def _infer(self, batch):
+        # batch: float32 [N, 3, 320, 320] -> float32 [N, 320, 320]
+        if self.backend == 'onnx':
+            return self.onnx.run(batch)
+        import torch
         with torch.no_grad():
-            d1, *_ = self.model(img_tensor)
-            pred = d1[:, 0, :, :]
-            pred = F.upsample(pred.unsqueeze(0), size=pil_img.size[::-1], mode='bilinear', align_corners=False)
-            pred = pred.squeeze().cpu().numpy()
-            pred = (pred - pred.min()) / (pred.max() - pred.min() + 1e-8)
-            mask = (pred * 255).astype(np.uint8)
-        return mask
+            d1 = self.model(torch.from_numpy(batch).to(self.device))
+            return d1[:, 0, :, :].cpu().numpy()
+
+    def predict(self, pil_img):
+        # pil_img: PIL.Image (RGB). Возвращает uint8-маску в размере исходного изображения.
+        return self.predict_batch([pil_img])[0].to_mask()
+
+    def predict_batch(self, pil_imgs, batch_size=8):
+        """
+        Прогон списка изображений пачками по batch_size за один forward.
+        Возвращает список SaliencyMap в разрешении сети (320x320) с метаданными масштаба —
+        без апсемплинга до исходного размера.
+        """
+        maps = []
+        for start in range(0, len(pil_imgs), batch_size):
+            chunk = pil_imgs[start:start + batch_size]
+            batch = preprocess_batch(chunk)
+            preds = self._infer(batch)
+            for img, pred in zip(chunk, preds):
+                maps.append(SaliencyMap(pred, img.size))
+        return maps
+
+
+class SaliencyMap:
+    """
+    Карта салентности в разрешении сети (обычно 320x320), нормированная в 0..1,
+    и размер исходного изображения. Билинейный апсемплинг (как F.upsample, align_corners=False)
+    считается лениво и только для запрошенной области исходного изображения.
+    """
+
+    def __init__(self, prob, orig_size):
+        prob = prob.astype(np.float32)
+        self.prob = (prob - prob.min()) / (prob.max() - prob.min() + 1e-8)
+        self.orig_size = tuple(orig_size)  # (w, h)
+        self.scale_x = self.orig_size[0] / self.prob.shape[1]
+        self.scale_y = self.orig_size[1] / self.prob.shape[0]
+
+    @staticmethod
+    def _axis(start, stop, in_len, out_len):
+        # Координаты и веса билинейной интерполяции для диапазона [start, stop) выходной оси
+        src = (np.arange(start, stop, dtype=np.float32) + 0.5) * (in_len / out_len) - 0.5
+        src = np.clip(src, 0, in_len - 1)
+        i0 = np.floor(src).astype(np.int64)
+        i1 = np.minimum(i0 + 1, in_len - 1)
+        return i0, i1, (src - i0).astype(np.float32)
+
+    def upsample(self, box=None):
+        """
+        Вероятности (float32, 0..1) для области box=(x0, y0, x1, y1) исходного изображения.
+        box=None — всё изображение.
+        """
+        w, h = self.orig_size
+        x0, y0, x1, y1 = box or (0, 0, w, h)
+        in_h, in_w = self.prob.shape
+        ix0, ix1, wx = self._axis(x0, x1, in_w, w)
+        iy0, iy1, wy = self._axis(y0, y1, in_h, h)
+        p = self.prob
+        top = p[np.ix_(iy0, ix0)] * (1 - wx) + p[np.ix_(iy0, ix1)] * wx
+        bottom = p[np.ix_(iy1, ix0)] * (1 - wx) + p[np.ix_(iy1, ix1)] * wx
+        return top * (1 - wy)[:, None] + bottom * wy[:, None]
+
+    def to_mask(self, box=None):
+        # uint8-маска 0..255 (как раньше возвращал predict) для области box
+        return (self.upsample(box) * 255).astype(np.uint8)
+
+    def threshold(self, level=128, box=None):
+        # Бинарная маска (mask > level) для области box
+        return self.to_mask(box) > level
 
 # ---
 # Для работы требуется файл u2net_arch.py (архитектура модели) из оф. репозитория U-2-Net:
@@ -0,0 +1,86 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from u2net_arch import REBNCONV
+
+# --- Инференс-версия U2NET/U2NETP ---
+# 1) BatchNorm каждого REBNCONV сворачивается в веса свёртки (Conv+BN+ReLU -> Conv+ReLU).
+# 2) forward возвращает только итоговую карту (первый выход U2NET.forward, её и берёт U2NETPredictor):
+#    боковые карты d1..d6 по-прежнему нужны для outconv, но без sigmoid и без возврата наружу.
+# Веса — те же u2net.pth/u2netp.pth: сначала load_state_dict в исходную модель, затем to_inference().
+
+
+def fuse_conv_bn(conv, bn):
+    """
+    Новая свёртка, эквивалентная bn(conv(x)) в режиме eval.
+    """
+    fused = nn.Conv2d(
+        conv.in_channels, conv.out_channels, conv.kernel_size,
+        stride=conv.stride, padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True
+    )
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    conv_bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    with torch.no_grad():
+        fused.weight.copy_(conv.weight * scale.reshape(-1, 1, 1, 1))
+        fused.bias.copy_((conv_bias - bn.running_mean) * scale + bn.bias)
+    return fused.to(conv.weight.device)
+
+
+def fold_batchnorm(model):
+    """
+    Сворачивает BatchNorm во всех REBNCONV модели (на месте). Возвращает ту же модель.
+    """
+    for module in model.modules():
+        if isinstance(module, REBNCONV) and isinstance(module.bn_s1, nn.BatchNorm2d):
+            module.conv_s1 = fuse_conv_bn(module.conv_s1, module.bn_s1)
+            module.bn_s1 = nn.Identity()
+    return model
+
+
+class U2NETInference(nn.Module):
+    """
+    Обёртка над U2NET/U2NETP (у обеих одинаковые имена стадий), forward возвращает sigmoid(d0) [N, 1, H, W].
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    @staticmethod
+    def _up(src, tar):
+        return F.interpolate(src, size=tar.shape[2:], mode='bilinear', align_corners=False)
+
+    def forward(self, x):
+        m = self.model
+        hx1 = m.stage1(x)
+        hx2 = m.stage2(m.pool12(hx1))
+        hx3 = m.stage3(m.pool23(hx2))
+        hx4 = m.stage4(m.pool34(hx3))
+        hx5 = m.stage5(m.pool45(hx4))
+        hx6 = m.stage6(m.pool56(hx5))
+
+        hx5d = m.stage5d(torch.cat((self._up(hx6, hx5), hx5), 1))
+        hx4d = m.stage4d(torch.cat((self._up(hx5d, hx4), hx4), 1))
+        hx3d = m.stage3d(torch.cat((self._up(hx4d, hx3), hx3), 1))
+        hx2d = m.stage2d(torch.cat((self._up(hx3d, hx2), hx2), 1))
+        hx1d = m.stage1d(torch.cat((self._up(hx2d, hx1), hx1), 1))
+
+        d1 = m.side1(hx1d)
+        d0 = m.outconv(torch.cat((
+            d1,
+            self._up(m.side2(hx2d), d1),
+            self._up(m.side3(hx3d), d1),
+            self._up(m.side4(hx4d), d1),
+            self._up(m.side5(hx5d), d1),
+            self._up(m.side6(hx6), d1),
+        ), 1))
+        return torch.sigmoid(d0)
+
+
+def to_inference(model):
+    """
+    U2NET/U2NETP с загруженными весами -> модель для инференса (eval, BN свёрнут, один выход).
+    """
+    model.eval()
+    return U2NETInference(fold_batchnorm(model)).eval()
@@ -0,0 +1,108 @@
+from pathlib import Path
+
+# --- ONNX Runtime для U2NET/U2NETP (CPU) ---
+# Экспорт: python u2net_onnx.py --weights u2net.pth --model u2net
+# Рядом с весами появятся u2net.onnx (экспорт) и u2net.opt.onnx (граф после оптимизаций ORT),
+# при следующих запусках оптимизированный граф загружается сразу, без повторной оптимизации.
+
+
+def onnx_paths(weights_path):
+    """
+    (путь к экспортированной модели, путь к сохранённой оптимизированной модели) для файла весов.
+    """
+    weights_path = Path(weights_path)
+    return weights_path.with_suffix('.onnx'), weights_path.with_suffix('.opt.onnx')
+
+
+def int8_paths(weights_path):
+    """
+    (путь к квантованной INT8-модели, путь к её оптимизированному графу).
+    """
+    weights_path = Path(weights_path)
+    return weights_path.with_suffix('.int8.onnx'), weights_path.with_suffix('.int8.opt.onnx')
+
+
+def export_onnx(weights_path, onnx_path=None, model_name='u2net', opset=13):
+    """
+    Экспорт u2net_arch.U2NET/U2NETP в ONNX. Выход один — карта, которую использует U2NETPredictor
+    (первый выход forward), батч — динамическая ось. Экспортируется инференс-версия со свёрнутым BN.
+    """
+    import torch
+    from u2net_arch import U2NET, U2NETP
+    from u2net_fast import to_inference
+
+    weights_path = Path(weights_path)
+    onnx_path = Path(onnx_path or onnx_paths(weights_path)[0])
+    net = U2NETP(3, 1) if model_name == 'u2netp' else U2NET(3, 1)
+    net.load_state_dict(torch.load(weights_path, map_location='cpu'))
+    net = to_inference(net)
+
+    dummy = torch.zeros(1, 3, 320, 320)
+    export_kwargs = dict(
+        input_names=['input'],
+        output_names=['output'],
+        dynamic_axes={'input': {0: 'batch'}, 'output': {0: 'batch'}},
+        opset_version=opset,
+    )
+    # В новых версиях torch экспорт по умолчанию идёт через dynamo — для этой модели нужен классический
+    try:
+        torch.onnx.export(net, dummy, str(onnx_path), dynamo=False, **export_kwargs)
+    except TypeError:
+        torch.onnx.export(net, dummy, str(onnx_path), **export_kwargs)
+    print(f'[U2NET ONNX] Экспортировано: {weights_path} -> {onnx_path}')
+    return onnx_path
+
+
+class OnnxU2NETBackend:
+    """
+    Инференс U2NET через onnxruntime: полный набор графовых оптимизаций, настраиваемое число потоков,
+    оптимизированный граф сохраняется на диск и переиспользуется.
+    """
+
+    def __init__(self, onnx_path, optimized_path=None, num_threads=0):
+        import onnxruntime as ort
+
+        onnx_path = Path(onnx_path)
+        optimized_path = Path(optimized_path) if optimized_path else None
+        opts = ort.SessionOptions()
+        if num_threads:
+            opts.intra_op_num_threads = int(num_threads)
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_path = onnx_path
+        if optimized_path and optimized_path.exists() and optimized_path.stat().st_mtime >= onnx_path.stat().st_mtime:
+            # Переносимые оптимизации (слияние Conv+BN и т.п.) уже применены и сохранены —
+            # при загрузке остаются только быстрые, зависящие от железа (раскладка NCHWc)
+            model_path = optimized_path
+        elif optimized_path:
+            # Сохраняем граф на уровне EXTENDED: файл не привязан к набору инструкций CPU
+            # и может лежать на общем диске нескольких узлов
+            self._save_optimized(ort, onnx_path, optimized_path, num_threads)
+            model_path = optimized_path
+        self.model_path = model_path
+        self.session = ort.InferenceSession(str(model_path), sess_options=opts, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def _save_optimized(ort, onnx_path, optimized_path, num_threads):
+        opts = ort.SessionOptions()
+        if num_threads:
+            opts.intra_op_num_threads = int(num_threads)
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        opts.optimized_model_filepath = str(optimized_path)
+        ort.InferenceSession(str(onnx_path), sess_options=opts, providers=['CPUExecutionProvider'])
+        print(f'[U2NET ONNX] Оптимизированный граф сохранён: {optimized_path}')
+
+    def run(self, batch):
+        # batch: float32 [N, 3, 320, 320] -> float32 [N, 320, 320]
+        return self.session.run(None, {self.input_name: batch})[0][:, 0, :, :]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Экспорт U2NET/U2NETP в ONNX')
+    parser.add_argument('--weights', type=str, default=str(Path(__file__).parent / 'u2net.pth'))
+    parser.add_argument('--model', type=str, default='u2net', choices=['u2net', 'u2netp'])
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--opset', type=int, default=13)
+    cli_args = parser.parse_args()
+    export_onnx(cli_args.weights, cli_args.output, model_name=cli_args.model, opset=cli_args.opset)
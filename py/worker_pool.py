@@ -0,0 +1,118 @@
+import gc
+import multiprocessing
+import os
+import time
+from loguru import logger
+
+# --- Несколько воркеров на узле с общими весами моделей ---
+# Схема preload-then-fork: родитель загружает веса (без инференса), замораживает GC и форкает воркеров.
+# Страницы с весами остаются общими (copy-on-write), пока их никто не пишет.
+# Сессии onnxruntime (rembg, backend=onnx) создают пулы потоков и после fork непригодны —
+# их каждый воркер создаёт сам (см. ModelRegistry.drop_fork_unsafe).
+
+
+def fork_available():
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def process_memory(pid):
+    """
+    Память процесса в МБ: rss, pss, uss (уникальная память = Private_Clean + Private_Dirty).
+    Linux: /proc/<pid>/smaps_rollup; иначе psutil, если установлен. None — если узнать нельзя.
+    """
+    try:
+        fields = {}
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+        return {
+            'rss': fields.get('Rss', 0) / 1024,
+            'pss': fields.get('Pss', 0) / 1024,
+            'uss': (fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)) / 1024,
+        }
+    except OSError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process(pid).memory_full_info()
+        return {'rss': info.rss / 2 ** 20, 'pss': getattr(info, 'pss', 0) / 2 ** 20, 'uss': info.uss / 2 ** 20}
+    except Exception:
+        return None
+
+
+def log_memory_report(workers):
+    """
+    workers: {индекс: pid}. Пишет в лог USS/PSS/RSS каждого воркера и родителя.
+    """
+    rows = [('parent', os.getpid())] + sorted(workers.items())
+    total_uss = 0.0
+    for name, pid in rows:
+        mem = process_memory(pid)
+        if mem is None:
+            logger.info(f'[MEMORY] {name} (pid {pid}): нет данных')
+            continue
+        total_uss += mem['uss']
+        logger.info(f'[MEMORY] {name} (pid {pid}): USS={mem["uss"]:.0f} МБ, PSS={mem["pss"]:.0f} МБ, RSS={mem["rss"]:.0f} МБ')
+    logger.info(f'[MEMORY] Суммарная уникальная память (USS): {total_uss:.0f} МБ')
+
+
+def run_forked_workers(workers, target, preload=None, memory_report_interval=60):
+    """
+    Вызывает preload() в родителе, затем запускает target(worker_index, workers) в workers форкнутых процессах.
+    Родитель пишет отчёт о памяти каждые memory_report_interval секунд и ждёт завершения воркеров.
+    SIGINT/SIGTERM родителя пересылаются воркерам.
+    """
+    import signal
+
+    if preload:
+        preload()
+    # Объекты, созданные до fork, больше не трогаются сборщиком мусора — их страницы не копируются
+    gc.freeze()
+    ctx = multiprocessing.get_context('fork')
+    procs = {}
+    for index in range(workers):
+        proc = ctx.Process(target=target, args=(index, workers), name=f'worker-{index}')
+        proc.start()
+        procs[index] = proc
+    logger.info(f'[WORKERS] Запущено воркеров: {workers} (pid: {[p.pid for p in procs.values()]})')
+
+    def forward_signal(signum, frame):
+        for proc in procs.values():
+            if proc.is_alive():
+                os.kill(proc.pid, signum)
+    signal.signal(signal.SIGINT, forward_signal)
+    signal.signal(signal.SIGTERM, forward_signal)
+
+    next_report = time.monotonic() + min(10, memory_report_interval)
+    while any(proc.is_alive() for proc in procs.values()):
+        for proc in procs.values():
+            proc.join(timeout=1)
+        if memory_report_interval and time.monotonic() >= next_report:
+            log_memory_report({i: p.pid for i, p in procs.items() if p.is_alive()})
+            next_report = time.monotonic() + memory_report_interval
+    for index, proc in procs.items():
+        if proc.exitcode:
+            logger.error(f'[WORKERS] Воркер {index} завершился с кодом {proc.exitcode}')
+
+
+def run_process_pool(func, stages, workers, start_method='fork', initializer=None, initargs=()):
+    """
+    Пакетная обработка: func(item) для каждого элемента в пуле из workers процессов.
+    stages — список этапов (списков элементов): этап начинается, когда завершён предыдущий; пул общий.
+    initializer вызывается один раз в каждом процессе. Возвращает результаты всех этапов по порядку.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if start_method == 'fork':
+        gc.freeze()
+    ctx = multiprocessing.get_context(start_method)
+    total = sum(len(stage) for stage in stages)
+    workers = max(1, min(workers, total))
+    logger.info(f'[WORKERS] Пул из {workers} процессов ({start_method}), задач: {total}, этапов: {len(stages)}')
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=initializer, initargs=initargs) as pool:
+        for stage in stages:
+            results += list(pool.map(func, stage))
+    return results